@@ -0,0 +1,104 @@
+
+# ASYNCHRONOUS WRITER
+# The outputs are written by a bounded pool of background threads while the computation goes on.
+# The arrays are handed over to the writer, not copied: after submitting a write the caller must not
+# modify them (the processing stages are out of place). At most max_pending writes wait at a time;
+# beyond that, submit blocks until one is done (back-pressure, bounded memory). flush waits for all
+# the pending writes of the writer and raises the first error. The writers of a process share the
+# threads and the pending limit, but each keeps its own pending writes.
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class asyncWriter:
+
+    def __init__(self, workers=2, max_pending=8, shared=None):
+        '''
+        :param workers: background writer threads (0: synchronous writes)
+        :param max_pending: maximum number of writes queued or running
+        :param shared: asyncWriter whose threads and pending limit are used (None: own ones). Each
+                       writer only waits for its own writes (flush), whatever the threads
+        '''
+        if shared is None:
+            self.pool = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+            self.slots = threading.BoundedSemaphore(max(max_pending, 1))
+        else:
+            self.pool = shared.pool
+            self.slots = shared.slots
+        self.owner = shared is None
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def submit(self, func, *args, **kwargs):
+        '''
+        Queue a write, func(*args, **kwargs). Blocks while max_pending writes are pending.
+        The arguments are owned by the writer until the write is done.
+        :param func: write function (e.g. writeToa)
+        :return: NA
+        '''
+        if self.pool is None:
+            func(*args, **kwargs)
+            return
+
+        self.slots.acquire()
+        try:
+            future = self.pool.submit(func, *args, **kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda f: self.slots.release())
+        with self.lock:
+            self.pending.append(future)
+
+    def flush(self):
+        '''
+        Wait for all the pending writes of this writer (barrier). Raises the first error of the writes.
+        :return: NA
+        '''
+        with self.lock:
+            pending, self.pending = self.pending, []
+        error = None
+        for future in pending:
+            exc = future.exception()
+            if exc is not None and error is None:
+                error = exc
+        if error is not None:
+            raise error
+
+    def close(self):
+        '''
+        Flush and stop the writer threads (if they are not shared)
+        :return: NA
+        '''
+        try:
+            self.flush()
+        finally:
+            if self.pool is not None and self.owner:
+                self.pool.shutdown(wait=True)
+
+# Threads of the writers of a process, created on the first call (the threads do not survive a fork:
+# one per process), and the writer of each key (e.g. output folder and module): the modules of a run
+# share a writer, and concurrent runs only wait for their own writes
+_writerPool = None
+_writerPid = None
+_writers = {}
+_writerLock = threading.Lock()
+
+def backgroundWriter(workers=2, max_pending=8, key=None):
+    '''
+    Writer of a key over the threads shared by the process, created on the first call
+    :param workers: background writer threads of the process (0: synchronous writes)
+    :param max_pending: maximum number of writes queued or running in the process
+    :param key: key of the writer (e.g. output folder and module). The same key gives the same writer
+    :return: asyncWriter
+    '''
+    global _writerPool, _writerPid
+    with _writerLock:
+        if _writerPool is None or _writerPid != os.getpid():
+            _writerPool = asyncWriter(workers, max_pending)
+            _writerPid = os.getpid()
+            _writers.clear()
+        if key not in _writers:
+            _writers[key] = asyncWriter(shared=_writerPool)
+        return _writers[key]
@@ -0,0 +1,83 @@
+
+from netCDF4 import Dataset
+import numpy as np
+import hashlib
+import os
+from common.io.ncLock import ncLocked
+
+def isrfCacheKey(isrfncfile, sgm_wv):
+    '''
+    Key of the cached spectral weights of one band.
+    Covers the content of the ISRF file (and thus its wavelength step)
+    and the wavelength grid of the input cube.
+    :param isrfncfile: ISRF netCDF file
+    :param sgm_wv: wavelengths of the input TOA cube
+    :return: hexadecimal key
+    '''
+    sha = hashlib.sha1()
+    with open(isrfncfile, 'rb') as fid:
+        for chunk in iter(lambda: fid.read(1 << 20), b''):
+            sha.update(chunk)
+    sha.update(np.ascontiguousarray(sgm_wv, dtype=np.float64).tobytes())
+    return sha.hexdigest()
+
+@ncLocked
+def readIsrfCache(cachedir, band, key):
+    '''
+    Reads the cached spectral weights of one band
+    :param cachedir: cache directory
+    :param band: band
+    :param key: expected key (see isrfCacheKey)
+    :return: weights over the input wavelength grid, or None if missing or stale
+    '''
+    ncfile = os.path.join(cachedir, 'isrf_weights_' + band + '.nc')
+    if not os.path.isfile(ncfile):
+        return None
+
+    dset = Dataset(ncfile)
+    if dset.getncattr('key') != key:
+        dset.close()
+        print('Stale ISRF cache ' + ncfile)
+        return None
+
+    weights = np.zeros(int(dset.getncattr('nwv')))
+    i0 = int(dset.getncattr('i0'))
+    window = np.array(dset.variables['weights'][:], dtype=np.float64)
+    weights[i0:i0 + window.size] = window
+    dset.close()
+    print('Reading ISRF cache ' + ncfile)
+
+    return weights
+
+@ncLocked
+def writeIsrfCache(cachedir, band, key, weights, isrf_step):
+    '''
+    Writes the spectral weights of one band (only the non-zero window)
+    :param cachedir: cache directory
+    :param band: band
+    :param key: key (see isrfCacheKey)
+    :param weights: weights over the input wavelength grid
+    :param isrf_step: wavelength step of the ISRF [nm]
+    :return: NA
+    '''
+    os.makedirs(cachedir, exist_ok=True)
+    ncfile = os.path.join(cachedir, 'isrf_weights_' + band + '.nc')
+
+    nz = np.flatnonzero(weights)
+    i0, i1 = (nz[0], nz[-1] + 1) if nz.size else (0, 0)
+
+    # Write to a temporary file first so that concurrent readers never see a partial entry
+    tmpfile = ncfile + '.' + str(os.getpid()) + '.tmp'
+    ncout = Dataset(tmpfile, 'w', format='NETCDF4')
+    ncout.createDimension('n_wavelengths', i1 - i0)
+    wvar = ncout.createVariable('weights', 'float64', ('n_wavelengths',))
+    wvar.description = "ISRF spectral weights over the input wavelength grid"
+    wvar[:] = weights[i0:i1]
+    ncout.setncattr('key', key)
+    ncout.setncattr('nwv', len(weights))
+    ncout.setncattr('i0', int(i0))
+    ncout.setncattr('isrf_step', float(isrf_step))
+    ncout.close()
+    os.replace(tmpfile, ncfile)
+
+    print("Finished writing: " + ncfile)
@@ -4,7 +4,9 @@ import numpy as np
 import os
 import sys
 from common.io.mkdirOutputdir import mkdirOutputdir
+from common.io.ncLock import ncLocked
 
+@ncLocked
 def writeL1c(outputdir, name, lat, lon, toa):
 
     # Check output directory
@@ -40,6 +42,7 @@ def writeL1c(outputdir, name, lat, lon, toa):
 
     print("Finished writting: " + savetostr)
 
+@ncLocked
 def readL1c(directory, filename):
 
     # concatenate filename and check that it exists
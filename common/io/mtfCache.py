@@ -0,0 +1,104 @@
+
+from netCDF4 import Dataset
+import numpy as np
+import hashlib
+import os
+from common.io.ncLock import ncLocked
+
+def mtfCacheKey(*params):
+    '''
+    Key of a cached system MTF: hash of the image shape, the band wavelength
+    and the optics parameters it was computed with
+    :param params: parameters of the system MTF (numbers)
+    :return: hexadecimal key
+    '''
+    return hashlib.sha1(repr(tuple(float(p) for p in params)).encode()).hexdigest()
+
+@ncLocked
+def readMtfCache(cachedir, key):
+    '''
+    Reads a cached system MTF
+    :param cachedir: cache directory
+    :param key: key (see mtfCacheKey)
+    :return: Hsys, or None if not in the cache
+    '''
+    ncfile = os.path.join(cachedir, 'mtf_' + key + '.nc')
+    if not os.path.isfile(ncfile):
+        return None
+
+    # The entry may be evicted (by another process) in between
+    try:
+        dset = Dataset(ncfile)
+    except OSError:
+        return None
+    Hsys = np.array(dset.variables['Hsys'][:])
+    dset.close()
+    print('Reading MTF cache ' + ncfile)
+
+    # Recently used (see pruneMtfCache)
+    try:
+        os.utime(ncfile)
+    except OSError:
+        pass
+
+    return Hsys
+
+@ncLocked
+def writeMtfCache(cachedir, key, Hsys, max_bytes=None):
+    '''
+    Writes a system MTF to the cache, evicting the least recently used entries
+    to keep the cache within max_bytes
+    :param cachedir: cache directory
+    :param key: key (see mtfCacheKey)
+    :param Hsys: system MTF
+    :param max_bytes: size limit of the cache [bytes] (None: no limit)
+    :return: NA
+    '''
+    if max_bytes is not None and Hsys.nbytes > max_bytes:
+        return
+    os.makedirs(cachedir, exist_ok=True)
+    ncfile = os.path.join(cachedir, 'mtf_' + key + '.nc')
+
+    # Write to a temporary file first so that concurrent readers never see a partial entry
+    tmpfile = ncfile + '.' + str(os.getpid()) + '.tmp'
+    ncout = Dataset(tmpfile, 'w', format='NETCDF4')
+    ncout.createDimension('alt_lines', Hsys.shape[0])
+    ncout.createDimension('act_columns', Hsys.shape[1])
+    var = ncout.createVariable('Hsys', 'float64', ('alt_lines', 'act_columns',))
+    var[:] = Hsys
+    ncout.setncattr('key', key)
+    ncout.close()
+    os.replace(tmpfile, ncfile)
+
+    print("Finished writing: " + ncfile)
+
+    if max_bytes is not None:
+        pruneMtfCache(cachedir, max_bytes)
+
+def pruneMtfCache(cachedir, max_bytes):
+    '''
+    Removes the least recently used entries (oldest modification time, updated
+    on every read) until the cache takes at most max_bytes
+    :param cachedir: cache directory
+    :param max_bytes: size limit of the cache [bytes]
+    :return: NA
+    '''
+    entries = []
+    for name in os.listdir(cachedir):
+        if name.startswith('mtf_') and name.endswith('.nc'):
+            try:
+                st = os.stat(os.path.join(cachedir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cachedir, name))
+            print('Evicted from the MTF cache ' + name)
+        except FileNotFoundError:
+            pass
+        total -= size
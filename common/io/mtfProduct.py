@@ -0,0 +1,123 @@
+
+from netCDF4 import Dataset
+import numpy as np
+import os
+import sys
+from common.io.mkdirOutputdir import mkdirOutputdir
+from common.io.ncLock import ncLocked
+
+# 2D contributors of the system MTF, in the order they are multiplied
+MTF_MAPS = ['Hdiff', 'Hdefoc', 'Hwfe', 'Hdet', 'Hsmear', 'Hmotion', 'Hsys']
+
+@ncLocked
+def writeMtf(outputdir, name, H, fnAct, fnAlt, chunk_lines=256):
+    '''
+    Writes the system MTF and its contributors of one band in a single
+    chunked and compressed NC file
+    :param outputdir: output directory
+    :param name: name of the file
+    :param H: dictionary with the 2D MTFs (see MTF_MAPS)
+    :param fnAct: normalised frequencies ACT (f/(1/w))
+    :param fnAlt: normalised frequencies ALT (f/(1/w))
+    :param chunk_lines: ALT lines per chunk
+    :return: NA
+    '''
+
+    # Check output directory
+    mkdirOutputdir(outputdir)
+
+    # MTF filename
+    savetostr = os.path.join(outputdir, name + '.nc')
+
+    # open a netCDF file to write
+    ncout = Dataset(savetostr, 'w', format='NETCDF4')
+
+    # define axis size
+    nlines, ncolumns = len(fnAlt), len(fnAct)
+    ncout.createDimension('alt_lines', nlines)
+    ncout.createDimension('act_columns', ncolumns)
+
+    # create variable arrays
+    chunks = (min(chunk_lines, nlines), ncolumns)
+    for key in MTF_MAPS:
+        var = ncout.createVariable(key, 'float32', ('alt_lines', 'act_columns',),
+                                   zlib=True, complevel=4, shuffle=True, chunksizes=chunks)
+        var[:] = H[key]
+    var = ncout.createVariable('fnAlt', 'float32', ('alt_lines',))
+    var.description = "Normalised frequencies ALT (f/(1/w))"
+    var[:] = fnAlt
+    var = ncout.createVariable('fnAct', 'float32', ('act_columns',))
+    var.description = "Normalised frequencies ACT (f/(1/w))"
+    var[:] = fnAct
+
+    # close files
+    ncout.close()
+
+    print("Finished writting: " + savetostr)
+
+@ncLocked
+def readMtf(directory, filename):
+    '''
+    Reads the MTF product of one band
+    :param directory: directory
+    :param filename: MTF filename
+    :return: dictionary with the 2D MTFs (see MTF_MAPS), fnAct and fnAlt
+    '''
+    ncfile = os.path.join(directory, filename)
+    if not os.path.isfile(ncfile):
+        sys.exit('File not found ' +ncfile + ". Exiting.")
+    print('Reading ' + ncfile)
+
+    # Load dataset
+    dset = Dataset(ncfile)
+
+    # Extract data from NetCDF file
+    H = {}
+    for key in MTF_MAPS + ['fnAct', 'fnAlt']:
+        H[key] = np.array(dset.variables[key][:])
+    dset.close()
+
+    return H
+
+@ncLocked
+def writeMtfExplorer(outputdir, name, params, fnAlt, fnAct, H):
+    '''
+    Writes the results of the MTF trade-space explorer (see ism/src/mtfExplorer.py)
+    :param outputdir: output directory
+    :param name: name of the file
+    :param params: dictionary parameter name -> value per point (or scalar)
+    :param fnAlt: normalised frequencies ALT (f/(1/w)) of the evaluation points
+    :param fnAct: normalised frequencies ACT (f/(1/w)) of the evaluation points
+    :param H: dictionary with the MTFs, of size points x frequencies
+    :return: NA
+    '''
+
+    # Check output directory
+    mkdirOutputdir(outputdir)
+
+    savetostr = os.path.join(outputdir, name + '.nc')
+    ncout = Dataset(savetostr, 'w', format='NETCDF4')
+
+    npoints, nfreq = next(iter(H.values())).shape
+    ncout.createDimension('points', npoints)
+    ncout.createDimension('frequencies', nfreq)
+
+    # Parameters of each point
+    for key, value in params.items():
+        var = ncout.createVariable(key, 'float64', ('points',))
+        var[:] = np.broadcast_to(np.asarray(value, dtype=float), (npoints,))
+    var = ncout.createVariable('fnAlt', 'float64', ('frequencies',))
+    var.description = "Normalised frequencies ALT (f/(1/w))"
+    var[:] = fnAlt
+    var = ncout.createVariable('fnAct', 'float64', ('frequencies',))
+    var.description = "Normalised frequencies ACT (f/(1/w))"
+    var[:] = fnAct
+
+    # MTFs
+    for key, value in H.items():
+        var = ncout.createVariable(key, 'float32', ('points', 'frequencies',), zlib=True, complevel=4)
+        var[:] = value
+
+    ncout.close()
+
+    print("Finished writting: " + savetostr)
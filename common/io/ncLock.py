@@ -0,0 +1,22 @@
+
+# LOCK OF THE NETCDF/HDF5 LIBRARY
+# netCDF4 releases the GIL in its calls, but the HDF5 library underneath is not thread-safe.
+# The netCDF I/O functions hold this process-wide lock, so that modules can run concurrently
+# in threads: their computations overlap, their netCDF calls do not.
+
+import threading
+import functools
+
+NC_LOCK = threading.RLock()
+
+def ncLocked(func):
+    '''
+    Decorator of the netCDF I/O functions: the function runs holding NC_LOCK
+    :param func: function
+    :return: wrapped function
+    '''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with NC_LOCK:
+            return func(*args, **kwargs)
+    return wrapper
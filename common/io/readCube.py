@@ -3,7 +3,9 @@ import numpy as np
 import os
 import sys
 from common.io.mkdirOutputdir import mkdirOutputdir
+from common.io.ncLock import ncLocked
 
+@ncLocked
 def readCube(directory, filename):
 
     # concatenate filename and check that it exists
@@ -14,6 +16,7 @@ def readCube(directory, filename):
 
     # Load dataset
     dset = Dataset(ncfile)
+    dset.set_auto_mask(False) # plain arrays, no masked-array copy
 
     # Extract data from NetCDF file
     toa = np.array(dset.variables['toa'][:])
@@ -23,6 +26,55 @@ def readCube(directory, filename):
     
     return toa, wv
 
+@ncLocked
+def readCubeInfo(directory, filename):
+    '''
+    Reads only the wavelengths and the shape of a TOA cube
+    :param directory: directory
+    :param filename: cube filename
+    :return: wavelengths [nm] and shape of the cube (ALT x ACT x wavelengths)
+    '''
+    ncfile = os.path.join(directory, filename)
+    if not os.path.isfile(ncfile):
+        sys.exit('File not found ' +ncfile + ". Exiting.")
+
+    dset = Dataset(ncfile)
+    wv = np.array(dset.variables['wv'][:])
+    shape = dset.variables['toa'].shape
+    dset.close()
+
+    return wv, shape
+
+@ncLocked
+def readCubeWindow(directory, filename, i0, i1, lines=None):
+    '''
+    Reads the spectral window [i0, i1) of a TOA cube (hyperslab read,
+    only that slice of the wavelengths is read from disk), in the dtype of the file
+    :param directory: directory
+    :param filename: cube filename
+    :param i0: first wavelength index
+    :param i1: last wavelength index + 1
+    :param lines: slice of the lines ALT to read (None for all)
+    :return: TOA cube ALT x ACT x (i1-i0)
+    '''
+    ncfile = os.path.join(directory, filename)
+    if not os.path.isfile(ncfile):
+        sys.exit('File not found ' +ncfile + ". Exiting.")
+    if lines is None:
+        lines = slice(None)
+        print('Reading ' + ncfile + ' wavelengths [' + str(i0) + ':' + str(i1) + ']')
+    else:
+        print('Reading ' + ncfile + ' lines [' + str(lines.start) + ':' + str(lines.stop) +
+              '] wavelengths [' + str(i0) + ':' + str(i1) + ']')
+
+    dset = Dataset(ncfile)
+    dset.set_auto_mask(False)
+    toa = dset.variables['toa'][lines, :, i0:i1]
+    dset.close()
+
+    return toa
+
+@ncLocked
 def writeCube(directory, filename, toa, wv):
 
     # Check output directory
@@ -0,0 +1,74 @@
+from netCDF4 import Dataset
+import numpy as np
+import os
+import sys
+from common.io.mkdirOutputdir import mkdirOutputdir
+from common.src.pcaCube import pcaCube
+from common.io.ncLock import ncLocked
+
+@ncLocked
+def readCubePca(directory, filename):
+
+    # concatenate filename and check that it exists
+    ncfile = os.path.join(directory, filename)
+    if not os.path.isfile(ncfile):
+        sys.exit('File not found ' +ncfile + ". Exiting.")
+    print('Reading ' + ncfile)
+
+    # Load dataset
+    dset = Dataset(ncfile)
+
+    # Extract data from NetCDF file
+    scores = np.array(dset.variables['scores'][:])
+    basis = np.array(dset.variables['basis'][:], dtype=np.float64)
+    mean = np.array(dset.variables['mean'][:], dtype=np.float64)
+    wv = np.array(dset.variables['wv'][:])
+    dset.close()
+
+    cube = pcaCube(scores, basis, mean)
+    print('Size of cube ' + str(cube.shape) + ', compressed with ' + str(basis.shape[0]) + ' components')
+
+    return cube, wv
+
+@ncLocked
+def writeCubePca(directory, filename, cube, wv):
+
+    # Check output directory
+    mkdirOutputdir(directory)
+
+    # TOA filename
+    savetostr = os.path.join(directory, filename + '.nc')
+
+    # open a netCDF file to write
+    ncout = Dataset(savetostr, 'w', format='NETCDF4')
+
+    # define axis size
+    ncout.createDimension('n_lines', cube.scores.shape[0])
+    ncout.createDimension('n_columns', cube.scores.shape[1])
+    ncout.createDimension('n_components', cube.basis.shape[0])
+    ncout.createDimension('n_wavelengths', cube.basis.shape[1])
+
+    # create variable array
+    scores = ncout.createVariable('scores', 'float32',
+                                  ('n_lines', 'n_columns', 'n_components',), zlib=True)
+    scores.units = 'mW/sr/m2/nm'
+    scores.description = "Scores of the TOA spectral radiances on the spectral basis"
+    basis = ncout.createVariable('basis', 'float64', ('n_components', 'n_wavelengths',))
+    basis.description = "Spectral basis (principal components)"
+    mean = ncout.createVariable('mean', 'float64', ('n_wavelengths',))
+    mean.units = 'mW/sr/m2/nm'
+    mean.description = "Mean TOA spectral radiance"
+    wavelengths = ncout.createVariable('wv', 'float32', ('n_wavelengths',))
+    wavelengths.units = 'nm'
+    wavelengths.description = "Wavelengths in nanometers"
+
+    # Assign data
+    scores[:]       = cube.scores[:]
+    basis[:]        = cube.basis[:]
+    mean[:]         = cube.mean[:]
+    wavelengths[:]  = wv[:]
+
+    # close files
+    ncout.close()
+
+    print("Finished writting: " + savetostr)
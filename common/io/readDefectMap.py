@@ -0,0 +1,70 @@
+
+from netCDF4 import Dataset
+import numpy as np
+import hashlib
+import os
+from common.io.ncLock import ncLocked
+
+def defectMapKey(ncolumns, bad_pix, dead_pix, bad_pix_red, dead_pix_red, seed):
+    '''
+    Key of a defect map: hash of the number of columns, the configuration and the seed
+    :return: hexadecimal key
+    '''
+    params = (int(ncolumns), float(bad_pix), float(dead_pix), float(bad_pix_red), float(dead_pix_red), int(seed))
+    return hashlib.sha1(repr(params).encode()).hexdigest()
+
+@ncLocked
+def readDefectMap(directory, filename, key=None):
+    '''
+    Reads a defect map
+    :param directory: directory
+    :param filename: defect map filename
+    :param key: expected key (see defectMapKey). None to accept any
+    :return: columns, factors; or None if the file is missing or has another key
+    '''
+    ncfile = os.path.join(directory, filename)
+    if not os.path.isfile(ncfile):
+        return None
+
+    dset = Dataset(ncfile)
+    if key is not None and dset.getncattr('key') != key:
+        dset.close()
+        return None
+    columns = np.array(dset.variables['columns'][:])
+    factors = np.array(dset.variables['factors'][:])
+    dset.close()
+    print('Reading ' + ncfile)
+
+    return columns, factors
+
+@ncLocked
+def writeDefectMap(directory, filename, columns, factors, key, ncolumns):
+    '''
+    Writes a defect map
+    :param directory: directory
+    :param filename: defect map filename
+    :param columns: defective columns
+    :param factors: factor per defective column [-]
+    :param key: key (see defectMapKey)
+    :param ncolumns: number of columns ACT of the detector
+    :return: NA
+    '''
+    os.makedirs(directory, exist_ok=True)
+    ncfile = os.path.join(directory, filename)
+
+    # Write to a temporary file first so that concurrent readers never see a partial file
+    tmpfile = ncfile + '.' + str(os.getpid()) + '.tmp'
+    ncout = Dataset(tmpfile, 'w', format='NETCDF4')
+    ncout.createDimension('defects', len(columns))
+    var = ncout.createVariable('columns', 'int32', ('defects',))
+    var.description = "Defective ACT columns"
+    var[:] = columns
+    var = ncout.createVariable('factors', 'float64', ('defects',))
+    var.description = "Multiplicative factor of the defective columns (1 - reduction of the QE)"
+    var[:] = factors
+    ncout.setncattr('key', key)
+    ncout.setncattr('act_columns', ncolumns)
+    ncout.close()
+    os.replace(tmpfile, ncfile)
+
+    print("Finished writting: " + ncfile)
@@ -4,11 +4,13 @@ import numpy as np
 import sys
 import os
 from common.io.mkdirOutputdir import mkdirOutputdir
+from common.io.ncLock import ncLocked
 
 EQ_MULT = "equalization_multiplicative_factor"
 EQ_ADD = "equalization_additive_factor"
 NC_EXT = ".nc"
 
+@ncLocked
 def readFactor(ncfile, varname):
     '''
     Reading a variable from a TOA
@@ -32,6 +34,7 @@ def readFactor(ncfile, varname):
 
     return gain
 
+@ncLocked
 def writeFactor(outputdir, name, gain, varname, varunis, vardescript):
     '''
     Writes a NC file for a 1D variable (a function of the pixels)
@@ -2,7 +2,9 @@ from netCDF4 import Dataset
 import numpy as np
 import os
 import sys
+from common.io.ncLock import ncLocked
 
+@ncLocked
 def readGeodetic(directory, filename):
     '''
     Reads the output geodetic file from the GM
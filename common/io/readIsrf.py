@@ -1,6 +1,8 @@
 from netCDF4 import Dataset
 import numpy as np
+from common.io.ncLock import ncLocked
 
+@ncLocked
 def readIsrf(isrffile, b):
 
     ncfile = isrffile + b + '.nc'
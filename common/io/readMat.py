@@ -3,7 +3,9 @@ import numpy as np
 import os
 import sys
 from common.io.mkdirOutputdir import mkdirOutputdir
+from common.io.ncLock import ncLocked
 
+@ncLocked
 def readMat(directory, filename):
 
     ncfile = os.path.join(directory, filename)
@@ -21,6 +23,7 @@ def readMat(directory, filename):
     
     return mat
 
+@ncLocked
 def writeMat(outputdir, name, mat):
 
     # Check output directory
@@ -1,11 +1,56 @@
-
 from netCDF4 import Dataset
 import numpy as np
 import os
 import sys
 from common.io.mkdirOutputdir import mkdirOutputdir
+from common.io.ncLock import ncLocked
+
+# Storage formats of the TOA
+TOA_FLOAT32 = 'float32'   # float32, uncompressed
+TOA_UINT16 = 'uint16'     # integer DN, uint16 with zlib compression
+TOA_PACKED12 = 'packed12' # integer DN of 12 bits, two samples in three bytes per row (uint8)
+
+def packDn12(toa):
+    '''
+    Packs 12-bit digital numbers row by row: two samples in three bytes
+    :param toa: TOA in DN (ALT x ACT), integers in [0, 4095]
+    :return: packed TOA (ALT x ceil(ACT/2)*3) uint8
+    '''
+    dn = np.asarray(toa, dtype=np.uint16)
+    if dn.shape[1] % 2:
+        dn = np.pad(dn, ((0, 0), (0, 1)))
+    a = dn[:, 0::2]
+    b = dn[:, 1::2]
+    packed = np.empty((dn.shape[0], a.shape[1], 3), dtype=np.uint8)
+    packed[:, :, 0] = a & 0xFF
+    packed[:, :, 1] = (a >> 8) | ((b & 0x0F) << 4)
+    packed[:, :, 2] = b >> 4
+    return packed.reshape(dn.shape[0], -1)
 
-def writeToa(outputdir, name, toa):
+def unpackDn12(packed, ncolumns):
+    '''
+    Unpacks 12-bit digital numbers packed with packDn12
+    :param packed: packed TOA (ALT x ceil(ACT/2)*3) uint8
+    :param ncolumns: number of columns ACT
+    :return: TOA in DN (ALT x ACT) uint16
+    '''
+    p = packed.reshape(packed.shape[0], -1, 3).astype(np.uint16)
+    dn = np.empty((packed.shape[0], p.shape[1] * 2), dtype=np.uint16)
+    dn[:, 0::2] = p[:, :, 0] | ((p[:, :, 1] & 0x0F) << 8)
+    dn[:, 1::2] = (p[:, :, 1] >> 4) | (p[:, :, 2] << 4)
+    return dn[:, :ncolumns]
+
+@ncLocked
+def writeToa(outputdir, name, toa, fmt=TOA_FLOAT32):
+    '''
+    Writes a TOA image
+    :param outputdir: output directory
+    :param name: name of the file (without extension)
+    :param toa: TOA (ALT x ACT)
+    :param fmt: storage format (TOA_FLOAT32, TOA_UINT16 or TOA_PACKED12). The integer formats
+                are for digital numbers: the values are rounded and must fit in the format
+    :return: NA
+    '''
 
     # Check output directory
     mkdirOutputdir(outputdir)
@@ -13,26 +58,120 @@ def writeToa(outputdir, name, toa):
     # TOA filename
     savetostr = os.path.join(outputdir, name + '.nc')
 
+    # Integer formats
+    toa = formatToa(toa, fmt)
+
     # open a netCDF file to write
     ncout = Dataset(savetostr, 'w', format='NETCDF4')
-    
+
     # define axis size
-    ncout.createDimension('alt_lines', toa.shape[0])  # unlimited
+    ncout.createDimension('alt_lines', toa.shape[0])
     ncout.createDimension('act_columns', toa.shape[1])
 
-    # create variable array
-    floris_toa_scene = ncout.createVariable('toa', 'float32',
-                                            ('alt_lines', 'act_columns',))
+    # create variable array and assign data
+    floris_toa_scene = toaVariable(ncout, fmt)
+    floris_toa_scene[:] = packDn12(toa) if fmt == TOA_PACKED12 else toa[:]
 
-    # Assign data
-    floris_toa_scene[:]         = toa[:]
-    
     # close files
     ncout.close()
 
     print("Finished writting: " + savetostr)
 
+def formatToa(toa, fmt):
+    '''
+    Rounds the TOA for the integer formats and checks that it fits in the format
+    :param toa: TOA (ALT x ACT)
+    :param fmt: storage format
+    :return: TOA
+    '''
+    if fmt == TOA_FLOAT32:
+        return toa
+    maxval = {TOA_UINT16: 2 ** 16 - 1, TOA_PACKED12: 2 ** 12 - 1}[fmt]
+    toa = np.rint(toa)
+    if toa.size and (toa.min() < 0 or toa.max() > maxval):
+        raise Exception('TOA out of the range of the format ' + fmt + ' [0, ' + str(maxval) + ']')
+    return toa
+
+def toaVariable(ncout, fmt, chunk_lines=None):
+    '''
+    Creates the TOA variable of a file with the dimensions alt_lines and act_columns
+    :param ncout: netCDF dataset
+    :param fmt: storage format
+    :param chunk_lines: lines ALT per chunk (None for the netCDF default)
+    :return: variable
+    '''
+    ncolumns = len(ncout.dimensions['act_columns'])
+    if fmt == TOA_PACKED12:
+        nbytes = (ncolumns + 1) // 2 * 3
+        ncout.createDimension('packed_bytes', nbytes)
+        var = ncout.createVariable('toa', 'u1', ('alt_lines', 'packed_bytes',),
+                                   zlib=True, complevel=4,
+                                   chunksizes=None if chunk_lines is None else (chunk_lines, nbytes))
+        var.encoding = TOA_PACKED12
+    elif fmt == TOA_UINT16:
+        var = ncout.createVariable('toa', 'u2', ('alt_lines', 'act_columns',),
+                                   zlib=True, complevel=4, shuffle=True,
+                                   chunksizes=None if chunk_lines is None else (chunk_lines, ncolumns))
+    else:
+        var = ncout.createVariable('toa', 'float32', ('alt_lines', 'act_columns',),
+                                   chunksizes=None if chunk_lines is None else (chunk_lines, ncolumns))
+    return var
+
+@ncLocked
+def createToa(outputdir, name, ncolumns, fmt=TOA_FLOAT32, chunk_lines=64):
+    '''
+    Creates a TOA file to be written in blocks of lines ALT (see appendToa), with
+    an unlimited ALT dimension. Same layout as the files of writeToa
+    :param outputdir: output directory
+    :param name: name of the file (without extension)
+    :param ncolumns: number of columns ACT
+    :param fmt: storage format (see writeToa)
+    :param chunk_lines: lines ALT per chunk of the file
+    :return: netCDF dataset, to be closed with closeToa
+    '''
+    mkdirOutputdir(outputdir)
+    savetostr = os.path.join(outputdir, name + '.nc')
+
+    ncout = Dataset(savetostr, 'w', format='NETCDF4')
+    ncout.createDimension('alt_lines', None)  # unlimited
+    ncout.createDimension('act_columns', ncolumns)
+    toaVariable(ncout, fmt, chunk_lines)
+    ncout.toa_format = fmt
+
+    return ncout
+
+@ncLocked
+def appendToa(ncout, toa):
+    '''
+    Appends a block of lines ALT to a TOA file created with createToa
+    :param ncout: netCDF dataset
+    :param toa: TOA block (lines x ACT)
+    :return: NA
+    '''
+    fmt = ncout.toa_format
+    toa = formatToa(toa, fmt)
+    ialt = len(ncout.dimensions['alt_lines'])
+    ncout.variables['toa'][ialt:ialt + toa.shape[0]] = packDn12(toa) if fmt == TOA_PACKED12 else toa
+
+@ncLocked
+def closeToa(ncout):
+    '''
+    Closes a TOA file created with createToa
+    :param ncout: netCDF dataset
+    :return: NA
+    '''
+    savetostr = ncout.filepath()
+    ncout.close()
+    print("Finished writting: " + savetostr)
+
+@ncLocked
 def readToa(directory, filename):
+    '''
+    Reads a TOA image. The integer formats are converted back to float32
+    :param directory: directory
+    :param filename: TOA filename
+    :return: TOA (ALT x ACT)
+    '''
 
     # concatenate filename and check that it exists
     ncfile = os.path.join(directory, filename)
@@ -42,9 +181,14 @@ def readToa(directory, filename):
 
     # Load dataset
     dset = Dataset(ncfile)
+    var = dset.variables['toa']
+    var.set_auto_mask(False)
 
     # Extract data from NetCDF file
-    toa = np.array(dset.variables['toa'][:])
+    if getattr(var, 'encoding', None) == TOA_PACKED12:
+        toa = unpackDn12(np.array(var[:]), len(dset.dimensions['act_columns'])).astype(np.float32)
+    else:
+        toa = np.array(var[:]).astype(np.float32, copy=False)
 
     dset.close()
 
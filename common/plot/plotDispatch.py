@@ -0,0 +1,102 @@
+
+# PLOT DISPATCH
+# Mode of the plots of the modules (globalConfig.plot_mode): full matplotlib figures, quicklooks
+# (see quicklook.py) or none. The plots are rendered in the processing thread, or in a pool of
+# background processes (globalConfig.plot_workers) that is flushed at the end of the modules.
+# The arrays are handed over (sent to the workers when they are free): they must not be modified.
+# At most globalConfig.plot_max_pending plots wait at a time; beyond that, submitPlot blocks until
+# one is done (back-pressure, bounded memory). The quicklooks are reduced before being submitted.
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from config.globalConfig import globalConfig
+from common.src.sharedArray import processContext
+
+PLOT_FULL = 'full'           # matplotlib figures, with titles, labels and colorbars
+PLOT_QUICKLOOK = 'quicklook' # downsampled PNG quicklooks from the arrays
+PLOT_NONE = 'none'           # no plots
+
+# Pool of the process (created on the first plot) and its pending plots
+_plotPool = None
+_plotPoolPid = None
+_plotPending = []
+_plotSlots = None
+_plotLock = threading.Lock()
+
+def plotMode():
+    """
+    Plot mode of the modules
+    :return: PLOT_FULL, PLOT_QUICKLOOK or PLOT_NONE
+    """
+    mode = globalConfig().plot_mode
+    if mode not in (PLOT_FULL, PLOT_QUICKLOOK, PLOT_NONE):
+        raise Exception('Unknown plot mode ' + str(mode))
+    return mode
+
+def submitPlot(func, *args, **kwargs):
+    """
+    Render a plot, func(*args, **kwargs), now or in the background process pool.
+    Blocks while globalConfig.plot_max_pending plots are pending
+    :param func: plot function (module level, so that it can be sent to the workers)
+    :return: NA
+    """
+    global _plotPool, _plotPoolPid, _plotSlots
+    config = globalConfig()
+    if config.plot_workers <= 0:
+        func(*args, **kwargs)
+        return
+
+    with _plotLock:
+        if _plotPool is None or _plotPoolPid != os.getpid():
+            _plotPool = ProcessPoolExecutor(max_workers=config.plot_workers, mp_context=processContext())
+            _plotPoolPid = os.getpid()
+            _plotSlots = threading.BoundedSemaphore(max(config.plot_max_pending, 1))
+            _plotPending.clear()
+        pool, slots = _plotPool, _plotSlots
+
+    slots.acquire()
+    try:
+        future = pool.submit(func, *args, **kwargs)
+    except BaseException:
+        slots.release()
+        raise
+    future.add_done_callback(lambda f: slots.release())
+    with _plotLock:
+        _plotPending.append(future)
+
+def flushPlots():
+    """
+    Wait for the plots rendered in the background. Raises the first error of the plots.
+    :return: NA
+    """
+    with _plotLock:
+        if _plotPoolPid != os.getpid():
+            return
+        pending = list(_plotPending)
+        _plotPending.clear()
+    error = None
+    for future in pending:
+        exc = future.exception()
+        if exc is not None and error is None:
+            error = exc
+    if error is not None:
+        raise error
+
+def shutdownPlots():
+    """
+    Wait for the plots rendered in the background and stop the pool of the process
+    (e.g. at the end of a worker process, which would otherwise wait for the pool at exit)
+    :return: NA
+    """
+    global _plotPool, _plotPoolPid
+    try:
+        flushPlots()
+    finally:
+        with _plotLock:
+            pool = _plotPool if _plotPoolPid == os.getpid() else None
+            if pool is not None:
+                _plotPool = None
+                _plotPoolPid = None
+        if pool is not None:
+            pool.shutdown(wait=True)
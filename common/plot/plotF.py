@@ -1,27 +1,42 @@
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import numpy as np
 import os
+from common.plot.plotDispatch import plotMode, submitPlot, PLOT_FULL, PLOT_QUICKLOOK
+from common.plot.quicklook import quicklookLines
 
 def plotF(x, y, title_str, xlabel_str, ylabel_str, directory, saveas_str):
 
-    # Diff and plot
-    fig = plt.figure(figsize=(10, 7))
+    # Full figure, quicklook or nothing, following globalConfig.plot_mode
+    savestr = directory + os.path.sep + saveas_str
+    mode = plotMode()
+    if mode == PLOT_QUICKLOOK:
+        x = np.array(x)  # In case they are not numpy arrays, convert them to those
+        y = np.array(y)
+        if y.size == 0:
+            x, y = np.array([]), x
+        submitPlot(quicklookLines, x, [y], savestr)
+    elif mode == PLOT_FULL:
+        submitPlot(figureF, x, y, title_str, xlabel_str, ylabel_str, savestr)
+
+def figureF(x, y, title_str, xlabel_str, ylabel_str, savestr):
+
+    # Diff and plot. Figure object, without the global state of pyplot (safe in concurrent modules)
+    fig = Figure(figsize=(10, 7))
+    ax = fig.subplots()
 
     x = np.array(x)  # In case they are not numpy arrays, convert them to those
     y = np.array(y)
 
     if x.size>0 and y.size>0:
-        plt.plot(x, y, '-r')
+        ax.plot(x, y, '-r')
     elif x.size == 0:
-        plt.plot(y, '-r')
+        ax.plot(y, '-r')
     elif y.size == 0:
-        plt.plot(x, '-r')
+        ax.plot(x, '-r')
 
-    plt.title(title_str, fontsize=20)
-    plt.xlabel(xlabel_str, fontsize=16)
-    plt.ylabel(ylabel_str, fontsize=16)
-    plt.grid()
-    savestr = directory + os.path.sep + saveas_str
-    plt.savefig(savestr)
-    plt.close(fig)
+    ax.set_title(title_str, fontsize=20)
+    ax.set_xlabel(xlabel_str, fontsize=16)
+    ax.set_ylabel(ylabel_str, fontsize=16)
+    ax.grid()
+    fig.savefig(savestr)
     print("Saved image " + savestr)
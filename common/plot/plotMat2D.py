@@ -1,14 +1,30 @@
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import os
+from config.globalConfig import globalConfig
+from common.plot.plotDispatch import plotMode, submitPlot, PLOT_FULL, PLOT_QUICKLOOK
+from common.plot.quicklook import quicklookMat2D, downsample
 
 def plotMat2D(mat, title_str, xlabel_str, ylabel_str, directory, saveas_str):
+
+    # Full figure, quicklook or nothing, following globalConfig.plot_mode
+    savestr = directory + os.path.sep + saveas_str + '.png'
+    mode = plotMode()
+    if mode == PLOT_QUICKLOOK:
+        # Reduced here, so that only the quicklook size is kept pending or sent to the workers
+        size = globalConfig().quicklook_size
+        submitPlot(quicklookMat2D, downsample(mat, size), savestr, size)
+    elif mode == PLOT_FULL:
+        submitPlot(figureMat2D, mat, title_str, xlabel_str, ylabel_str, savestr)
+
+def figureMat2D(mat, title_str, xlabel_str, ylabel_str, savestr):
     
-    fig, ax = plt.subplots(figsize=(20, 10))
+    # Figure object, without the global state of pyplot (safe in concurrent modules)
+    fig = Figure(figsize=(20, 10))
+    ax = fig.subplots()
     pos = ax.imshow(mat, cmap='jet', origin='lower')
     fig.colorbar(pos, ax=ax)# add the colorbar
-    plt.title(title_str, fontsize=20)    
-    plt.xlabel(xlabel_str, fontsize=16)
-    plt.ylabel(ylabel_str, fontsize=16)
-    plt.axis('equal')
-    plt.savefig(directory + os.path.sep + saveas_str +'.png')
-    plt.close(fig)
+    ax.set_title(title_str, fontsize=20)
+    ax.set_xlabel(xlabel_str, fontsize=16)
+    ax.set_ylabel(ylabel_str, fontsize=16)
+    ax.axis('equal')
+    fig.savefig(savestr)
@@ -0,0 +1,212 @@
+
+# QUICKLOOK RENDERER
+# Downsampled PNG quicklooks written straight from the arrays: values mapped to colours with a
+# colormap look-up table, lines and points rasterised with numpy, and the PNG encoded with zlib.
+# No matplotlib figure is built (no axes, labels or colorbar): a fraction of the cost of a figure.
+
+import numpy as np
+import zlib
+import struct
+import os
+import matplotlib
+
+# Colours of the quicklooks (RGB)
+QL_BACKGROUND = (255, 255, 255)
+QL_AXES = (160, 160, 160)
+QL_NAN = (0, 0, 0)
+QL_LINE_COLOURS = {'r': (255, 0, 0), 'g': (0, 128, 0), 'b': (0, 0, 255), 'k': (0, 0, 0), 'y': (191, 191, 0)}
+
+_lutCache = {}
+
+def colormapLut(name='jet', ncolours=256):
+    """
+    Look-up table of a matplotlib colormap
+    :param name: colormap name
+    :param ncolours: number of colours
+    :return: LUT (ncolours x 3) uint8
+    """
+    key = (name, ncolours)
+    if key not in _lutCache:
+        rgba = matplotlib.colormaps[name].resampled(ncolours)(np.arange(ncolours))
+        _lutCache[key] = np.round(rgba[:, :3] * 255).astype(np.uint8)
+    return _lutCache[key]
+
+def colourIndex(values, ncolours):
+    """
+    Index in the LUT of the values, scaled between their minimum and maximum
+    :param values: values (NaN allowed)
+    :param ncolours: number of colours of the LUT
+    :return: index (int), valid (not NaN) mask
+    """
+    valid = np.isfinite(values)
+    if not valid.any():
+        return np.zeros(values.shape, dtype=int), valid
+    lo, hi = values[valid].min(), values[valid].max()
+    scale = (ncolours - 1) / (hi - lo) if hi > lo else 0.
+    index = np.zeros(values.shape, dtype=int)
+    index[valid] = np.clip(np.rint((values[valid] - lo) * scale), 0, ncolours - 1)
+    return index, valid
+
+def downsample(mat, max_size):
+    """
+    Block mean of a 2D array so that no side exceeds max_size
+    :param mat: 2D array
+    :param max_size: maximum size per side [pixels]
+    :return: downsampled array
+    """
+    mat = np.asarray(mat, dtype=float)
+    factor = int(np.ceil(max(mat.shape) / max_size))
+    if factor <= 1:
+        return mat
+    nl, nc = mat.shape[0] // factor, mat.shape[1] // factor
+    if nl == 0 or nc == 0:
+        return mat[::factor, ::factor]
+    return mat[:nl * factor, :nc * factor].reshape(nl, factor, nc, factor).mean(axis=(1, 3))
+
+def writePng(filename, rgb, level=6):
+    """
+    Writes an RGB image as PNG (8 bits per channel)
+    :param filename: file name
+    :param rgb: image (lines x columns x 3) uint8
+    :param level: zlib compression level
+    :return: NA
+    """
+    nl, nc = rgb.shape[:2]
+    raw = np.empty((nl, 1 + nc * 3), dtype=np.uint8)
+    raw[:, 0] = 0 # no filter
+    raw[:, 1:] = rgb.reshape(nl, -1)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    png = b'\x89PNG\r\n\x1a\n' + \
+          chunk(b'IHDR', struct.pack('>IIBBBBB', nc, nl, 8, 2, 0, 0, 0)) + \
+          chunk(b'IDAT', zlib.compress(raw.tobytes(), level)) + \
+          chunk(b'IEND', b'')
+    with open(filename, 'wb') as f:
+        f.write(png)
+
+def pngName(savestr):
+    """
+    File name of a quicklook, with the png extension
+    """
+    return savestr if os.path.splitext(savestr)[1].lower() == '.png' else savestr + '.png'
+
+def quicklookMat2D(mat, savestr, max_size=1024, cmap='jet'):
+    """
+    Quicklook of a 2D array (first line at the bottom, as plotMat2D)
+    :param mat: 2D array
+    :param savestr: file name
+    :param max_size: maximum size per side [pixels]
+    :param cmap: colormap
+    :return: NA
+    """
+    quicklookImage(downsample(mat, max_size)[::-1], savestr, cmap)
+
+def quicklookImage(mat, savestr, cmap='jet', nan_colour=None):
+    """
+    Quicklook of a 2D array at its size, first line at the top
+    :param mat: 2D array (NaN: no data)
+    :param savestr: file name
+    :param cmap: colormap
+    :param nan_colour: RGB of the pixels without data (None: QL_NAN)
+    :return: NA
+    """
+    lut = colormapLut(cmap)
+    index, valid = colourIndex(np.asarray(mat, dtype=float), lut.shape[0])
+    rgb = lut[index]
+    rgb[~valid] = QL_NAN if nan_colour is None else nan_colour
+    writePng(pngName(savestr), rgb)
+    print("Saved quicklook " + pngName(savestr))
+
+def quicklookLines(x, curves, savestr, colours=None, size=(400, 640)):
+    """
+    Quicklook of curves y(x) sharing the axes
+    :param x: abscissae (empty for the index of the samples)
+    :param curves: list of ordinates, each of the size of x
+    :param savestr: file name
+    :param colours: colour code per curve ('r', 'g', 'b', 'k', 'y'); red by default
+    :param size: lines and columns of the image [pixels]
+    :return: NA
+    """
+    curves = [np.asarray(y, dtype=float).ravel() for y in curves]
+    x = np.asarray(x, dtype=float).ravel()
+    if x.size == 0:
+        x = np.arange(curves[0].size, dtype=float)
+    colours = colours or ['r'] * len(curves)
+
+    nl, nc = size
+    margin = 10
+    rgb = np.empty((nl, nc, 3), dtype=np.uint8)
+    rgb[:] = QL_BACKGROUND
+    rgb[[margin - 1, nl - margin], margin - 1:nc - margin + 1] = QL_AXES
+    rgb[margin - 1:nl - margin + 1, [margin - 1, nc - margin]] = QL_AXES
+
+    # Common scale of all the curves
+    ally = np.concatenate(curves)
+    ok = np.isfinite(ally)
+    ylo, yhi = (ally[ok].min(), ally[ok].max()) if ok.any() else (0., 1.)
+    xlo, xhi = np.nanmin(x), np.nanmax(x)
+    xscale = (nc - 2 * margin - 1) / (xhi - xlo) if xhi > xlo else 0.
+    yscale = (nl - 2 * margin - 1) / (yhi - ylo) if yhi > ylo else 0.
+
+    for y, colour in zip(curves, colours):
+        good = np.isfinite(x) & np.isfinite(y)
+        px = margin + (x[good] - xlo) * xscale
+        py = nl - 1 - margin - (y[good] - ylo) * yscale
+        if px.size == 0:
+            continue
+        if px.size == 1:
+            rgb[int(round(py[0])), int(round(px[0]))] = QL_LINE_COLOURS.get(colour, QL_LINE_COLOURS['r'])
+            continue
+
+        # Samples along every segment, one per pixel
+        dx, dy = np.diff(px), np.diff(py)
+        n = np.maximum(np.abs(dx), np.abs(dy)).astype(int) + 1
+        seg = np.repeat(np.arange(n.size), n)
+        t = (np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)) / np.repeat(n, n)
+        cols = np.rint(px[seg] + t * dx[seg]).astype(int)
+        rows = np.rint(py[seg] + t * dy[seg]).astype(int)
+        rgb[rows, cols] = QL_LINE_COLOURS.get(colour, QL_LINE_COLOURS['r'])
+
+    writePng(pngName(savestr), rgb)
+    print("Saved quicklook " + pngName(savestr))
+
+def scatterRaster(x, y, values, max_size=1024):
+    """
+    Raster of points (x, y) with their value, with the same scale in x and y
+    :param x: abscissae of the points (e.g. longitude)
+    :param y: ordinates of the points (e.g. latitude)
+    :param values: value per point
+    :param max_size: maximum size per side [pixels]
+    :return: 2D array, first line at the top (largest y), NaN where there are no points
+    """
+    x = np.asarray(x, dtype=float).ravel()
+    y = np.asarray(y, dtype=float).ravel()
+    values = np.asarray(values, dtype=float).ravel()
+
+    xlo, xhi, ylo, yhi = x.min(), x.max(), y.min(), y.max()
+    span = max(xhi - xlo, yhi - ylo)
+    scale = (max_size - 1) / span if span > 0 else 0.
+    nc = int(np.rint((xhi - xlo) * scale)) + 1
+    nl = int(np.rint((yhi - ylo) * scale)) + 1
+
+    raster = np.full((nl, nc), np.nan)
+    cols = np.rint((x - xlo) * scale).astype(int)
+    rows = nl - 1 - np.rint((y - ylo) * scale).astype(int)
+    valid = np.isfinite(values)
+    raster[rows[valid], cols[valid]] = values[valid]
+    return raster
+
+def quicklookScatter(x, y, values, savestr, max_size=1024, cmap='jet'):
+    """
+    Quicklook of points (x, y) coloured by their value, with the same scale in x and y
+    :param x: abscissae of the points (e.g. longitude)
+    :param y: ordinates of the points (e.g. latitude)
+    :param values: value per point
+    :param savestr: file name
+    :param max_size: maximum size per side [pixels]
+    :param cmap: colormap
+    :return: NA
+    """
+    quicklookImage(scatterRaster(x, y, values, max_size), savestr, cmap, QL_BACKGROUND)
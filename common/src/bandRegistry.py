@@ -0,0 +1,85 @@
+
+# BAND REGISTRY
+# Per-band properties gathered from the global, ISM and L1B configurations.
+# Bands are indexed by their position in globalConfig.bands, so that the per-band
+# arrays of the configurations (ismConfig.wv, l1bConfig.gain) can hold any number of bands.
+
+import numpy as np
+from common.io.readIsrf import readIsrf
+from common.src.radiometricBudget import radiometricBudget
+
+class bandRegistry:
+
+    def __init__(self, globalConfig, ismConfig, l1bConfig, auxdir):
+        """
+        :param globalConfig: global configuration (list of bands)
+        :param ismConfig: ISM configuration (central wavelengths, ISRF)
+        :param l1bConfig: L1B configuration (absolute radiometric gains)
+        :param auxdir: auxiliary directory (ISRF files)
+        """
+        self.globalConfig = globalConfig
+        self.ismConfig = ismConfig
+        self.l1bConfig = l1bConfig
+        self.auxdir = auxdir
+        self.names = list(globalConfig.bands)
+        self.indices = {band: iband for iband, band in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def index(self, band):
+        """
+        Index of a band in the registry
+        :param band: band name
+        :return: index
+        """
+        if band not in self.indices:
+            raise Exception('Band not found in the configuration ' + band)
+        return self.indices[band]
+
+    def wv(self, band):
+        """
+        Central wavelength of the band [m]
+        """
+        return self.ismConfig.wv[self.index(band)]
+
+    def gain(self, band):
+        """
+        Absolute radiometric gain of the band [mW/m2/sr/DN]
+        From l1bConfig.gain, or from the radiometric budget of the ISM configuration (l1bConfig.gain_from_budget)
+        """
+        if self.l1bConfig.gain_from_budget:
+            return radiometricBudget(self.ismConfig, self.wv(band)).gain()[0]
+        return self.l1bConfig.gain[self.index(band)]
+
+    def isrfFile(self, band):
+        """
+        ISRF file of the band, or None when the ISRF is parametric
+        """
+        if self.ismConfig.isrf_fwhm is not None:
+            return None
+        return self.auxdir + self.ismConfig.isrffile + band + '.nc'
+
+    def isrf(self, band):
+        """
+        ISRF of the band
+        Read from the auxiliary ISRF file, or a Gaussian of ismConfig.isrf_fwhm
+        centred at the central wavelength when no files are available (e.g. hyperspectral)
+        :param band: band name
+        :return: isrf and its wavelengths [nm]
+        """
+        if self.ismConfig.isrf_fwhm is None:
+            isrf, wv_isrf = readIsrf(self.auxdir + self.ismConfig.isrffile, band)
+            return isrf, wv_isrf * 1000 # [um] to [nm]
+
+        fwhm = np.broadcast_to(self.ismConfig.isrf_fwhm, (len(self),))[self.index(band)]
+        sigma = fwhm / (2 * np.sqrt(2 * np.log(2)))
+        wv0 = self.wv(band) * 1e9 # [nm]
+        step = fwhm / self.ismConfig.isrf_fwhm_samples
+        wv_isrf = wv0 + np.arange(-3 * fwhm, 3 * fwhm + step / 2, step)
+        isrf = np.exp(-0.5 * ((wv_isrf - wv0) / sigma) ** 2)
+
+        return isrf, wv_isrf
@@ -2,7 +2,63 @@ import logging.config
 from config.globalConfig import globalConfig
 from auxiliary.constants import constants
 from common.io.fileExists import fileExists, addFileSep
+from common.io.asyncWriter import backgroundWriter
 import os
+import threading
+
+# The logging system (formatters, console) is configured once per process, so that modules created
+# concurrently do not reconfigure it under each other. Each log file (outdir/modulestr.log) has its
+# own logger, a child of the module logger (e.g. ISM.1, ISM.2), with a file handler with the level and
+# formatter of the file handler of the configuration file. Modules of different output folders can then
+# run concurrently in one process, each logging to its own file
+_loggingLock = threading.Lock()
+_loggingConfigured = False
+_fileLevel = logging.DEBUG
+_fileFormatter = None
+_fileLoggers = {}
+
+def configureLogging(logconf):
+    """
+    Configuration of the logging system from the configuration file, once per process.
+    The file handlers of the configuration are removed: the log files belong to the modules (see moduleLogger)
+    :param logconf: logging configuration file
+    :return: NA
+    """
+    global _loggingConfigured, _fileLevel, _fileFormatter
+    with _loggingLock:
+        if _loggingConfigured:
+            return
+        logging.config.fileConfig(logconf,
+                                  defaults={'logfilename': os.devnull})
+        root = logging.getLogger()
+        for handler in [h for h in root.handlers if isinstance(h, logging.FileHandler)]:
+            _fileLevel = handler.level
+            _fileFormatter = handler.formatter
+            root.removeHandler(handler)
+            handler.close()
+        # matplotlib (imported lazily by the plots, after the configuration) only logs warnings
+        logging.getLogger('matplotlib').setLevel(logging.WARNING)
+        _loggingConfigured = True
+
+def moduleLogger(modulestr, logfile):
+    """
+    Logger of a module writing to a log file: one logger per log file, shared by the modules of that
+    file only (a child of the module logger, so that the messages also reach the console)
+    :param modulestr: module name
+    :param logfile: log file of the module
+    :return: logger
+    """
+    logfile = os.path.abspath(logfile)
+    with _loggingLock:
+        logger = _fileLoggers.get(logfile)
+        if logger is None:
+            logger = logging.getLogger(modulestr + '.' + str(len(_fileLoggers) + 1))
+            handler = logging.FileHandler(logfile)
+            handler.setLevel(_fileLevel)
+            handler.setFormatter(_fileFormatter)
+            logger.addHandler(handler)
+            _fileLoggers[logfile] = logger
+    return logger
 
 class baseModule:
 
@@ -52,9 +108,12 @@ class baseModule:
                             'File not found: ' + logstr)
 
         outlog = outdir + os.path.sep + modulestr + '.log'
-        logging.config.fileConfig(logstr,
-                                  defaults={'logfilename': outlog})
-        self.logger = logging.getLogger(self.modulestr)
+        configureLogging(logstr)
+        self.logger = moduleLogger(self.modulestr, outlog)
+
+        # Writer of the outputs, shared by the modules of the run (output folder and module), flushed at the end
+        self.writer = backgroundWriter(self.globalConfig.write_workers, self.globalConfig.write_max_pending,
+                                       (os.path.abspath(outdir), modulestr))
 
         # Get constants
         self.constants = constants()
@@ -0,0 +1,55 @@
+
+# DEFECT PIXEL MAP
+# Bad and dead pixels of the detector, as a sparse index: the ACT columns and their
+# multiplicative factor (1 - reduction of the quantum efficiency). Drawn from the configured
+# percentages and the seed; shared by the ISM (simulation) and the L1B (correction).
+
+import numpy as np
+
+def drawDefectMap(ncolumns, bad_pix, dead_pix, bad_pix_red, dead_pix_red, seed):
+    """
+    Draw the bad and dead columns of the detector
+    :param ncolumns: number of columns ACT
+    :param bad_pix: Percentage of bad pixels in the CCD [%]
+    :param dead_pix: Percentage of dead pixels in the CCD [%]
+    :param bad_pix_red: Reduction in the quantum efficiency for the bad pixels [-, over 1]
+    :param dead_pix_red: Reduction in the quantum efficiency for the dead pixels [-, over 1]
+    :param seed: seed
+    :return: columns (sorted), factor per column [-]
+    """
+    nbad = int(round(ncolumns * bad_pix / 100))
+    ndead = int(round(ncolumns * dead_pix / 100))
+    if nbad + ndead > ncolumns:
+        raise Exception('More bad and dead pixels (' + str(nbad + ndead) + ') than columns ' + str(ncolumns))
+
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(ncolumns,)))
+    columns = rng.choice(ncolumns, nbad + ndead, replace=False)
+    factors = np.concatenate((np.full(nbad, 1 - bad_pix_red), np.full(ndead, 1 - dead_pix_red)))
+
+    order = np.argsort(columns)
+    return columns[order].astype(np.int32), factors[order]
+
+def applyDefectMap(toa, columns, factors):
+    """
+    Apply the defect map
+    :param toa: TOA (ALT x ACT)
+    :param columns: defective columns
+    :param factors: factor per defective column [-]
+    :return: TOA with the defects (new array)
+    """
+    col_factors = np.ones(toa.shape[1])
+    col_factors[columns] = factors
+    return (toa * col_factors).astype(toa.dtype, copy=False)
+
+def correctDefectMap(toa, columns, factors):
+    """
+    Undo the defect map, for the columns with a non-zero factor
+    :param toa: TOA (ALT x ACT)
+    :param columns: defective columns
+    :param factors: factor per defective column [-]
+    :return: corrected TOA (new array)
+    """
+    valid = factors > 0
+    col_factors = np.ones(toa.shape[1])
+    col_factors[columns[valid]] = factors[valid]
+    return (toa / col_factors).astype(toa.dtype, copy=False)
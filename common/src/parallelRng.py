@@ -0,0 +1,86 @@
+
+# PARALLEL RANDOM GENERATION
+# The image is split in blocks of ALT lines and each block is drawn from its own numpy Generator,
+# derived from the seed, a key (e.g. band and effect) and the index of the block. The blocks are
+# drawn concurrently (numpy releases the GIL in the generators). As the streams belong to the blocks
+# and not to the threads, the result only depends on the seed, the key and the block size.
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+def blockRng(seed, key, iblock):
+    """
+    Random generator of one block
+    :param seed: seed
+    :param key: tuple of integers identifying the random process (e.g. band index, effect)
+    :param iblock: index of the block
+    :return: numpy Generator
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=tuple(key) + (iblock,)))
+
+def forBlocks(nlines, block_lines, work, nthreads=1, first_block=0):
+    """
+    Run work(iblock, lines) for every block of ALT lines
+    :param nlines: number of lines ALT
+    :param block_lines: lines per block
+    :param work: function of the index of the block and the slice of its lines
+    :param nthreads: number of threads
+    :param first_block: index of the first block (for a piece of a longer image starting at first_block*block_lines)
+    :return: NA
+    """
+    blocks = [(iblock, slice(ialt, ialt + block_lines))
+              for iblock, ialt in enumerate(range(0, nlines, block_lines), first_block)]
+    if nthreads > 1:
+        with ThreadPoolExecutor(max_workers=nthreads) as pool:
+            list(pool.map(lambda b: work(*b), blocks))
+    else:
+        for b in blocks:
+            work(*b)
+
+def addShotNoise(toa, seed, key, nthreads=1, block_lines=64, first_block=0, out=None):
+    """
+    Photon shot noise: each pixel is replaced by a Poisson sample of its mean
+    :param toa: TOA [e-] (negative means are taken as 0)
+    :param seed: seed
+    :param key: tuple of integers identifying the random process
+    :param nthreads: number of threads
+    :param block_lines: lines per block
+    :param first_block: index of the first block (see forBlocks)
+    :param out: output array (None: in place)
+    :return: TOA with shot noise (out)
+    """
+    if out is None:
+        out = toa
+
+    def work(iblock, lines):
+        rng = blockRng(seed, key, iblock)
+        out[lines] = rng.poisson(np.maximum(toa[lines], 0.))
+
+    forBlocks(toa.shape[0], block_lines, work, nthreads, first_block)
+    return out
+
+def addReadNoise(toa, sigma, seed, key, nthreads=1, block_lines=64, first_block=0, out=None):
+    """
+    Read noise: additive zero-mean Gaussian noise
+    :param toa: TOA [e-]
+    :param sigma: standard deviation [e-]
+    :param seed: seed
+    :param key: tuple of integers identifying the random process
+    :param nthreads: number of threads
+    :param block_lines: lines per block
+    :param first_block: index of the first block (see forBlocks)
+    :param out: output array (None: in place)
+    :return: TOA with read noise (out)
+    """
+    if out is None:
+        out = toa
+
+    def work(iblock, lines):
+        rng = blockRng(seed, key, iblock)
+        block = toa[lines]
+        noise = rng.standard_normal(block.shape)
+        noise *= sigma
+        np.add(block, noise, out=out[lines])
+
+    forBlocks(toa.shape[0], block_lines, work, nthreads, first_block)
+    return out
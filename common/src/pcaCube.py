@@ -0,0 +1,77 @@
+
+# PCA-COMPRESSED TOA CUBE
+# The SGM spectra are highly redundant: the cube is stored as spatial scores on a
+# small spectral basis, toa ~ mean + scores @ basis. Any linear spectral operator
+# (e.g. the ISRF integration) can be applied in the compressed domain by projecting
+# the operator onto the basis.
+
+import numpy as np
+
+class pcaCube:
+
+    def __init__(self, scores, basis, mean):
+        """
+        :param scores: spatial scores ALT x ACT x components
+        :param basis: spectral basis components x wavelengths
+        :param mean: mean spectrum (wavelengths)
+        """
+        self.scores = scores
+        self.basis = basis
+        self.mean = mean
+
+    @property
+    def shape(self):
+        """
+        Shape of the equivalent uncompressed cube (ALT x ACT x wavelengths)
+        """
+        return self.scores.shape[0], self.scores.shape[1], self.basis.shape[1]
+
+    @property
+    def ratio(self):
+        """
+        Compression ratio (wavelengths over stored values per spectrum)
+        """
+        return self.basis.shape[1] / self.basis.shape[0]
+
+    def reconstruct(self, lines=slice(None)):
+        """
+        Uncompressed cube (or some ALT lines of it)
+        :param lines: slice of ALT lines
+        :return: TOA cube ALT x ACT x wavelengths
+        """
+        return self.mean + self.scores[lines] @ self.basis
+
+def compressCube(toa, ncomp, block_lines=64):
+    """
+    PCA compression of a TOA cube. The spectral covariance is accumulated
+    in ALT blocks so that no full-size float64 copy of the cube is needed.
+    :param toa: TOA cube ALT x ACT x wavelengths
+    :param ncomp: number of principal components
+    :param block_lines: ALT lines per block
+    :return: pcaCube
+    """
+    nalt, nact, nwv = toa.shape
+    ncomp = min(ncomp, nwv)
+    npix = nalt * nact
+
+    # Mean spectrum and covariance
+    mean = np.zeros(nwv)
+    for ialt in range(0, nalt, block_lines):
+        mean += np.sum(toa[ialt:ialt + block_lines].reshape(-1, nwv), axis=0, dtype=np.float64)
+    mean /= npix
+
+    cov = np.zeros((nwv, nwv))
+    for ialt in range(0, nalt, block_lines):
+        X = toa[ialt:ialt + block_lines].reshape(-1, nwv) - mean
+        cov += X.T @ X
+
+    # Leading eigenvectors of the covariance form the spectral basis
+    eigval, eigvec = np.linalg.eigh(cov)
+    basis = eigvec[:, ::-1][:, :ncomp].T.copy()
+
+    scores = np.zeros((nalt, nact, ncomp), dtype=np.float32)
+    for ialt in range(0, nalt, block_lines):
+        X = toa[ialt:ialt + block_lines] - mean
+        scores[ialt:ialt + block_lines] = X @ basis.T
+
+    return pcaCube(scores, basis, mean)
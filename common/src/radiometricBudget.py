@@ -0,0 +1,101 @@
+
+# RADIOMETRIC BUDGET
+# Analytic end-to-end radiometry of the ISM chain (rad2Irrad, irrad2Phot, phot2Electr,
+# electr2Volt, digitisation) from the ISM configuration, for all the bands at once:
+# conversion factors, absolute gain (as l1bConfig.gain), saturation radiances, dark signal
+# and SNR over an array of input radiances. Arrays are bands (x radiances).
+
+import numpy as np
+from scipy.constants import Planck, c
+
+class radiometricBudget:
+
+    def __init__(self, ismConfig, wv):
+        """
+        :param ismConfig: ISM configuration
+        :param wv: central wavelength per band [m]
+        """
+        self.ismConfig = ismConfig
+        self.wv = np.atleast_1d(np.asarray(wv, dtype=float))
+
+    def factors(self):
+        """
+        Conversion factors of each stage of the chain, per band
+        :return: dictionary with 'rad2irr' [mW/m2 per mW/m2/sr], 'irr2ph' [ph per mW/m2],
+                 'ph2e' [e-/ph], 'e2v' [V/e-], 'v2dn' [DN/V], 'rad2e' [e- per mW/m2/sr] and 'rad2dn' [DN per mW/m2/sr]
+        """
+        cfg = self.ismConfig
+        nb = self.wv.shape
+        f = {'rad2irr': np.full(nb, cfg.Tr * (cfg.D / cfg.f) ** 4 * np.pi / 4),               # see rad2Irrad
+             'irr2ph': cfg.pix_size * cfg.pix_size * cfg.t_int * self.wv / (Planck * c),    # see irrad2Phot
+             'ph2e': np.full(nb, float(cfg.QE)),                                            # see phot2Electr
+             'e2v': np.full(nb, cfg.OCF * cfg.ADC_gain),                                   # see electr2Volt
+             'v2dn': np.full(nb, (2 ** cfg.bit_depth - 1) / (cfg.max_voltage - cfg.min_voltage))} # see digitisation
+        f['rad2e'] = f['rad2irr'] * f['irr2ph'] * f['ph2e']
+        f['rad2dn'] = f['rad2e'] * f['e2v'] * f['v2dn']
+        return f
+
+    def gain(self):
+        """
+        Absolute radiometric gain per band, DN to radiances (as l1bConfig.gain)
+        :return: gain [mW/m2/sr/DN]
+        """
+        return 1 / self.factors()['rad2dn']
+
+    def darkSignal(self):
+        """
+        Dark signal per band (without the DSNU), see detectionPhase.darkSignal
+        :return: dark signal [e-], dark signal [DN]
+        """
+        cfg = self.ismConfig
+        Sd = cfg.ds_A_coeff * (cfg.T / cfg.Tref) ** 3 * np.exp(-cfg.ds_B_coeff * (1 / cfg.T - 1 / cfg.Tref))
+        f = self.factors()
+        Sd = np.full(self.wv.shape, Sd)
+        return Sd, Sd * f['e2v'] * f['v2dn']
+
+    def saturationRadiance(self):
+        """
+        Radiance at which each band saturates: the ADC (maximum DN, with the dark signal) or the full well
+        (ismConfig.FWC in photons, converted to electrons with the QE)
+        :return: saturation radiance of the ADC, of the full well and the minimum of both [mW/m2/sr]
+        """
+        f = self.factors()
+        ds_e, ds_dn = self.darkSignal()
+        max_dn = 2 ** self.ismConfig.bit_depth - 1
+        lsat_adc = (max_dn - ds_dn) / f['rad2dn']
+        fwc_e = self.ismConfig.FWC * f['ph2e']
+        lsat_fwc = (fwc_e - ds_e) / f['rad2e']
+        return lsat_adc, lsat_fwc, np.minimum(lsat_adc, lsat_fwc)
+
+    def snr(self, radiances, read_noise=0.):
+        """
+        SNR per band and radiance. Temporal noise: shot noise of the signal and of the dark signal,
+        read noise and quantisation noise. Zero above the saturation radiance.
+        :param radiances: input radiances [mW/m2/sr]
+        :param read_noise: RMS of the read noise [e-]
+        :return: SNR (bands x radiances) [-]
+        """
+        L = np.atleast_1d(np.asarray(radiances, dtype=float))[None, :]
+        f = self.factors()
+        ds_e = self.darkSignal()[0][:, None]
+        e_per_dn = 1 / (f['e2v'] * f['v2dn'])[:, None]
+
+        signal = L * f['rad2e'][:, None]
+        noise = np.sqrt(signal + ds_e + read_noise ** 2 + e_per_dn ** 2 / 12)
+        snr = signal / noise
+        return np.where(L > self.saturationRadiance()[2][:, None], 0., snr)
+
+    def compute(self, radiances, read_noise=0.):
+        """
+        Whole budget
+        :param radiances: input radiances for the SNR [mW/m2/sr]
+        :param read_noise: RMS of the read noise [e-]
+        :return: dictionary with the factors (see factors), 'gain', 'ds_e', 'ds_dn', 'lsat_adc', 'lsat_fwc',
+                 'lsat' (per band) and 'snr' (bands x radiances)
+        """
+        budget = self.factors()
+        budget['gain'] = 1 / budget['rad2dn']
+        budget['ds_e'], budget['ds_dn'] = self.darkSignal()
+        budget['lsat_adc'], budget['lsat_fwc'], budget['lsat'] = self.saturationRadiance()
+        budget['snr'] = self.snr(radiances, read_noise)
+        return budget
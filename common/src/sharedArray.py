@@ -0,0 +1,42 @@
+
+# SHARED-MEMORY ARRAYS
+# An array is copied once into a block of multiprocessing.shared_memory; worker processes attach
+# to the block by its name and see the same data without copies. The descriptor (name, shape and
+# dtype) is small and picklable, so it can be passed to the workers instead of the array.
+
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+def shareArray(array):
+    """
+    Copy of an array in shared memory
+    :param array: array
+    :return: shared memory block (to be closed and unlinked by the owner), descriptor (name, shape, dtype)
+    """
+    array = np.asarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+def attachArray(descriptor):
+    """
+    Array in a shared memory block created with shareArray (no copy)
+    :param descriptor: descriptor (name, shape, dtype)
+    :return: shared memory block (to be closed once the array is not used), array
+    """
+    name, shape, dtype = descriptor
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+def processContext():
+    """
+    Multiprocessing context of the workers: forkserver where available, spawn otherwise.
+    Never fork: the parent has live threads (writer, plot pool, scipy.fft) and a lock held
+    by one of them at fork time would stay locked in the child. The workers import the
+    main module, so the main scripts run under if __name__ == '__main__'
+    :return: multiprocessing context
+    """
+    if 'forkserver' in mp.get_all_start_methods():
+        return mp.get_context('forkserver')
+    return mp.get_context('spawn')
@@ -0,0 +1,126 @@
+
+# STREAMING PER-PIXEL STATISTICS
+# Mean and standard deviation (Welford, merged per batch with the parallel update of Chan et al.)
+# and quantiles (P-square algorithm of Jain and Chlamtac, vectorised over the pixels), without
+# keeping the samples: memory is a few images whatever the number of samples.
+
+import numpy as np
+
+class streamMoments:
+
+    def __init__(self, shape):
+        """
+        :param shape: shape of the samples (e.g. image)
+        """
+        self.n = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def update(self, batch):
+        """
+        Add a batch of samples
+        :param batch: samples along the first axis (nsamples x shape)
+        :return: NA
+        """
+        nb = batch.shape[0]
+        if nb == 0:
+            return
+        mean_b = batch.mean(axis=0)
+        m2_b = ((batch - mean_b) ** 2).sum(axis=0)
+
+        n = self.n + nb
+        delta = mean_b - self.mean
+        self.mean += delta * (nb / n)
+        self.m2 += m2_b + delta * delta * (self.n * nb / n)
+        self.n = n
+
+    def std(self, ddof=1):
+        """
+        Standard deviation of the samples so far
+        :param ddof: delta degrees of freedom
+        :return: standard deviation
+        """
+        return np.sqrt(self.m2 / max(self.n - ddof, 1))
+
+class streamQuantile:
+
+    def __init__(self, shape, p):
+        """
+        :param shape: shape of the samples (e.g. image)
+        :param p: quantile [0-1]
+        """
+        self.p = p
+        self.n = 0
+        self.first = []
+        # Marker heights and positions (5 markers per pixel), desired positions and their increments
+        self.q = np.zeros((5,) + tuple(shape))
+        self.pos = np.zeros((5,) + tuple(shape))
+        self.desired = np.array([0., 2 * p, 4 * p, 2 + 2 * p, 4.])
+        self.increment = np.array([0., p / 2, p, (1 + p) / 2, 1.])
+
+    def update(self, batch):
+        """
+        Add a batch of samples
+        :param batch: samples along the first axis (nsamples x shape)
+        :return: NA
+        """
+        for x in batch:
+            self.add(np.asarray(x, dtype=float))
+
+    def add(self, x):
+        """
+        Add one sample
+        :param x: sample (shape)
+        :return: NA
+        """
+        self.n += 1
+        if self.n <= 5:
+            self.first.append(x.copy())
+            if self.n == 5:
+                self.q[:] = np.sort(np.stack(self.first), axis=0)
+                self.pos[:] = np.arange(5).reshape((5,) + (1,) * x.ndim)
+                self.first = []
+            return
+
+        q, pos = self.q, self.pos
+
+        # Cell of the sample, extending the extreme markers if needed
+        np.minimum(q[0], x, out=q[0])
+        np.maximum(q[4], x, out=q[4])
+        k = (x >= q[1]).astype(int) + (x >= q[2]) + (x >= q[3])
+        for j in range(1, 5):
+            pos[j] += k < j
+        self.desired += self.increment
+
+        # Adjust the central markers
+        for i in range(1, 4):
+            d = self.desired[i] - pos[i]
+            up = (d >= 1) & (pos[i + 1] - pos[i] > 1)
+            down = (d <= -1) & (pos[i - 1] - pos[i] < -1)
+            move = up | down
+            if not move.any():
+                continue
+            ds = np.where(up, 1., -1.)
+
+            # Parabolic prediction, linear if it leaves the neighbours' interval
+            qp = q[i] + ds / (pos[i + 1] - pos[i - 1]) * (
+                (pos[i] - pos[i - 1] + ds) * (q[i + 1] - q[i]) / (pos[i + 1] - pos[i]) +
+                (pos[i + 1] - pos[i] - ds) * (q[i] - q[i - 1]) / (pos[i] - pos[i - 1]))
+            inside = (q[i - 1] < qp) & (qp < q[i + 1])
+            qn = np.where(up, q[i + 1], q[i - 1])
+            pn = np.where(up, pos[i + 1], pos[i - 1])
+            ql = q[i] + ds * (qn - q[i]) / (pn - pos[i])
+
+            q[i] = np.where(move, np.where(inside, qp, ql), q[i])
+            pos[i] += np.where(move, ds, 0.)
+
+    def value(self):
+        """
+        Quantile estimate of the samples so far (exact for up to 5 samples)
+        :return: quantile
+        """
+        if self.n == 0:
+            raise Exception('No samples')
+        if self.n < 5:
+            return np.quantile(np.stack(self.first), self.p, axis=0)
+        return self.q[2].copy()
@@ -9,11 +9,24 @@ class globalConfig:
         # Auxiliary files
         self.logconfigfile = 'logging.conf'
 
-        # bands
+        # Asynchronous writes of the outputs (see common/io/asyncWriter.py)
+        self.write_workers = 2 # [-] Background writer threads (0: synchronous writes)
+        self.write_max_pending = 8 # [-] Maximum writes pending at a time (memory bound); beyond it the processing waits
+
+        # Plots of the modules (see common/plot/plotDispatch.py)
+        self.plot_mode = 'quicklook' # 'full' (matplotlib figures), 'quicklook' (downsampled PNG from the arrays) or 'none'
+        self.plot_workers = 0 # [-] Background processes rendering the plots (0: in the processing thread)
+        self.plot_max_pending = 8 # [-] Maximum plots queued or rendering in the background (back-pressure)
+        self.quicklook_size = 1024 # [pixels] Maximum size per side of the quicklooks of 2D arrays
+
+        # bands. Any number of bands 'NAME-<index>'; the per-band parameters (ismConfig.wv,
+        # l1bConfig.gain) follow this order. E.g. for a hyperspectral instrument
+        # self.bands = ['HYP-' + str(i) for i in range(200)]
         self.bands = ['VNIR-0','VNIR-1','VNIR-2','VNIR-3']
 
         # Name of the scene (output of the SGM)
         self.scene = 'sgm_toa.nc'
+        self.scene_pca = 'sgm_toa_pca.nc' # PCA-compressed scene (see ism/mainCompressCube.py)
 
         # Name of the GM outputs
         self.gm_geoloc = 'geolocation.nc'
@@ -28,6 +41,10 @@ class globalConfig:
         self.ism_toa_ds = 'ism_toa_ds_' # [e-] Electrons. Intermediate output after the Detection stage - Dark signal
         self.ism_toa_detection = 'ism_toa_detection_' # [e-] Digital numbers. Intermediate output after the Detection stage (after bad/dead pix)
         self.ism_toa_vcu = 'ism_toa_vcu_' # [DN] Digital numbers. Intermediate output after the Video Control Unit
+        self.ism_mtf = 'ism_mtf_' # [-] System MTF and its contributors (Hdiff, Hdefoc, Hwfe, Hdet, Hsmear, Hmotion, Hsys, fnAct, fnAlt)
+        self.ism_mtf_explorer = 'ism_mtf_explorer_' # [-] MTF trade-space explorer: MTFs per combination of parameters and frequency
+        self.ism_ensemble = 'ism_ensemble_' # [DN] Per-pixel summaries of the noise ensemble. Attaches mean/std/p<percentile> + '_' + BAND
+        self.ism_defect_map = 'ism_defect_map.nc' # [-] Bad/dead pixels of the detector (columns and factors), also used by the L1B
 
         # Name of the TOA outputs of the L1B
         self.l1b_toa = "l1b_toa_" # [mW/m2/sr] Radiances. Output of the L1B
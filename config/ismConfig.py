@@ -23,10 +23,18 @@ class ismConfig:
         self.defocus = 2                         # [-] Defocus coefficient (defocus/(f/N)). 0-2 low defocusing
         self.ksmear = 0.191                      # [pixels] Coefficient for the smearing ALT
         self.kmotion = 0.02                      # [pixels] Amplitude of high-frequency component for the motion smear MTF in ALT and ACT
-        self.kernel_half_width = 0.5             # [pixels] Half-width of the kernel
+        self.kernel_half_width = 3.5             # [pixels] Half-width of the PSF kernel (2*ceil(w-0.5)+1 pixels per side)
         self.kernel_step = 0.1                   # [pixels] Sampling of the kernel
+        self.psf_grid = 256                      # [pixels] Grid on which the PSF kernel is derived from the system MTF (>> kernel)
+        self.psf_method = 'auto'                 # PSF convolution: 'auto' (cheapest), 'separable', 'direct' or 'fft'
+        self.psf_sep_tol = 1e-3                  # [-] Maximum relative second singular value of a separable PSF kernel
+        # Cost model of the PSF convolution methods per pixel of the image [ns], used by psf_method='auto':
+        # direct a*nk + b, separable a*(nk_alt + nk_act) + b, FFT a*log2(npix). Fitted to timings of scipy.ndimage
+        # convolve/convolve1d and scipy.fft (one thread, float64, 512x512 and 1024x1024, kernels 3x3 to 15x15).
+        # Only the ratios matter: refit on other machines
+        self.psf_cost = {'direct': (1.2, 6.), 'separable': (1.5, 30.), 'fft': 3.}
 
-        # Central wavelength of the band
+        # Central wavelength of the band (one per band of globalConfig.bands)
         self.wv = np.array([0.49,0.665,0.865,0.945])*1e-6  # [m] Central wavelength
 
         # Photonic Stage
@@ -34,8 +42,8 @@ class ismConfig:
         self.FWC = 420000                        # [ph] Full Well Capacity
 
         # Detection stage
-        self.bad_pix = 1.0                      # [%] Percentage of bad/dead pixels in the CCD
-        self.dead_pix = 0.5                      # [%]
+        self.bad_pix = 1.0                      # [%] Percentage of bad pixels in the CCD
+        self.dead_pix = 0.5                      # [%] Percentage of dead pixels in the CCD
         self.bad_pix_red = 0.1                   # [-] Reduction in the quantum efficiency of the pixel (over 1)
         self.dead_pix_red = 0.4                  # [-]
         self.kprnu = 0.04                        # 4% Coefficient by which we multiply the PRNU standard normal distribution
@@ -54,15 +62,87 @@ class ismConfig:
         self.max_voltage = 0.86                  # [V]
 
         self.seed = 123456789                    # Seed for the random generators
+        self.read_noise = 50.                    # [e-] RMS of the read noise
+        self.noise_nthreads = 4                  # [-] Threads of the shot and read noise generation
+        self.noise_block_lines = 64              # [lines] ALT lines per random stream (the noise depends on it, not on the threads)
+
+        # Fused detection and video chain phases: per-column gain and offset, rounding and clipping in one pass
+        self.fused_detection_vcu = False         # Output in integer DN. The intermediate outputs follow the save flags
+        self.vcu_block_lines = 64                # [lines] ALT lines per block of the fused pass
+
+        # Bands in parallel workers, sharing the cube after the ISRF (outputs identical to the serial run)
+        self.band_workers = 1                    # [-] Workers (1: serial)
+        self.band_executor = 'process'           # 'process' (shared memory) or 'thread' (the modules are re-entrant)
+
+        # Format of the ISM output (globalConfig.ism_toa), see common/io/writeToa.py
+        self.toa_format = 'uint16'               # 'uint16' (compressed), 'packed12' (12-bit samples, bit_depth <= 12) or 'float32'
+
+        # Monte Carlo ensemble of the PRNU and DSNU (detection and video chain phases on the optical output)
+        self.ensemble_size = 0                   # [-] Number of realisations (0: no ensemble)
+        self.ensemble_chunk = 16                 # [-] Realisations computed at once (memory: chunk x image)
+        self.ensemble_percentiles = [5, 50, 95]  # [%] Per-pixel percentiles of the ensemble
+
+        # Spectral integration (ISRF)
+        self.isrf_nthreads = 1                   # [-] Threads for the ISRF integration (split in ALT blocks)
+        self.isrf_block_lines = 64               # [lines] ALT lines per block of the ISRF integration
+        self.isrf_cache = True                   # Keep the ISRF spectral weights in an on-disk cache
+        self.isrf_window_read = True             # Read from the scene only the wavelengths within the ISRF support
+        self.isrf_window_max = 512               # [samples] Max. wavelengths read at once for a group of bands
+        self.isrf_fwhm = None                    # [nm] FWHM of a Gaussian ISRF (scalar or per band). If None, read the ISRF files
+        self.isrf_fwhm_samples = 20              # [-] Samples per FWHM of the Gaussian ISRF
+
+        # Spectral smile (ACT-dependent ISRF). Uses the 2D ISRF (columns x wavelengths) if the ISRF file
+        # provides one, otherwise the band ISRF shifted and scaled per column
+        self.isrf_smile = False
+        self.smile_shift = 0.0                   # [nm] ISRF centre shift per ACT column (scalar or array of n_columns)
+        self.smile_width = 1.0                   # [-] ISRF width factor per ACT column (scalar or array of n_columns)
+
+        # PCA-compressed input scene. The ISRF integration is done in the compressed domain
+        self.use_pca_scene = False               # Read globalConfig.scene_pca instead of globalConfig.scene
+        self.pca_ncomp = 20                      # [-] Number of principal components of the compressed scene
+
+        # System MTF cache (keyed on the image shape, the wavelength and the optics parameters)
+        self.mtf_cache_size = 8                  # [-] System MTFs kept in memory
+        self.mtf_disk_cache = True               # Keep the system MTFs in an on-disk cache too
+        self.mtf_disk_cache_mb = 256             # [MB] Size limit of the on-disk cache (least recently used MTFs evicted)
+
+        # FFT of the MTF application
+        self.fft_workers = -1                    # [-] Threads of scipy.fft (-1 for all the cores)
+        self.fft_single = False                  # Single precision transforms (complex64)
+        self.fft_pad = False                     # Mirror-pad the image to FFT-friendly sizes (no circular wrap at the edges)
+        self.fft_pad_margin = 16                 # [pixels] Minimum padding per side
+
+        # Streaming (overlap-save) application of the MTF along track, for long strips
+        self.mtf_stream = False                  # Filter the image in blocks of lines ALT instead of in one FFT
+        self.stream_block_lines = 256            # [lines] Output lines per block (minimum, rounded up to an FFT-friendly size)
+        self.stream_margin = 16                  # [lines] Overlap per side. Support of the PSF ALT (kernel renormalised, ~0.12/margin of its energy beyond)
+
+        # Streaming ISM: each band is read, integrated, filtered (overlap-save MTF, see above), detected, digitised
+        # and written in blocks of lines ALT. Memory is bounded by the block size. No intermediate outputs
+        self.stream_ism = False
+        self.stream_read_lines = 256             # [lines] ALT lines read from the scene and written to the output at once
+
+        # Field-dependent system MTF (ACT): tiles filtered with the MTF of their field point, blended by overlap-add
+        self.field_mtf = False                   # Apply a field-dependent MTF instead of a single one
+        self.field_points = [0.0, 0.7, 1.0]      # [-] ACT field points: distance to the swath centre, normalised to the half swath
+        self.field_params = {'defocus': [2, 2.2, 2.6],
+                             'wLF': [100e-9, 110e-9, 130e-9]} # MTF parameters at the field points (the others take the values above)
+        self.field_tile_columns = 64             # [columns] Distance between tile centres ACT
+        self.field_margin = 16                   # [columns] Margin per side of the tiles. Support of the PSF ACT
+        self.field_nthreads = 4                  # [-] Tiles filtered in parallel
 
         # Auxiliary inputs (relative paths to the root folder)
         #--------------------------------------------------------------------------------
         self.isrffile = 'isrf/ISRF_'
+        self.isrf_cachedir = 'cache/isrf/'       # Cache of the ISRF spectral weights per band
+        self.mtf_cachedir = 'cache/mtf/'         # Cache of the system MTFs
+        self.defect_cachedir = 'cache/defects/'  # Cache of the defect pixel maps
+        self.psffile = None                      # 1D PSF profile sampled at kernel_step over +-kernel_half_width. None: PSF from the system MTF
 
         # Flags to save intermediate outputs
         #--------------------------------------------------------------------------------
         self.save_after_isrf = True         # optical stage after the ISRF
-        self.save_mtfs = True               # save the MTFs
+        self.save_mtfs = True               # save the MTFs (plots and one NC file per band, globalConfig.ism_mtf)
         self.save_optical_stage = True      # optical stage after the MTF
         self.save_after_ph2e = True         # detections stage after the photon to electron conversion
         self.save_after_prnu = True         # detections stage after the PRNU
@@ -78,3 +158,5 @@ class ismConfig:
         self.apply_prnu = True
         self.apply_dark_signal = True
         self.apply_bad_dead = True
+        self.apply_shot_noise = False            # Photon shot noise (Poisson)
+        self.apply_read_noise = False            # Read noise (Gaussian, ismConfig.read_noise)
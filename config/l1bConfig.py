@@ -10,10 +10,15 @@ class l1bConfig:
         # Flags to enable or disable the equalization
         self.do_equalization = False
 
+        # Correction of the bad/dead pixels with the defect map of the ISM (globalConfig.ism_defect_map)
+        self.do_defect_correction = False
+
         # Auxiliary inputs (relative paths to the root folder)
         #--------------------------------------------------------------------------------
         # Gain, conversion factor from Digital Numbers to Radiances
         self.gain = np.array([0.09209303, 0.06787323, 0.052162305, 0.047756273]) # [mW/m2/sr/DN]
+        # Use instead the analytic gain of the radiometric budget of the ISM configuration
+        self.gain_from_budget = False
 
         # Equalisation, multiplicative and additive factors.
         self.eq_mult = 'equalization/eq_mult_'
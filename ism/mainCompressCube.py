@@ -0,0 +1,17 @@
+
+# MAIN FUNCTION TO COMPRESS THE SGM SCENE (PCA) FOR THE ISM
+# Writes globalConfig.scene_pca in the output directory and reports the
+# reconstruction error per band. Set ismConfig.use_pca_scene to use it in the ISM.
+
+from ism.src.cubeCompression import cubeCompression
+
+# Directory - this is the common directory for the execution of the E2E, all modules
+auxdir = r'C:\\Users\\pc\\Desktop\\Earth_Observation_Data_Processing\\Assignment\\auxiliary'
+indir = r"C:\\Users\\pc\\Desktop\\Earth_Observation_Data_Processing\\EODP_TER_2021\\EODP-TS-ISM\\input\\gradient_alt100_act150"
+outdir = r"C:\\Users\\pc\\Desktop\\Earth_Observation_Data_Processing\\EODP_TER_2021\\EODP-TS-ISM\\input\\gradient_alt100_act150"
+
+# Worker processes (bands, plots) import this script: run only as the main script
+if __name__ == '__main__':
+    # Compress the scene
+    myCompression = cubeCompression(auxdir, indir, outdir)
+    myCompression.processModule()
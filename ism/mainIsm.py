@@ -8,6 +8,8 @@ auxdir = r'C:\\Users\\pc\\Desktop\\Earth_Observation_Data_Processing\\Assignment
 indir = r"C:\\Users\\pc\\Desktop\\Earth_Observation_Data_Processing\\EODP_TER_2021\\EODP-TS-ISM\\input\\gradient_alt100_act150"
 outdir = r"C:\\Users\\pc\\Desktop\\Earth_Observation_Data_Processing\\EODP_TER_2021\\EODP-TS-ISM\\my_output_ism"
 
-# Initialise the ISM
-myIsm = ism(auxdir, indir, outdir)
-myIsm.processModule()
\ No newline at end of file
+# Worker processes (bands, plots) import this script: run only as the main script
+if __name__ == '__main__':
+    # Initialise the ISM
+    myIsm = ism(auxdir, indir, outdir)
+    myIsm.processModule()
\ No newline at end of file
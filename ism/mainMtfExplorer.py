@@ -0,0 +1,41 @@
+
+# MAIN FUNCTION OF THE MTF TRADE-SPACE EXPLORER
+# Sweeps the optical design parameters and writes the system MTF and its contributors
+# at Nyquist and half Nyquist (ALT and ACT) for every combination (globalConfig.ism_mtf_explorer)
+
+import logging
+import numpy as np
+from config.globalConfig import globalConfig
+from config.ismConfig import ismConfig
+from config.l1bConfig import l1bConfig
+from common.src.bandRegistry import bandRegistry
+from ism.src.mtfExplorer import mtfExplorer, parameterGrid, defaultParameters
+from common.io.mtfProduct import writeMtfExplorer
+
+# Directory - this is the common directory for the execution of the E2E, all modules
+auxdir = r'C:\\Users\\pc\\Desktop\\Earth_Observation_Data_Processing\\Assignment\\auxiliary'
+outdir = r"C:\\Users\\pc\\Desktop\\Earth_Observation_Data_Processing\\EODP_TER_2021\\EODP-TS-ISM\\my_output_mtf_explorer"
+band = 'VNIR-0'
+
+# Evaluation frequencies (f/(1/w)): Nyquist ALT, Nyquist ACT, half Nyquist ALT and ACT
+fnAlt = np.array([0.5, 0., 0.25, 0.])
+fnAct = np.array([0., 0.5, 0., 0.25])
+
+# Configuration (no input folder: the explorer does not run the ISM)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+logger = logging.getLogger('MTF_EXPLORER')
+myGlobalConfig = globalConfig()
+myIsmConfig = ismConfig()
+myBands = bandRegistry(myGlobalConfig, myIsmConfig, l1bConfig(), auxdir)
+
+# Trade space. The parameters not swept take the values of ismConfig
+params = defaultParameters(myIsmConfig, myBands.wv(band))
+params.update(parameterGrid(D=np.linspace(0.10, 0.30, 21),
+                            focal=np.linspace(0.4, 0.6, 11),
+                            defocus=np.linspace(0., 2., 11),
+                            ksmear=np.linspace(0., 0.5, 6)))
+
+# Evaluate and write
+myExplorer = mtfExplorer(logger)
+H = myExplorer.evaluate(params, fnAlt, fnAct)
+writeMtfExplorer(outdir, myGlobalConfig.ism_mtf_explorer + band, params, fnAlt, fnAct, H)
@@ -0,0 +1,20 @@
+# MAIN FUNCTION OF THE RADIOMETRIC BUDGET
+# Analytic gains (as l1bConfig.gain), dark signal, saturation radiances and SNR curves
+# of all the bands from the ISM configuration, without running the ISM
+
+import numpy as np
+from config.ismConfig import ismConfig
+from common.src.radiometricBudget import radiometricBudget
+
+# Input radiances of the SNR curves [mW/m2/sr]
+radiances = np.linspace(0.1, 5., 50)
+
+myConfig = ismConfig()
+budget = radiometricBudget(myConfig, myConfig.wv).compute(radiances, read_noise=myConfig.read_noise)
+
+np.set_printoptions(precision=6)
+print('Gain [mW/m2/sr/DN]:            ' + str(budget['gain']))
+print('Dark signal [e-]:              ' + str(budget['ds_e']))
+print('Dark signal [DN]:              ' + str(budget['ds_dn']))
+print('Saturation radiance [mW/m2/sr]: ' + str(budget['lsat']))
+print('Maximum SNR (at saturation):    ' + str(budget['snr'].max(axis=1)))
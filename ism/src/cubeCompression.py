@@ -0,0 +1,62 @@
+
+# PCA COMPRESSION OF THE SGM SCENE
+
+from ism.src.initIsm import initIsm
+from ism.src.opticalPhase import opticalPhase
+from ism.src.isrfOperator import weightsOperator, applyOperator, applyOperatorPca
+from common.io.readCube import readCube
+from common.io.readCubePca import writeCubePca
+from common.src.pcaCube import compressCube
+import numpy as np
+import os
+
+class cubeCompression(initIsm):
+
+    def __init__(self, auxdir, indir, outdir):
+        super().__init__(auxdir, indir, outdir)
+
+    def processModule(self):
+
+        self.logger.info("Start of the PCA compression of the scene")
+
+        # Read input TOA cube
+        # -------------------------------------------------------------------------------
+        sgm_toa, sgm_wv = readCube(self.indir, self.globalConfig.scene)
+
+        # Compression
+        # -------------------------------------------------------------------------------
+        cube = compressCube(sgm_toa, self.ismConfig.pca_ncomp, self.ismConfig.isrf_block_lines)
+        self.logger.info("Compressed with " + str(cube.basis.shape[0]) + " components. Ratio " +
+                         str(round(cube.ratio, 2)))
+
+        writeCubePca(self.outdir, os.path.splitext(self.globalConfig.scene_pca)[0], cube, sgm_wv)
+
+        # Reconstruction error per band, after the ISRF integration
+        # -------------------------------------------------------------------------------
+        myOpt = opticalPhase(self.auxdir, self.indir, self.outdir)
+        bands = self.globalConfig.bands
+        W = weightsOperator([myOpt.isrfBandWeights(sgm_wv, band) for band in bands])
+        toa = applyOperator(sgm_toa, W, self.ismConfig.isrf_nthreads, self.ismConfig.isrf_block_lines)
+        toa_pca = applyOperatorPca(cube, W)
+
+        errors = self.bandErrors(toa, toa_pca)
+        for iband, band in enumerate(bands):
+            self.logger.info("Reconstruction error " + band +
+                             ": max " + '{:.4e}'.format(errors[iband, 0]) + " %," +
+                             " rms " + '{:.4e}'.format(errors[iband, 1]) + " %")
+
+        self.logger.info("End of the PCA compression of the scene")
+
+        return errors
+
+    def bandErrors(self, toa, toa_pca):
+        """
+        Relative error of the compressed scene after the ISRF integration
+        :param toa: ISRF-integrated TOA of the original scene (ALT x ACT x bands)
+        :param toa_pca: ISRF-integrated TOA of the compressed scene (ALT x ACT x bands)
+        :return: maximum and RMS relative error per band [%], array bands x 2
+        """
+        rel = (toa_pca - toa) / np.where(toa != 0, toa, 1) * 100
+        rel = rel.reshape(-1, toa.shape[2])
+
+        return np.stack((np.max(np.abs(rel), axis=0), np.sqrt(np.mean(rel ** 2, axis=0))), axis=1)
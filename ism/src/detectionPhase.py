@@ -5,15 +5,34 @@ from common.io.writeToa import writeToa
 from common.plot.plotMat2D import plotMat2D
 from common.plot.plotF import plotF
 from scipy.constants import Planck, c
+from common.src.parallelRng import addShotNoise, addReadNoise
+from common.src.defectMap import drawDefectMap, applyDefectMap
+from common.io.readDefectMap import defectMapKey, readDefectMap, writeDefectMap
+
+# Random streams of the detection effects. Each band and effect has its own stream,
+# derived from ismConfig.seed: the result does not depend on the order in which the bands are processed
+RNG_PRNU = 0
+RNG_DSNU = 1
+RNG_SHOT = 2
+RNG_READ = 3
 
 class detectionPhase(initIsm):
 
     def __init__(self, auxdir, indir, outdir):
         super().__init__(auxdir, indir, outdir)
 
-        # Initialise the random see for the PRNU and DSNU
-        np.random.seed(self.ismConfig.seed)
-
+    def bandRng(self, band, effect, realisation=None):
+        """
+        Random generator of one effect of one band, independent of the others
+        :param band: band
+        :param effect: effect (RNG_PRNU, RNG_DSNU)
+        :param realisation: realisation of a noise ensemble (None for the nominal one)
+        :return: numpy Generator
+        """
+        key = (self.bandRegistry.index(band), effect)
+        if realisation is not None:
+            key = key + (realisation,)
+        return np.random.default_rng(np.random.SeedSequence(self.ismConfig.seed, spawn_key=key))
 
     def compute(self, toa, band):
 
@@ -23,7 +42,7 @@ class detectionPhase(initIsm):
         # -------------------------------------------------------------------------------
         self.logger.info("EODP-ALG-ISM-2010: Irradiances to Photons")
         area_pix = self.ismConfig.pix_size * self.ismConfig.pix_size # [m2]
-        toa = self.irrad2Phot(toa, area_pix, self.ismConfig.t_int, self.ismConfig.wv[int(band[-1])])
+        toa = self.irrad2Phot(toa, area_pix, self.ismConfig.t_int, self.bandRegistry.wv(band))
 
         self.logger.debug("TOA [0,0] " +str(toa[0,0]) + " [ph]")
 
@@ -36,20 +55,20 @@ class detectionPhase(initIsm):
 
         if self.ismConfig.save_after_ph2e:
             saveas_str = self.globalConfig.ism_toa_e + band
-            writeToa(self.outdir, saveas_str, toa)
+            self.writer.submit(writeToa, self.outdir, saveas_str, toa)
 
         # PRNU
         # -------------------------------------------------------------------------------
         if self.ismConfig.apply_prnu:
 
             self.logger.info("EODP-ALG-ISM-2020: PRNU")
-            toa = self.prnu(toa, self.ismConfig.kprnu)
+            toa = self.prnu(toa, self.ismConfig.kprnu, self.bandRng(band, RNG_PRNU))
 
             self.logger.debug("TOA [0,0] " +str(toa[0,0]) + " [e-]")
 
             if self.ismConfig.save_after_prnu:
                 saveas_str = self.globalConfig.ism_toa_prnu + band
-                writeToa(self.outdir, saveas_str, toa)
+                self.writer.submit(writeToa, self.outdir, saveas_str, toa)
 
         # Dark-signal
         # -------------------------------------------------------------------------------
@@ -57,13 +76,14 @@ class detectionPhase(initIsm):
 
             self.logger.info("EODP-ALG-ISM-2020: Dark signal")
             toa = self.darkSignal(toa, self.ismConfig.kdsnu, self.ismConfig.T, self.ismConfig.Tref,
-                                  self.ismConfig.ds_A_coeff, self.ismConfig.ds_B_coeff)
+                                  self.ismConfig.ds_A_coeff, self.ismConfig.ds_B_coeff,
+                                  self.bandRng(band, RNG_DSNU))
 
             self.logger.debug("TOA [0,0] " +str(toa[0,0]) + " [e-]")
 
             if self.ismConfig.save_after_ds:
                 saveas_str = self.globalConfig.ism_toa_ds + band
-                writeToa(self.outdir, saveas_str, toa)
+                self.writer.submit(writeToa, self.outdir, saveas_str, toa)
 
         # Bad/dead pixels
         # -------------------------------------------------------------------------------
@@ -76,13 +96,35 @@ class detectionPhase(initIsm):
                                self.ismConfig.bad_pix_red,
                                self.ismConfig.dead_pix_red)
 
+        # Shot noise and read noise
+        # The noisy TOA is a new array: the previous one may be owned by the writer
+        # -------------------------------------------------------------------------------
+        if self.ismConfig.apply_shot_noise:
+
+            self.logger.info("EODP-ALG-ISM-2060: Shot noise")
+            toa = addShotNoise(toa, self.ismConfig.seed, (self.bandRegistry.index(band), RNG_SHOT),
+                               self.ismConfig.noise_nthreads, self.ismConfig.noise_block_lines,
+                               out=np.empty_like(toa))
+
+            self.logger.debug("TOA [0,0] " +str(toa[0,0]) + " [e-]")
+
+        if self.ismConfig.apply_read_noise:
+
+            self.logger.info("EODP-ALG-ISM-2070: Read noise")
+            toa = addReadNoise(toa, self.ismConfig.read_noise,
+                               self.ismConfig.seed, (self.bandRegistry.index(band), RNG_READ),
+                               self.ismConfig.noise_nthreads, self.ismConfig.noise_block_lines,
+                               out=np.empty_like(toa))
+
+            self.logger.debug("TOA [0,0] " +str(toa[0,0]) + " [e-]")
+
 
         # Write output TOA
         # -------------------------------------------------------------------------------
         if self.ismConfig.save_detection_stage:
             saveas_str = self.globalConfig.ism_toa_detection + band
 
-            writeToa(self.outdir, saveas_str, toa)
+            self.writer.submit(writeToa, self.outdir, saveas_str, toa)
 
             title_str = 'TOA after the detection phase [e-]'
             xlabel_str='ACT'
@@ -145,30 +187,78 @@ class detectionPhase(initIsm):
         """
         #TODO
 
-        # There are no bad pixels, therefore, no code is developed for this
-
-        toa[:, 4] *= 0.9 # Attenuate the values in the 5th column by 10%
+        columns, factors = self.defectMap(toa.shape[1], bad_pix, dead_pix, bad_pix_red, dead_pix_red)
+        toa = applyDefectMap(toa, columns, factors)
 
         return toa
 
-    def prnu(self, toa, kprnu):
+    def badDeadFactors(self, ncolumns, bad_pix, dead_pix, bad_pix_red, dead_pix_red):
+        """
+        Bad and dead pixels multiplicative factor per ACT column (see badDeadPixels for the parameters)
+        :param ncolumns: number of columns ACT
+        :return: factor per column [-]
+        """
+        columns, factors = self.defectMap(ncolumns, bad_pix, dead_pix, bad_pix_red, dead_pix_red)
+        col_factors = np.ones(ncolumns)
+        col_factors[columns] = factors
+
+        return col_factors
+
+    def defectMap(self, ncolumns, bad_pix, dead_pix, bad_pix_red, dead_pix_red):
+        """
+        Defect map of the detector (see common/src/defectMap.py), drawn with ismConfig.seed.
+        Kept in an on-disk cache keyed on the number of columns, the configuration and the seed.
+        :param ncolumns: number of columns ACT
+        :return: defective columns, factor per defective column [-]
+        """
+        key = defectMapKey(ncolumns, bad_pix, dead_pix, bad_pix_red, dead_pix_red, self.ismConfig.seed)
+        cachedir = self.auxdir + self.ismConfig.defect_cachedir
+        filename = 'defects_' + key + '.nc'
+
+        defects = readDefectMap(cachedir, filename, key)
+        if defects is None:
+            defects = drawDefectMap(ncolumns, bad_pix, dead_pix, bad_pix_red, dead_pix_red, self.ismConfig.seed)
+            writeDefectMap(cachedir, filename, defects[0], defects[1], key, ncolumns)
+
+        return defects
+
+    def exportDefectMap(self, ncolumns):
+        """
+        Write the defect map of the detector with the outputs (globalConfig.ism_defect_map), for the L1B
+        :param ncolumns: number of columns ACT
+        :return: NA
+        """
+        args = (ncolumns, self.ismConfig.bad_pix, self.ismConfig.dead_pix,
+                self.ismConfig.bad_pix_red, self.ismConfig.dead_pix_red)
+        columns, factors = self.defectMap(*args)
+        writeDefectMap(self.outdir, self.globalConfig.ism_defect_map, columns, factors,
+                       defectMapKey(*args, self.ismConfig.seed), ncolumns)
+
+    def prnu(self, toa, kprnu, rng):
         """
         Adding the PRNU effect
         :param toa: TOA pre-PRNU [e-]
         :param kprnu: multiplicative factor to the standard normal deviation for the PRNU
+        :param rng: random generator of the PRNU of the band
         :return: TOA after adding PRNU [e-]
         """
         #TODO
 
-        normal = np.random.normal(0.,1.,toa.shape[1])
-        toa_col = toa.shape[1]
-        for act in range(toa_col):
-            toa[:, act] = toa[:, act] * (1+normal[act]*kprnu)
+        toa = toa * self.prnuFactors(toa.shape[1], kprnu, rng)
 
         return toa
 
+    def prnuFactors(self, ncolumns, kprnu, rng):
+        """
+        PRNU multiplicative factor per ACT column
+        :param ncolumns: number of columns ACT
+        :param kprnu: multiplicative factor to the standard normal deviation for the PRNU
+        :param rng: random generator of the PRNU of the band
+        :return: factor per column [-]
+        """
+        return 1 + rng.standard_normal(ncolumns) * kprnu
 
-    def darkSignal(self, toa, kdsnu, T, Tref, ds_A_coeff, ds_B_coeff):
+    def darkSignal(self, toa, kdsnu, T, Tref, ds_A_coeff, ds_B_coeff, rng):
         """
         Dark signal simulation
         :param toa: TOA in [e-]
@@ -177,16 +267,21 @@ class detectionPhase(initIsm):
         :param Tref: Reference temperature of the system
         :param ds_A_coeff: Empirical parameter of the model 7.87 e-
         :param ds_B_coeff: Empirical parameter of the model 6040 K
+        :param rng: random generator of the DSNU of the band
         :return: TOA in [e-] with dark signal
         """
         #TODO
 
-        Sd = ds_A_coeff * (T / Tref) ** 3 * np.exp(-ds_B_coeff * (1 / T - 1 / Tref))
-
-        Ds = Sd*(1 + np.abs(np.random.normal(0,1,toa.shape[1])*kdsnu))
-
-        for act in range(toa.shape[1]):
-            toa[:, act] = toa[:, act] + Ds[act]
+        toa = toa + self.darkSignalOffsets(toa.shape[1], kdsnu, T, Tref, ds_A_coeff, ds_B_coeff, rng)
 
         return toa
 
+    def darkSignalOffsets(self, ncolumns, kdsnu, T, Tref, ds_A_coeff, ds_B_coeff, rng):
+        """
+        Dark signal per ACT column (see darkSignal for the parameters)
+        :param ncolumns: number of columns ACT
+        :return: dark signal per column [e-]
+        """
+        Sd = ds_A_coeff * (T / Tref) ** 3 * np.exp(-ds_B_coeff * (1 / T - 1 / Tref))
+
+        return Sd * (1 + np.abs(rng.standard_normal(ncolumns) * kdsnu))
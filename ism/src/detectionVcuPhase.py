@@ -0,0 +1,210 @@
+
+# FUSED DETECTION AND VIDEO CHAIN PHASES
+# From irradiances to digital numbers, the detection and video chain phases are a gain and an
+# offset per ACT column followed by rounding and clipping. They are applied in one pass per block
+# of lines, straight into the integer DN buffer, counting the saturated pixels on the way.
+# The intermediate outputs of the stages are only computed if their save flags are set.
+
+from ism.src.detectionPhase import detectionPhase, RNG_PRNU, RNG_DSNU, RNG_SHOT, RNG_READ
+from ism.src.videoChainPhase import videoChainPhase
+import numpy as np
+from common.io.writeToa import writeToa
+from common.plot.plotMat2D import plotMat2D
+from common.plot.plotF import plotF
+from scipy.constants import Planck, c
+from common.src.parallelRng import addShotNoise, addReadNoise
+
+class detectionVcuPhase(detectionPhase):
+
+    def __init__(self, auxdir, indir, outdir):
+        super().__init__(auxdir, indir, outdir)
+
+    def compute(self, toa, band):
+
+        # The shot and read noises are not a gain and an offset per column: staged phases
+        if self.ismConfig.apply_shot_noise or self.ismConfig.apply_read_noise:
+            toa = super().compute(toa, band)
+            return videoChainPhase(self.auxdir, self.indir, self.outdir).compute(toa, band)
+
+        self.logger.info("EODP-ALG-ISM-2000: Detection stage")
+        self.logger.info("EODP-ALG-ISM-3000: Video Chain (fused with the detection stage)")
+
+        # Gain and offset per column after each stage
+        # -------------------------------------------------------------------------------
+        stages = self.columnAffine(toa.shape[1], band)
+
+        # Intermediate outputs, only if requested
+        # -------------------------------------------------------------------------------
+        saves = [('e', self.ismConfig.save_after_ph2e, self.globalConfig.ism_toa_e),
+                 ('prnu', self.ismConfig.save_after_prnu and self.ismConfig.apply_prnu, self.globalConfig.ism_toa_prnu),
+                 ('ds', self.ismConfig.save_after_ds and self.ismConfig.apply_dark_signal, self.globalConfig.ism_toa_ds),
+                 ('detection', self.ismConfig.save_detection_stage, self.globalConfig.ism_toa_detection)]
+        for stage, save, name in saves:
+            if not save:
+                continue
+            gain, offset = stages[stage]
+            toa_stage = toa * gain + offset
+            self.writer.submit(writeToa, self.outdir, name + band, toa_stage)
+
+            if stage == 'detection':
+                title_str = 'TOA after the detection phase [e-]'
+                xlabel_str='ACT'
+                ylabel_str='ALT'
+                plotMat2D(toa_stage, title_str, xlabel_str, ylabel_str, self.outdir, name + band)
+
+                idalt = int(toa.shape[0]/2)
+                plotF([], toa_stage[idalt,:], title_str, xlabel_str, ylabel_str, self.outdir, name + band + '_alt' + str(idalt))
+
+        # Gain, offset, rounding and clipping in one pass
+        # -------------------------------------------------------------------------------
+        gain, offset = stages['dn']
+        max_dn = 2 ** self.ismConfig.bit_depth - 1
+        toa_dn, saturated_pixels = self.applyAffine(toa, gain, offset, max_dn, self.ismConfig.vcu_block_lines)
+
+        saturated_percentage = (saturated_pixels / toa_dn.size) * 100
+        print(f" -+-+-+- Percentage of saturated pixels: {saturated_percentage:.2f}%")
+        self.logger.debug("TOA [0,0] " +str(toa_dn[0,0]) + " [DN]")
+
+        # Plot
+        if self.ismConfig.save_vcu_stage:
+            saveas_str = self.globalConfig.ism_toa_vcu + band
+            title_str = 'TOA after the VCU phase [DN]'
+            xlabel_str='ACT'
+            ylabel_str='ALT'
+            plotMat2D(toa_dn, title_str, xlabel_str, ylabel_str, self.outdir, saveas_str)
+
+            idalt = int(toa_dn.shape[0]/2)
+            saveas_str = saveas_str + '_alt' + str(idalt)
+            plotF([], toa_dn[idalt,:], title_str, xlabel_str, ylabel_str, self.outdir, saveas_str)
+
+        return toa_dn
+
+    def columnAffine(self, ncolumns, band, realisation=None):
+        """
+        Gain and offset per ACT column from the TOA in irradiances to each stage:
+        TOA_stage = TOA * gain + offset
+        :param ncolumns: number of columns ACT
+        :param band: band
+        :param realisation: realisation of a noise ensemble (None for the nominal one)
+        :return: dictionary stage ('e', 'prnu', 'ds', 'detection', 'dn' before rounding) -> (gain, offset)
+        """
+        stages = {}
+
+        # Irradiances to photons to electrons (see irrad2Phot, phot2Electr)
+        area_pix = self.ismConfig.pix_size * self.ismConfig.pix_size # [m2]
+        gain = np.full(ncolumns, area_pix * self.ismConfig.t_int * self.bandRegistry.wv(band) / (Planck * c)
+                       * self.ismConfig.QE)
+        offset = np.zeros(ncolumns)
+        stages['e'] = (gain, offset)
+
+        # PRNU
+        if self.ismConfig.apply_prnu:
+            gain = gain * self.prnuFactors(ncolumns, self.ismConfig.kprnu, self.bandRng(band, RNG_PRNU, realisation))
+        stages['prnu'] = (gain, offset)
+
+        # Dark signal
+        if self.ismConfig.apply_dark_signal:
+            offset = offset + self.darkSignalOffsets(ncolumns, self.ismConfig.kdsnu, self.ismConfig.T, self.ismConfig.Tref,
+                                                     self.ismConfig.ds_A_coeff, self.ismConfig.ds_B_coeff,
+                                                     self.bandRng(band, RNG_DSNU, realisation))
+        stages['ds'] = (gain, offset)
+
+        # Bad/dead pixels
+        if self.ismConfig.apply_bad_dead:
+            factors = self.badDeadFactors(ncolumns,
+                                          self.ismConfig.bad_pix,
+                                          self.ismConfig.dead_pix,
+                                          self.ismConfig.bad_pix_red,
+                                          self.ismConfig.dead_pix_red)
+            gain = gain * factors
+            offset = offset * factors
+        stages['detection'] = (gain, offset)
+
+        # Electrons to volts to digital numbers (see videoChainPhase.electr2Volt, digitisation)
+        e2dn = self.dnFactor()
+        stages['dn'] = (gain * e2dn, offset * e2dn)
+
+        return stages
+
+    def dnFactor(self):
+        """
+        Conversion factor from electrons to digital numbers (see videoChainPhase.electr2Volt, digitisation)
+        :return: factor [DN/e-]
+        """
+        return self.ismConfig.OCF * self.ismConfig.ADC_gain \
+               / (self.ismConfig.max_voltage - self.ismConfig.min_voltage) * (2 ** self.ismConfig.bit_depth - 1)
+
+    def computeStream(self, blocks, ncolumns, band):
+        """
+        Streaming detection and video chain phases. The gain and offset per column are drawn
+        once for the whole strip. With shot or read noise, the blocks must be a multiple of
+        ismConfig.noise_block_lines lines (but the last one), so that the noise is the same as
+        for the whole image. The intermediate outputs are not written.
+        :param blocks: iterable of blocks of lines of the TOA in irradiances [mW/m2]
+        :param ncolumns: columns ACT
+        :param band: band
+        :return: generator of blocks of lines of the TOA in digital numbers
+        """
+        self.logger.info("EODP-ALG-ISM-2000: Detection stage")
+        self.logger.info("EODP-ALG-ISM-3000: Video Chain (fused with the detection stage)")
+
+        noise = self.ismConfig.apply_shot_noise or self.ismConfig.apply_read_noise
+        stages = self.columnAffine(ncolumns, band)
+        max_dn = 2 ** self.ismConfig.bit_depth - 1
+        e2dn = np.full(ncolumns, self.dnFactor())
+        key = self.bandRegistry.index(band)
+        block_lines = self.ismConfig.noise_block_lines
+
+        nlines = 0
+        saturated_pixels = 0
+        for toa in blocks:
+            if noise:
+                # Electrons, noise and digitisation
+                if nlines % block_lines:
+                    raise Exception('Block of the stream not aligned with the noise blocks of ' + str(block_lines) + ' lines')
+                gain, offset = stages['detection']
+                toa = toa * gain + offset
+                if self.ismConfig.apply_shot_noise:
+                    addShotNoise(toa, self.ismConfig.seed, (key, RNG_SHOT),
+                                 self.ismConfig.noise_nthreads, block_lines, nlines // block_lines)
+                if self.ismConfig.apply_read_noise:
+                    addReadNoise(toa, self.ismConfig.read_noise, self.ismConfig.seed, (key, RNG_READ),
+                                 self.ismConfig.noise_nthreads, block_lines, nlines // block_lines)
+                toa_dn, saturated = self.applyAffine(toa, e2dn, 0., max_dn, self.ismConfig.vcu_block_lines)
+            else:
+                gain, offset = stages['dn']
+                toa_dn, saturated = self.applyAffine(toa, gain, offset, max_dn, self.ismConfig.vcu_block_lines)
+
+            nlines += toa_dn.shape[0]
+            saturated_pixels += saturated
+            yield toa_dn
+
+        saturated_percentage = (saturated_pixels / max(nlines * ncolumns, 1)) * 100
+        print(f" -+-+-+- Percentage of saturated pixels: {saturated_percentage:.2f}%")
+
+    def applyAffine(self, toa, gain, offset, max_dn, block_lines=64):
+        """
+        Gain and offset per column, rounding and clipping to [0, max_dn], written into an integer buffer
+        :param toa: input TOA
+        :param gain: gain per column
+        :param offset: offset per column
+        :param max_dn: maximum digital number
+        :param block_lines: lines per block (the block stays in cache through all the operations)
+        :return: TOA in digital numbers (unsigned integers), number of saturated pixels
+        """
+        dtype = np.uint16 if max_dn < 2 ** 16 else np.uint32
+        toa_dn = np.empty(toa.shape, dtype=dtype)
+        saturated_pixels = 0
+
+        tmp = np.empty((block_lines, toa.shape[1]))
+        for ialt in range(0, toa.shape[0], block_lines):
+            block = toa[ialt:ialt + block_lines]
+            out = tmp[:block.shape[0]]
+            np.multiply(block, gain, out=out)
+            out += offset
+            np.rint(out, out=out)
+            np.clip(out, 0, max_dn, out=out)
+            saturated_pixels += np.count_nonzero(out == max_dn)
+            toa_dn[ialt:ialt + block.shape[0]] = out
+
+        return toa_dn, saturated_pixels
@@ -0,0 +1,80 @@
+
+# FFT ENGINE FOR THE APPLICATION OF THE SYSTEM MTF
+# Real-to-complex transforms on a pre-shifted half-spectrum MTF, multi-threaded
+# through scipy.fft, optionally in single precision and on mirror-padded images
+# of FFT-friendly sizes.
+
+import numpy as np
+from scipy import fft as sfft
+from collections import OrderedDict
+import threading
+
+# Half-spectrum MTFs already prepared, keyed on the identity of Hsys (the MTFs are cached and shared)
+_halfCache = OrderedDict()
+_halfCacheLock = threading.Lock()
+HALF_CACHE_SIZE = 8
+
+def halfSpectrumMtf(Hsys, single=False):
+    """
+    Shifted MTF (DC in the first pixel) restricted to the half spectrum of rfft2.
+    The MTF is symmetrised, H(k) <- (H(k) + H(-k))/2, which is what the real part of a
+    full complex transform applies to a real image, so the result is the same.
+    :param Hsys: System MTF, centred (as from mtf.system_mtf)
+    :param single: float32 output
+    :return: half-spectrum MTF of size nlines x (ncolumns//2 + 1)
+    """
+    key = (id(Hsys), Hsys.shape, single)
+    with _halfCacheLock:
+        if key in _halfCache and _halfCache[key][0] is Hsys:
+            _halfCache.move_to_end(key)
+            return _halfCache[key][1]
+
+    nhalf = Hsys.shape[1] // 2 + 1
+    Hs = np.fft.fftshift(Hsys)
+    Hneg = np.roll(Hs[::-1, ::-1], 1, axis=(0, 1)) # H(-k)
+    Hhalf = 0.5 * (Hs[:, :nhalf] + Hneg[:, :nhalf])
+    if single:
+        Hhalf = Hhalf.astype(np.float32)
+    Hhalf.setflags(write=False)
+
+    with _halfCacheLock:
+        _halfCache[key] = (Hsys, Hhalf)
+        while len(_halfCache) > HALF_CACHE_SIZE:
+            _halfCache.popitem(last=False)
+
+    return Hhalf
+
+def paddedShape(shape, margin):
+    """
+    FFT-friendly shape with at least margin pixels of padding on each side
+    :param shape: image shape
+    :param margin: minimum padding per side [pixels]
+    :return: padded shape
+    """
+    return tuple(sfft.next_fast_len(n + 2 * margin, real=True) for n in shape)
+
+def applyMtfFft(toa, Hsys, workers=-1, single=False):
+    """
+    Application of the system MTF with real-to-complex FFTs.
+    If the MTF is larger than the image, the image is mirror-padded to the MTF size
+    (avoids the circular wrap of the image edges) and cropped back after filtering.
+    :param toa: input image
+    :param Hsys: System MTF, centred (as from mtf.system_mtf)
+    :param workers: threads of scipy.fft (-1 for all cores)
+    :param single: single precision transforms (complex64)
+    :return: filtered image, same size as toa
+    """
+    nlines, ncolumns = toa.shape
+    dtype = np.float32 if single else np.float64
+
+    # Mirror padding up to the size of the MTF
+    pad = [(0, 0), (0, 0)]
+    if Hsys.shape != toa.shape:
+        pad = [((N - n) // 2, N - n - (N - n) // 2) for N, n in zip(Hsys.shape, toa.shape)]
+        toa = np.pad(toa, pad, mode='symmetric')
+
+    GE = sfft.rfft2(np.asarray(toa, dtype=dtype), workers=workers)
+    GE *= halfSpectrumMtf(Hsys, single)
+    toa_ft = sfft.irfft2(GE, s=Hsys.shape, workers=workers, overwrite_x=True)
+
+    return toa_ft[pad[0][0]:pad[0][0] + nlines, pad[1][0]:pad[1][0] + ncolumns]
@@ -0,0 +1,97 @@
+
+# FIELD-DEPENDENT SYSTEM MTF
+# The image is split ACT in overlapping tiles centred on equally spaced nodes. Each tile is
+# filtered with the system MTF of its node and the tiles are blended by overlap-add with
+# triangular weights (a partition of unity), so the PSF varies linearly ACT between nodes.
+# Every column is filtered twice (two overlapping tiles), plus the margins. The image edges ACT are mirrored.
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from ism.src.fftEngine import applyMtfFft
+
+# Parameters of the system MTF that may vary with the field
+FIELD_PARAMS = ['kLF', 'wLF', 'kHF', 'wHF', 'defocus', 'ksmear', 'kmotion']
+
+def fieldNodes(ncolumns, tile_columns):
+    """
+    Tile centres ACT: equally spaced, first and last on the image edges
+    :param ncolumns: columns ACT
+    :param tile_columns: maximum distance between nodes [columns]
+    :return: node positions [columns]
+    """
+    nnodes = max(2, int(np.ceil((ncolumns - 1) / tile_columns)) + 1)
+    return np.linspace(0, ncolumns - 1, nnodes)
+
+def fieldPosition(columns, ncolumns):
+    """
+    Field position ACT: distance to the swath centre, normalised to the half swath
+    :param columns: column positions
+    :param ncolumns: columns ACT
+    :return: field position [0-1]
+    """
+    half = max((ncolumns - 1) / 2, 1)
+    return np.abs(np.asarray(columns, dtype=float) - (ncolumns - 1) / 2) / half
+
+def fieldTiles(nodes, ncolumns):
+    """
+    Columns covered by the tile of each node and their blending weights
+    :param nodes: node positions [columns]
+    :param ncolumns: columns ACT
+    :return: list of (first column, last column + 1, weights)
+    """
+    cols = np.arange(ncolumns)
+    tiles = []
+    for i, x in enumerate(nodes):
+        left = nodes[i - 1] if i > 0 else x
+        right = nodes[i + 1] if i < len(nodes) - 1 else x
+        lo, hi = int(np.ceil(left)), int(np.floor(right)) + 1
+        c = cols[lo:hi]
+        w = np.ones(hi - lo)
+        if x > left:
+            w = np.where(c < x, (c - left) / (x - left), w)
+        if right > x:
+            w = np.where(c > x, (right - c) / (right - x), w)
+        tiles.append((lo, hi, w))
+    return tiles
+
+def applyFieldMtf(toa, mtfFunc, nodes, margin, nthreads=1, workers=-1, single=False):
+    """
+    Application of a field-dependent system MTF by overlap-add of tiles
+    :param toa: input image
+    :param mtfFunc: mtfFunc(nlines, ncolumns, inode) -> system MTF (centred) of node inode, for a tile of that size
+    :param nodes: node positions ACT [columns] (see fieldNodes)
+    :param margin: margin per side of the tiles [columns]. Support of the PSF ACT
+    :param nthreads: tiles filtered in parallel
+    :param workers: threads of scipy.fft within each tile
+    :param single: single precision transforms
+    :return: filtered image, same size as toa
+    """
+    nlines, ncolumns = toa.shape
+    tiles = fieldTiles(nodes, ncolumns)
+    padded = np.pad(toa, ((0, 0), (margin, margin + 1)), mode='symmetric')
+    if nthreads > 1:
+        workers = 1
+
+    def work(inode):
+        lo, hi, w = tiles[inode]
+        # Even widths: the MTF frequency grid then contains the zero frequency
+        width = hi - lo + 2 * margin
+        width += width % 2
+        sub = padded[:, lo:lo + width]
+        Hsys = mtfFunc(nlines, width, inode)
+        out = applyMtfFft(sub, Hsys, workers, single)[:, margin:margin + hi - lo]
+        out *= w
+        return out
+
+    toa_ft = np.zeros((nlines, ncolumns))
+    if nthreads > 1:
+        with ThreadPoolExecutor(max_workers=nthreads) as pool:
+            results = list(pool.map(work, range(len(tiles))))
+    else:
+        results = [work(inode) for inode in range(len(tiles))]
+
+    # Sum in a fixed order (same result whatever the number of threads)
+    for (lo, hi, w), out in zip(tiles, results):
+        toa_ft[:, lo:hi] += out
+
+    return toa_ft
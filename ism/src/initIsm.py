@@ -1,5 +1,7 @@
 from config.ismConfig import ismConfig
+from config.l1bConfig import l1bConfig
 from common.src.baseModule import baseModule
+from common.src.bandRegistry import bandRegistry
 
 class initIsm(baseModule):
 
@@ -11,5 +13,8 @@ class initIsm(baseModule):
         # Init Local config
         self.ismConfig = ismConfig()
 
+        # Band registry (central wavelength, gain and ISRF per band)
+        self.bandRegistry = bandRegistry(self.globalConfig, self.ismConfig, l1bConfig(), self.auxdir)
+
         # Make sure the logger is enabled
         self.logger.disabled = False
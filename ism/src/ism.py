@@ -5,8 +5,15 @@ from ism.src.initIsm import initIsm
 from ism.src.opticalPhase import opticalPhase
 from ism.src.detectionPhase import detectionPhase
 from ism.src.videoChainPhase import videoChainPhase
-from common.io.readCube import readCube
-from common.io.writeToa import writeToa
+from ism.src.detectionVcuPhase import detectionVcuPhase
+from ism.src.noiseEnsemble import noiseEnsemble
+from common.io.readCube import readCube, readCubeInfo
+from common.io.readCubePca import readCubePca
+from common.io.writeToa import writeToa, createToa, appendToa, closeToa
+from ism.src.mtfStream import rechunk
+from common.src.sharedArray import shareArray, attachArray, processContext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from common.plot.plotDispatch import flushPlots, shutdownPlots
 
 class ism(initIsm):
 
@@ -15,21 +22,79 @@ class ism(initIsm):
 
     def processModule(self):
 
+        if self.ismConfig.stream_ism:
+            return self.processModuleStream()
+
         self.logger.info("Start of the Instrument Module")
 
-        # Read input TOA cube
+        myOpt = opticalPhase(self.auxdir, self.indir, self.outdir)
+
+        # Read the input TOA cube and integrate all the bands with their ISRF
+        # -------------------------------------------------------------------------------
+        self.logger.info("EODP-ALG-ISM-1010: Spectral modelling. ISRF (all bands)")
+        if self.ismConfig.use_pca_scene:
+            # PCA-compressed cube (see mainCompressCube), integrated in the compressed domain
+            sgm_toa, sgm_wv = readCubePca(self.indir, self.globalConfig.scene_pca)
+            toa_isrf = myOpt.spectralIntegrationBands(sgm_toa, sgm_wv, self.globalConfig.bands)
+            del sgm_toa
+        elif self.ismConfig.isrf_window_read:
+            # Only the wavelengths within the ISRF support of the bands are read
+            toa_isrf = myOpt.spectralIntegrationFile(self.indir, self.globalConfig.scene, self.globalConfig.bands)
+        else:
+            # Whole cube, all bands in one pass
+            sgm_toa, sgm_wv = readCube(self.indir, self.globalConfig.scene)
+            toa_isrf = myOpt.spectralIntegrationBands(sgm_toa, sgm_wv, self.globalConfig.bands)
+            del sgm_toa
+
+        # Defect pixel map of the detector, for the L1B
         # -------------------------------------------------------------------------------
-        sgm_toa, sgm_wv = readCube(self.indir, self.globalConfig.scene)
+        if self.ismConfig.apply_bad_dead:
+            detectionPhase(self.auxdir, self.indir, self.outdir).exportDefectMap(toa_isrf.shape[1])
+
+        if self.ismConfig.band_workers > 1 and len(self.globalConfig.bands) > 1:
+            if self.ismConfig.band_executor == 'thread':
+                # Bands in parallel threads
+                self.processBandsThreads(toa_isrf, self.ismConfig.band_workers)
+            else:
+                # Bands in parallel, in worker processes sharing the integrated cube
+                self.processBandsParallel(toa_isrf, self.ismConfig.band_workers)
+        else:
+            for iband, band in enumerate(self.globalConfig.bands):
+                self.processBand(toa_isrf[:, :, iband], band)
+
+        # Wait for the pending writes and plots
+        self.writer.flush()
+        flushPlots()
 
-        for band in self.globalConfig.bands:
+        self.logger.info("End of the Instrument Module!")
 
-            self.logger.info("Start of BAND " + band)
+    def processBand(self, toa_isrf, band):
+        """
+        Optical (after the ISRF), detection and video chain phases of one band
+        :param toa_isrf: TOA of the band after the ISRF [mW/m2/sr]
+        :param band: band
+        """
+        self.logger.info("Start of BAND " + band)
 
-            # Optical Phase
-            # -------------------------------------------------------------------------------
-            myOpt = opticalPhase(self.auxdir, self.indir, self.outdir)
-            toa = myOpt.compute(sgm_toa, sgm_wv, band)
+        myOpt = opticalPhase(self.auxdir, self.indir, self.outdir)
+
+        # Optical Phase
+        # -------------------------------------------------------------------------------
+        self.logger.info("EODP-ALG-ISM-1000: Optical stage")
+        toa = myOpt.computeFromIsrf(toa_isrf, band)
 
+        # Noise ensemble (per-pixel summaries of the PRNU/DSNU realisations)
+        # -------------------------------------------------------------------------------
+        if self.ismConfig.ensemble_size > 0:
+            myEnsemble = noiseEnsemble(self.auxdir, self.indir, self.outdir)
+            myEnsemble.compute(toa, band)
+
+        if self.ismConfig.fused_detection_vcu:
+            # Detection Stage and Video Chain Phase in one pass
+            # -------------------------------------------------------------------------------
+            myDetVcu = detectionVcuPhase(self.auxdir, self.indir, self.outdir)
+            toa = myDetVcu.compute(toa, band)
+        else:
             # Detection Stage
             # -------------------------------------------------------------------------------
             Det = detectionPhase(self.auxdir, self.indir, self.outdir)
@@ -40,12 +105,125 @@ class ism(initIsm):
             myVcu = videoChainPhase(self.auxdir, self.indir, self.outdir)
             toa = myVcu.compute(toa, band)
 
-            # Write output TOA
+        # Write output TOA
+        # -------------------------------------------------------------------------------
+        self.writer.submit(writeToa, self.outdir, self.globalConfig.ism_toa + band, toa, self.ismConfig.toa_format)
+
+        self.logger.info("End of BAND " + band)
+
+    def processBandsParallel(self, toa_isrf, workers):
+        """
+        Bands in parallel worker processes. The integrated cube is shared with the workers
+        (shared memory, no copies) and each band is processed as in the serial loop, so the
+        outputs are identical to the serial run
+        :param toa_isrf: TOA after the ISRF, ALT x ACT x bands [mW/m2/sr]
+        :param workers: number of worker processes
+        """
+        self.logger.info("Bands in " + str(workers) + " worker processes")
+        self.writer.flush() # errors of the pending writes raised before starting the workers
+        shm, shared = shareArray(toa_isrf)
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=processContext()) as pool:
+                futures = [pool.submit(bandWorker, self.auxdir, self.indir, self.outdir, shared, iband, band)
+                           for iband, band in enumerate(self.globalConfig.bands)]
+                for future in futures:
+                    future.result()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def processBandsThreads(self, toa_isrf, workers):
+        """
+        Bands in parallel threads. The numpy, FFT and netCDF sections release the GIL; the
+        random streams are per band, so the outputs are identical to the serial run
+        :param toa_isrf: TOA after the ISRF, ALT x ACT x bands [mW/m2/sr]
+        :param workers: number of threads
+        """
+        self.logger.info("Bands in " + str(workers) + " threads")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self.processBand, toa_isrf[:, :, iband], band)
+                       for iband, band in enumerate(self.globalConfig.bands)]
+            for future in futures:
+                future.result()
+
+    def processModuleStream(self):
+        """
+        Instrument Module in blocks of lines ALT (ismConfig.stream_ism): per band, the scene is read
+        in blocks of ismConfig.stream_read_lines lines (only the ISRF support of the band), integrated
+        with the ISRF, filtered with the system MTF by overlap-save, detected, digitised and appended
+        to the output file. Memory is bounded by the block size, not by the scene size.
+        No intermediate products are written (the MTF included). The output matches the standard
+        ISM within the residual of the truncated overlap-save kernel (see mtfStream).
+        """
+        self.logger.info("Start of the Instrument Module (streaming in blocks of lines ALT)")
+
+        for flag in ['use_pca_scene', 'do_psf_conv', 'field_mtf']:
+            if getattr(self.ismConfig, flag):
+                self.logger.warning("ismConfig." + flag + " is not available in the streaming mode. Ignored")
+        if self.ismConfig.ensemble_size > 0:
+            self.logger.warning("The noise ensemble is not available in the streaming mode. Ignored")
+
+        myOpt = opticalPhase(self.auxdir, self.indir, self.outdir)
+        myDetVcu = detectionVcuPhase(self.auxdir, self.indir, self.outdir)
+
+        sgm_wv, shape = readCubeInfo(self.indir, self.globalConfig.scene)
+        ncolumns = shape[1]
+
+        # Defect pixel map of the detector, for the L1B
+        # -------------------------------------------------------------------------------
+        if self.ismConfig.apply_bad_dead:
+            myDetVcu.exportDefectMap(ncolumns)
+
+        # Output blocks, multiple of the blocks of the random streams of the noises
+        block_lines = -(-self.ismConfig.stream_read_lines // self.ismConfig.noise_block_lines) \
+                      * self.ismConfig.noise_block_lines
+
+        for band in self.globalConfig.bands:
+
+            self.logger.info("Start of BAND " + band)
+
+            # Spectral integration, optical, detection and video chain phases, block by block
+            # -------------------------------------------------------------------------------
+            self.logger.info("EODP-ALG-ISM-1010: Spectral modelling. ISRF")
+            blocks = myOpt.spectralIntegrationStream(self.indir, self.globalConfig.scene, band,
+                                                     self.ismConfig.stream_read_lines)
+            blocks = myOpt.computeStream(blocks, ncolumns, band)
+            blocks = myDetVcu.computeStream(rechunk(blocks, block_lines), ncolumns, band)
+
+            # Write output TOA, block by block
             # -------------------------------------------------------------------------------
-            writeToa(self.outdir, self.globalConfig.ism_toa + band, toa)
+            ncout = createToa(self.outdir, self.globalConfig.ism_toa + band, ncolumns,
+                              self.ismConfig.toa_format, min(block_lines, shape[0]))
+            for toa in blocks:
+                appendToa(ncout, toa)
+            closeToa(ncout)
 
             self.logger.info("End of BAND " + band)
 
-        self.logger.info("End of the Instrument Module!")
+        # Wait for the pending writes and plots
+        self.writer.flush()
+        flushPlots()
 
+        self.logger.info("End of the Instrument Module!")
 
+def bandWorker(auxdir, indir, outdir, shared, iband, band):
+    """
+    Worker process of ism.processBandsParallel: processes one band of the shared integrated cube
+    :param auxdir: auxiliary directory
+    :param indir: input directory
+    :param outdir: output directory
+    :param shared: descriptor of the shared TOA after the ISRF (see shareArray)
+    :param iband: index of the band in the cube
+    :param band: band
+    """
+    shm, toa_isrf = attachArray(shared)
+    try:
+        myIsm = ism(auxdir, indir, outdir)
+        try:
+            myIsm.processBand(toa_isrf[:, :, iband], band)
+        finally:
+            myIsm.writer.flush() # the writes may refer to the shared cube
+            shutdownPlots()     # the plot pool of the worker, if any, does not outlive the band
+    finally:
+        del toa_isrf
+        shm.close()
@@ -0,0 +1,249 @@
+
+# ISRF SPECTRAL INTEGRATION OPERATOR
+# The interpolation of the SGM spectra onto the ISRF grid and the ISRF weighting
+# are both linear, so they are collapsed into a single (sparse) operator that is
+# built once per wavelength grid and applied to the whole cube in one contraction.
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from concurrent.futures import ThreadPoolExecutor
+
+def interpMatrix(wv_in, wv_out):
+    """
+    Linear interpolation as a sparse matrix. Equivalent to
+    interp1d(wv_in, y, fill_value=(0, 0), bounds_error=False)(wv_out)
+    :param wv_in: input wavelengths (1D)
+    :param wv_out: output wavelengths (1D)
+    :return: sparse matrix of size len(wv_out) x len(wv_in)
+    """
+    wv_in = np.asarray(wv_in, dtype=np.float64)
+    wv_out = np.asarray(wv_out, dtype=np.float64)
+
+    # interp1d sorts the input grid, do the same and map back to the original indices
+    order = np.argsort(wv_in, kind='mergesort')
+    xs = wv_in[order]
+
+    # Bracketing samples (same convention as interp1d)
+    hi = np.clip(np.searchsorted(xs, wv_out, side='left'), 1, len(xs) - 1)
+    lo = hi - 1
+    w_hi = (wv_out - xs[lo]) / (xs[hi] - xs[lo])
+    w_lo = 1.0 - w_hi
+
+    # Out of bounds samples are filled with zeros
+    inside = (wv_out >= xs[0]) & (wv_out <= xs[-1])
+    w_hi[~inside] = 0.
+    w_lo[~inside] = 0.
+
+    rows = np.concatenate((np.arange(len(wv_out)), np.arange(len(wv_out))))
+    cols = np.concatenate((order[lo], order[hi]))
+    vals = np.concatenate((w_lo, w_hi))
+
+    return csr_matrix((vals, (rows, cols)), shape=(len(wv_out), len(wv_in)))
+
+def isrfWeights(sgm_wv, wv_isrf, isrf):
+    """
+    Spectral weights of one band over the input wavelength grid.
+    Composition of the linear interpolation onto the ISRF grid and the
+    normalised ISRF integration.
+    :param sgm_wv: wavelengths of the input TOA cube [nm]
+    :param wv_isrf: wavelengths of the ISRF [nm]
+    :param isrf: ISRF (not normalised)
+    :return: weights, 1D array of size len(sgm_wv)
+    """
+    isrf_step = wv_isrf[1] - wv_isrf[0]
+
+    # Normalised ISRF times the integration step. Eq. pag 33
+    isrf_norm = isrf / (np.sum(isrf) * isrf_step)
+
+    A = interpMatrix(sgm_wv, wv_isrf)
+    return np.asarray(A.T @ (isrf_norm * isrf_step)).ravel()
+
+def isrfColumnWeights(sgm_wv, wv_isrf, isrf):
+    """
+    Spectral weights of one band for every ACT column (spectral smile).
+    Same operator as isrfWeights, built for all the columns at once.
+    :param sgm_wv: wavelengths of the input TOA cube [nm]
+    :param wv_isrf: wavelengths of the ISRF [nm], 1D or 2D (columns x ISRF samples)
+    :param isrf: ISRF (not normalised), 1D or 2D (columns x ISRF samples)
+    :return: sparse matrix of size ncolumns x len(sgm_wv)
+    """
+    wv_isrf = np.atleast_2d(wv_isrf)
+    isrf = np.atleast_2d(isrf)
+    ncol = max(wv_isrf.shape[0], isrf.shape[0])
+    wv_isrf = np.broadcast_to(wv_isrf, (ncol, wv_isrf.shape[1]))
+    isrf = np.broadcast_to(isrf, (ncol, isrf.shape[1]))
+    nisrf = isrf.shape[1]
+
+    # The normalised ISRF times the (per column) step is isrf/sum(isrf). Eq. pag 33
+    isrf_norm = isrf / np.sum(isrf, axis=1, keepdims=True)
+
+    # Sum over the ISRF samples of each column
+    S = csr_matrix((isrf_norm.ravel(), np.arange(ncol * nisrf), np.arange(0, ncol * nisrf + 1, nisrf)),
+                   shape=(ncol, ncol * nisrf))
+    A = interpMatrix(sgm_wv, wv_isrf.ravel())
+
+    return (S @ A).tocsr()
+
+def smileGrid(wv_isrf, isrf, shift, width, ncolumns):
+    """
+    Wavelengths of the ISRF for each ACT column, for an ISRF whose centre
+    shifts and whose width scales across the columns (parametric smile)
+    :param wv_isrf: wavelengths of the ISRF [nm]
+    :param isrf: ISRF (not normalised)
+    :param shift: centre shift per column [nm] (scalar or ncolumns)
+    :param width: width factor per column [-] (scalar or ncolumns)
+    :param ncolumns: number of ACT columns
+    :return: wavelengths of the ISRF per column, ncolumns x len(wv_isrf) [nm]
+    """
+    wv0 = np.sum(isrf * wv_isrf) / np.sum(isrf) # ISRF centroid
+    shift = np.broadcast_to(np.asarray(shift, dtype=np.float64), (ncolumns,))
+    width = np.broadcast_to(np.asarray(width, dtype=np.float64), (ncolumns,))
+
+    return wv0 + shift[:, None] + width[:, None] * (wv_isrf[None, :] - wv0)
+
+def weightsOperator(weights):
+    """
+    Stack the spectral weights of one or several bands as a sparse operator
+    :param weights: list of 1D weights (or a single 1D array)
+    :return: sparse matrix of size nwv x nbands
+    """
+    weights = np.atleast_2d(np.asarray(weights))
+    return csr_matrix(weights.T)
+
+def supportWindow(W):
+    """
+    First and last+1 wavelength index where the operator is not zero
+    :param W: sparse operator nwv x nbands
+    :return: (i0, i1)
+    """
+    rows = np.unique(W.nonzero()[0])
+    if rows.size == 0:
+        return 0, 0
+    return int(rows[0]), int(rows[-1]) + 1
+
+def bandGroups(windows, max_width):
+    """
+    Groups of bands whose union of spectral windows can be read at once.
+    Bands are grouped in order of their window start while the union
+    stays within max_width samples (a single band is never split).
+    :param windows: list of (i0, i1) per band
+    :param max_width: maximum width of the union of a group [samples]
+    :return: list of (i0, i1, list of band indices)
+    """
+    groups = []
+    for iband in sorted(range(len(windows)), key=lambda ib: windows[ib]):
+        i0, i1 = windows[iband]
+        if i1 == i0:
+            continue
+        if groups:
+            g0, g1, members = groups[-1]
+            if max(g1, i1) - g0 <= max_width:
+                groups[-1] = (g0, max(g1, i1), members + [iband])
+                continue
+        groups.append((i0, i1, [iband]))
+
+    return groups
+
+def applyOperator(sgm_toa, W, nthreads=1, block_lines=64, max_density=0.1):
+    """
+    Apply the spectral operator to the whole cube in one contraction over
+    the wavelength support. Optionally threaded across ALT blocks
+    (the matrix products release the GIL).
+    The operator is applied as a dense matrix over its support window, or as a
+    sparse matrix when many narrow bands only fill a small part of that window.
+    :param sgm_toa: TOA cube (ALT x ACT x wavelengths)
+    :param W: sparse operator nwv x nbands
+    :param nthreads: number of threads
+    :param block_lines: number of ALT lines per block
+    :param max_density: maximum fill of the support window for the sparse product
+    :return: TOA of size ALT x ACT x nbands
+    """
+    nalt, nact, nwv = sgm_toa.shape
+    i0, i1 = supportWindow(W)
+    Wsup = W[i0:i1, :].tocsc()
+    nbands = Wsup.shape[1]
+
+    toa = np.zeros((nalt, nact, nbands))
+    if i1 == i0:
+        return toa
+
+    sparse = nbands > 1 and Wsup.nnz < max_density * Wsup.shape[0] * nbands
+    if not sparse:
+        Wsup = Wsup.toarray()
+
+    def work(ialt):
+        block = sgm_toa[ialt:ialt + block_lines, :, i0:i1]
+        if sparse:
+            nlines = block.shape[0]
+            toa[ialt:ialt + nlines] = (block.reshape(-1, i1 - i0) @ Wsup).reshape(nlines, nact, nbands)
+        else:
+            np.matmul(block, Wsup, out=toa[ialt:ialt + block_lines])
+
+    starts = range(0, nalt, block_lines)
+    if nthreads > 1:
+        with ThreadPoolExecutor(max_workers=nthreads) as pool:
+            list(pool.map(work, starts))
+    else:
+        for ialt in starts:
+            work(ialt)
+
+    return toa
+
+def applyColumnOperator(sgm_toa, Wc, nthreads=1, block_lines=64):
+    """
+    Apply an ACT-dependent spectral operator (one set of weights per column)
+    as a batched contraction over the wavelength support
+    :param sgm_toa: TOA cube (ALT x ACT x wavelengths)
+    :param Wc: sparse operator ncolumns x nwv
+    :param nthreads: number of threads
+    :param block_lines: number of ALT lines per block
+    :return: TOA of size ALT x ACT
+    """
+    nalt, nact, nwv = sgm_toa.shape
+    if Wc.shape[0] != nact:
+        raise Exception('ISRF columns ' + str(Wc.shape[0]) + ' do not match the ACT columns ' + str(nact))
+    i0, i1 = supportWindow(Wc.T)
+    Wd = Wc[:, i0:i1].toarray()
+
+    toa = np.zeros((nalt, nact))
+    if i1 == i0:
+        return toa
+
+    def work(ialt):
+        block = sgm_toa[ialt:ialt + block_lines, :, i0:i1]
+        toa[ialt:ialt + block_lines] = np.einsum('acw,cw->ac', block, Wd)
+
+    starts = range(0, nalt, block_lines)
+    if nthreads > 1:
+        with ThreadPoolExecutor(max_workers=nthreads) as pool:
+            list(pool.map(work, starts))
+    else:
+        for ialt in starts:
+            work(ialt)
+
+    return toa
+
+def applyOperatorPca(cube, W):
+    """
+    Apply the spectral operator in the PCA-compressed domain:
+    (mean + scores @ basis) @ W = mean @ W + scores @ (basis @ W)
+    :param cube: pcaCube
+    :param W: sparse operator nwv x nbands
+    :return: TOA of size ALT x ACT x nbands
+    """
+    Wb = np.asarray((W.T @ cube.basis.T).T) # components x nbands
+    Wm = np.asarray(W.T @ cube.mean).ravel() # nbands
+
+    return cube.scores @ Wb + Wm
+
+def applyColumnOperatorPca(cube, Wc):
+    """
+    Apply an ACT-dependent spectral operator in the PCA-compressed domain
+    :param cube: pcaCube
+    :param Wc: sparse operator ncolumns x nwv
+    :return: TOA of size ALT x ACT
+    """
+    Wb = np.asarray(Wc @ cube.basis.T) # ncolumns x components
+    Wm = np.asarray(Wc @ cube.mean).ravel() # ncolumns
+
+    return np.einsum('ack,ck->ac', cube.scores, Wb) + Wm
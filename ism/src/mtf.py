@@ -5,19 +5,29 @@ from numpy.ma.core import sctype
 from scipy.stats import cosine
 
 from config.ismConfig import ismConfig
+from config.globalConfig import globalConfig
 import numpy as np
 import math
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from scipy.special import j1
 from numpy.matlib import repmat
 from common.io.readMat import writeMat
 from common.io.mkdirOutputdir import mkdirOutputdir
 from common.plot.plotMat2D import plotMat2D
+from common.plot.plotDispatch import plotMode, submitPlot, PLOT_FULL, PLOT_QUICKLOOK
+from common.plot.quicklook import quicklookLines
 from scipy.interpolate import interp2d
 from numpy.fft import fftshift, ifft2
 import os
 from netCDF4 import Dataset
-
+from collections import OrderedDict
+import threading
+from common.io.mtfProduct import writeMtf
+from common.io.asyncWriter import asyncWriter
+from common.io.mtfCache import mtfCacheKey, readMtfCache, writeMtfCache
+from common.io.ncLock import ncLocked
+
+@ncLocked
 def writeArray(outputdir, name, array):
 
     # Check output directory
@@ -45,18 +55,58 @@ def writeArray(outputdir, name, array):
 
     print("Finished writting: " + savetostr)
 
+# Curves of the plots of the MTF
+MTF_PLOT_LABELS = ['Hdiff', 'Hdefoc', 'Hwfe', 'Hdet', 'Hsmear', 'Hmotion', 'Hsys']
+MTF_PLOT_COLOURS = ['r', 'g', 'b', 'k', 'y', 'r', 'g']
+
+def figureMtf(x, curves, title, savestr):
+    """
+    Figure of a cut of the system MTF and its contributors
+    :param x: spatial frequencies [-]
+    :param curves: MTFs along the cut, in the order of MTF_PLOT_LABELS
+    :param title: title
+    :param savestr: file name
+    :return: N/A
+    """
+    fig = Figure()
+    ax = fig.subplots()
+    fig.suptitle(title)
+    for y, colour, label in zip(curves, MTF_PLOT_COLOURS, MTF_PLOT_LABELS):
+        ax.plot(x, y, colour, label=label)
+    ax.legend(loc='lower left')
+    ax.set_xlabel('Spatial Frequencies [-]')
+    ax.set_ylabel('MTF')
+    ax.grid(True)
+    fig.savefig(savestr)
+
+# Number of elements of the blocks in which the system MTF is built
+MTF_BLOCK_SIZE = 1 << 16
+
+# In-memory cache of system MTFs (most recently used last), shared by all the mtf objects
+_mtfCache = OrderedDict()
+_mtfCacheLock = threading.Lock()
+
 class mtf:
     """
     Class MTF. Collects the analytical modelling of the different contributions
     for the system MTF
     """
-    def __init__(self, logger, outdir):
+    def __init__(self, logger, outdir, cachedir=None, writer=None):
+        """
+        :param logger: logger
+        :param outdir: output directory
+        :param cachedir: directory of the on-disk MTF cache (None to disable it)
+        :param writer: writer of the outputs (e.g. of the calling module, which flushes it). None: synchronous writes
+        """
         self.ismConfig = ismConfig()
+        self.globalConfig = globalConfig()
         self.logger = logger
         self.outdir = outdir
+        self.cachedir = cachedir
+        self.writer = asyncWriter(0) if writer is None else writer
 
     def system_mtf(self, nlines, ncolumns, D, lambd, focal, pix_size,
-                   kLF, wLF, kHF, wHF, defocus, ksmear, kmotion, directory, band):
+                   kLF, wLF, kHF, wHF, defocus, ksmear, kmotion, directory, band, save=True, cache=True):
         """
         System MTF
         :param nlines: Lines of the TOA
@@ -73,91 +123,173 @@ class mtf:
         :param ksmear: Amplitude of low-frequency component for the motion smear MTF in ALT [pixels]
         :param kmotion: Amplitude of high-frequency component for the motion smear MTF in ALT and ACT
         :param directory: output directory
+        :param save: plots and outputs (if ismConfig.save_mtfs). Off for partial MTFs (e.g. the field tiles)
+        :param cache: use and fill the in-memory and on-disk caches. Off for MTFs used once (e.g. the field tiles),
+                      which would evict the band MTFs
         :return: mtf
         """
 
         self.logger.info("Calculation of the System MTF")
 
-        # Calculate the 2D relative frequencies
-        self.logger.debug("Calculation of 2D relative frequencies")
-        fn2D, fr2D, fnAct, fnAlt = self.freq2d(nlines, ncolumns, D, lambd, focal, pix_size)
+        # The MTF only depends on the image shape, the wavelength and the optics parameters
+        key = mtfCacheKey(nlines, ncolumns, D, lambd, focal, pix_size,
+                          kLF, wLF, kHF, wHF, defocus, ksmear, kmotion)
+
+        Hsys = self.cachedMtf(key) if cache else None
+        if Hsys is None:
+            Hsys = self.buildMtf(nlines, ncolumns, D, lambd, focal, pix_size,
+                                 kLF, wLF, kHF, wHF, defocus, ksmear, kmotion)
+            if cache:
+                self.storeMtf(key, Hsys)
 
-        # Diffraction MTF
-        self.logger.debug("Calculation of the diffraction MTF")
-        Hdiff = self.mtfDiffract(fr2D)
+        # Plots and outputs, only if requested
+        if save and self.ismConfig.save_mtfs:
+            fnAlt, fnAct, frAlt, frAct = self.freq1d(nlines, ncolumns, D, lambd, focal, pix_size)
 
-        # Defocus
-        Hdefoc = self.mtfDefocus(fr2D, defocus, focal, D)
+            # Full 2D contributors, only for the plots and outputs
+            H = self.contributors(fnAlt, fnAct, frAlt, frAct,
+                                  D, lambd, focal, kLF, wLF, kHF, wHF, defocus, ksmear, kmotion)
+            H['Hsys'] = Hsys
 
-        # WFE Aberrations
-        Hwfe = self.mtfWfeAberrations(fr2D, lambd, kLF, wLF, kHF, wHF)
+            # Plot cuts ACT/ALT of the MTF
+            self.plotMtf(H['Hdiff'], H['Hdefoc'], H['Hwfe'], H['Hdet'], H['Hsmear'], H['Hmotion'], Hsys,
+                         nlines, ncolumns, fnAct, fnAlt, directory, band)
 
-        # Detector
-        Hdet  = self. mtfDetector(fn2D)
+            self.writer.submit(writeMtf, self.outdir, self.globalConfig.ism_mtf + band, H, fnAct, fnAlt)
 
-        # Smearing MTF
-        Hsmear = self.mtfSmearing(fnAlt, ncolumns, ksmear)
+        return Hsys
 
-        # Motion blur MTF
-        Hmotion = self.mtfMotion(fn2D, kmotion)
+    def buildMtf(self, nlines, ncolumns, D, lambd, focal, pix_size,
+                 kLF, wLF, kHF, wHF, defocus, ksmear, kmotion):
+        """
+        System MTF, product of the six contributors (see system_mtf for the parameters)
+        :return: Hsys
+        """
+        # 1D relative frequencies. The 2D frequencies are only built by broadcasting, per block of lines
+        self.logger.debug("Calculation of 1D relative frequencies")
+        fnAlt, fnAct, frAlt, frAct = self.freq1d(nlines, ncolumns, D, lambd, focal, pix_size)
 
         # Calculate the System MTF
+        # Multiplication of the six contributors directly into the output, one block of ALT lines at a time
         self.logger.debug("Calculation of the Sysmtem MTF by multiplying the different contributors")
-        # Hsys = 1 # dummy
-        Hsys = Hdiff * Hdefoc * Hwfe * Hdet * Hsmear * Hmotion
-
-        # Plot cuts ACT/ALT of the MTF
-        self.plotMtf(Hdiff, Hdefoc, Hwfe, Hdet, Hsmear, Hmotion, Hsys, nlines, ncolumns, fnAct, fnAlt, directory, band)
-
-        writeMat(self.outdir, 'Hdiff_' + band, Hdiff)
-        writeMat(self.outdir, 'Hdefoc_' + band, Hdefoc)
-        writeMat(self.outdir, 'Hwfe_' + band, Hwfe)
-        writeMat(self.outdir, 'Hdet_' + band, Hdet)
-        writeMat(self.outdir, 'Hsmear_' + band, Hsmear)
-        writeMat(self.outdir, 'Hmotion_' + band, Hmotion)
-        writeMat(self.outdir, 'Hsys_' + band, Hsys)
-        writeArray(self.outdir, 'fnAct_' + band, fnAct)
-        writeArray(self.outdir, 'fnAlt_' + band, fnAlt)
+        Hsys = np.empty((nlines, ncolumns))
+        block = max(1, MTF_BLOCK_SIZE // ncolumns)
+        for ialt in range(0, nlines, block):
+            lines = slice(ialt, ialt + block)
+            H = self.contributors(fnAlt[lines], fnAct, frAlt[lines], frAct,
+                                  D, lambd, focal, kLF, wLF, kHF, wHF, defocus, ksmear, kmotion)
+            out = Hsys[lines]
+            np.multiply(H['Hdiff'], H['Hdefoc'], out=out)
+            out *= H['Hwfe']
+            out *= H['Hdet']
+            out *= H['Hsmear']
+            out *= H['Hmotion']
 
         return Hsys
 
-    def freq2d(self,nlines, ncolumns, D, lambd, focal, w):
+    def cachedMtf(self, key):
         """
-        Calculate the relative frequencies 2D (for the diffraction MTF)
+        System MTF from the in-memory cache, or from the on-disk cache
+        :param key: key of the MTF (see mtfCacheKey)
+        :return: Hsys (read-only), or None if not cached
+        """
+        with _mtfCacheLock:
+            if key in _mtfCache:
+                _mtfCache.move_to_end(key)
+                self.logger.debug("System MTF taken from the memory cache")
+                return _mtfCache[key]
+
+        if self.cachedir is None or not self.ismConfig.mtf_disk_cache:
+            return None
+
+        Hsys = readMtfCache(self.cachedir, key)
+        if Hsys is not None:
+            self.logger.debug("System MTF taken from the disk cache")
+            self.storeMtf(key, Hsys, disk=False)
+        return Hsys
+
+    def storeMtf(self, key, Hsys, disk=True):
+        """
+        Keep a system MTF in the in-memory cache (and on disk)
+        :param key: key of the MTF (see mtfCacheKey)
+        :param Hsys: system MTF. Made read-only, as it is shared
+        :param disk: also write it to the on-disk cache
+        :return: NA
+        """
+        Hsys.setflags(write=False)
+        with _mtfCacheLock:
+            _mtfCache[key] = Hsys
+            while len(_mtfCache) > self.ismConfig.mtf_cache_size:
+                _mtfCache.popitem(last=False)
+
+        if disk and self.cachedir is not None and self.ismConfig.mtf_disk_cache:
+            writeMtfCache(self.cachedir, key, Hsys, self.ismConfig.mtf_disk_cache_mb * 2 ** 20)
+
+    def contributors(self, fnAlt, fnAct, frAlt, frAct, D, lambd, focal, kLF, wLF, kHF, wHF, defocus, ksmear, kmotion):
+        """
+        MTF contributors on the 2D grid of the given 1D ALT and ACT frequencies
+        :param fnAlt: 1D normalised frequencies ALT (f/(1/w))
+        :param fnAct: 1D normalised frequencies ACT (f/(1/w))
+        :param frAlt: 1D relative frequencies ALT (f/fc)
+        :param frAct: 1D relative frequencies ACT (f/fc)
+        :return: dictionary with Hdiff, Hdefoc, Hwfe, Hdet, Hsmear, Hmotion
+        """
+        fn2D = np.sqrt(fnAlt[:, None] * fnAlt[:, None] + fnAct[None, :] * fnAct[None, :])
+        fr2D = np.sqrt(frAlt[:, None] * frAlt[:, None] + frAct[None, :] * frAct[None, :])
+
+        return {'Hdiff': self.mtfDiffract(fr2D),
+                'Hdefoc': self.mtfDefocus(fr2D, defocus, focal, D),
+                'Hwfe': self.mtfWfeAberrations(fr2D, lambd, kLF, wLF, kHF, wHF),
+                'Hdet': self.mtfDetector(fn2D),
+                'Hsmear': self.mtfSmearing(fnAlt, fnAct.shape[0], ksmear),
+                'Hmotion': self.mtfMotion(fn2D, kmotion)}
+
+    def freq1d(self, nlines, ncolumns, D, lambd, focal, w):
+        """
+        Calculate the 1D normalised and relative frequencies ALT and ACT
         :param nlines: Lines of the TOA
         :param ncolumns: Columns of the TOA
         :param D: Telescope diameter [m]
         :param lambd: central wavelength of the band [m]
         :param focal: focal length [m]
         :param w: pixel size in meters [m]
-        :return fn2D: normalised frequencies 2D (f/(1/w))
-        :return fr2D: relative frequencies 2D (f/(1/fc))
-        :return fnAct: 1D normalised frequencies 2D ACT (f/(1/w))
-        :return fnAlt: 1D normalised frequencies 2D ALT (f/(1/w))
+        :return fnAlt: 1D normalised frequencies ALT (f/(1/w))
+        :return fnAct: 1D normalised frequencies ACT (f/(1/w))
+        :return frAlt: 1D relative frequencies ALT (f/fc)
+        :return frAct: 1D relative frequencies ACT (f/fc)
         """
-        #TODO
-
         eps = 10**(-8)
         fstepAlt = 1 / nlines / w
         fstepAct = 1 / ncolumns / w
         fAlt = np.arange(-1 / (2 * w), 1 / (2 * w) - eps, fstepAlt)
         fAct = np.arange(-1 / (2 * w), 1 / (2 * w) - eps, fstepAct)
 
-        # We work with nomralized frequencies
-        # compute the cut of freq
+        # cut-off frequency of the optics
         fco = D / (lambd * focal)
 
-        # compute teh realtive freqnecies
-        fr_Alt = fAlt / fco
-        fr_Act = fAct / fco
-        fn_Alt = fAlt / (1/w)
-        fn_Act = fAct / (1/w)
+        return fAlt / (1/w), fAct / (1/w), fAlt / fco, fAct / fco
+
+    def freq2d(self,nlines, ncolumns, D, lambd, focal, w):
+        """
+        Calculate the relative frequencies 2D (for the diffraction MTF)
+        :param nlines: Lines of the TOA
+        :param ncolumns: Columns of the TOA
+        :param D: Telescope diameter [m]
+        :param lambd: central wavelength of the band [m]
+        :param focal: focal length [m]
+        :param w: pixel size in meters [m]
+        :return fn2D: normalised frequencies 2D (f/(1/w))
+        :return fr2D: relative frequencies 2D (f/(1/fc))
+        :return fnAct: 1D normalised frequencies 2D ACT (f/(1/w))
+        :return fnAlt: 1D normalised frequencies 2D ALT (f/(1/w))
+        """
+        #TODO
 
-        [fnAltxx, fnActxx] = np.meshgrid(fn_Alt, fn_Act,indexing='ij')  # Please use ‘ij’ indexing or you will get the transpose
-        fn2D = np.sqrt(fnAltxx * fnAltxx + fnActxx * fnActxx)
+        fn_Alt, fn_Act, fr_Alt, fr_Act = self.freq1d(nlines, ncolumns, D, lambd, focal, w)
 
-        [frAltxx, frActxx] = np.meshgrid(fr_Alt, fr_Act,indexing='ij')  # Please use ‘ij’ indexing or you will get the transpose
-        fr2D = np.sqrt(frAltxx * frAltxx + frActxx * frActxx)
+        # 2D grids by broadcasting the ALT column against the ACT row ('ij' indexing)
+        fn2D = np.sqrt(fn_Alt[:, None] * fn_Alt[:, None] + fn_Act[None, :] * fn_Act[None, :])
+        fr2D = np.sqrt(fr_Alt[:, None] * fr_Alt[:, None] + fr_Act[None, :] * fr_Act[None, :])
 
         return fn2D, fr2D, fn_Act, fn_Alt
 
@@ -169,14 +301,10 @@ class mtf:
         """
         #TODO
 
-        Hdiff = np.zeros((fr2D.shape[0], fr2D.shape[1]))
-        for i in range(fr2D.shape[0]):
-            for j in range(fr2D.shape[1]):
-                if fr2D[i, j] < 1:
-                    Hdiff[i, j] = 2 / np.pi * (
-                                np.arccos(fr2D[i, j]) - fr2D[i, j] * np.sqrt((1 - (fr2D[i, j]) * fr2D[i, j])))
-                else:
-                    Hdiff[i,j]=0.
+        # Beyond the cut-off (fr >= 1) the expression is 0: clipping fr to 1 gives exactly 0 there
+        fr = np.minimum(fr2D, 1.)
+        Hdiff = 2 / np.pi * (np.arccos(fr) - fr * np.sqrt(1 - fr * fr))
+
         return Hdiff
 
 
@@ -192,7 +320,8 @@ class mtf:
         #TODO
 
         x = np.pi *  defocus * fr2D * (1 - fr2D)
-        Hdefoc = 2 * j1(x) /x
+        # 2 J1(x)/x tends to 1 for x = 0
+        Hdefoc = np.divide(2 * j1(x), x, out=np.ones_like(x), where=(x != 0))
 
         return Hdefoc
 
@@ -236,7 +365,8 @@ class mtf:
         #TODO
 
         Hsmear_1 = np.sinc(ksmear * fnAlt)
-        Hsmear = np.tile(Hsmear_1.reshape(-1, 1),  ncolumns)  # usar reshape con 1 y -1 o el traspose
+        # Constant ACT: read-only broadcast view of the ALT column, no full-size copy
+        Hsmear = np.broadcast_to(Hsmear_1.reshape(-1, 1), (Hsmear_1.shape[0], ncolumns))
 
         return Hsmear
 
@@ -275,52 +405,18 @@ class mtf:
 
         halfAct = int(np.floor(fnAct.shape[0] / 2))
         halfAlt = int(np.floor(fnAlt.shape[0] / 2))
-        fig, ax = plt.subplots()
-        plt.suptitle('Alt = ' + str(halfAlt) + ' for ' + band)
-        x_1 = fnAct[halfAct:]
-        y_1 = Hdiff[halfAlt, halfAct:]
-        y_2 = Hdefoc[halfAlt, halfAct:]
-        y_3 = Hwfe[halfAlt, halfAct:]
-        y_4 = Hdet[halfAlt, halfAct:]
-        y_5 = Hsmear[halfAlt, halfAct:]
-        y_6 = Hmotion[halfAlt, halfAct:]
-        y_7 = Hsys[halfAlt, halfAct:]
-        ax.plot(x_1, y_1, 'r', label='Hdiff')
-        ax.plot(x_1, y_2, 'g', label='Hdefoc')
-        ax.plot(x_1, y_3, 'b', label='Hwfe')
-        ax.plot(x_1, y_4, 'k', label='Hdet')
-        ax.plot(x_1, y_5, 'y', label='Hsmear')
-        ax.plot(x_1, y_6, 'r', label='Hmotion')
-        ax.plot(x_1, y_7, 'g', label='Hsys')
-        plt.legend(loc='lower left')
-        plt.xlabel('Spatial Frequencies [-]')
-        plt.ylabel('MTF')
-        plt.grid(True)
-        # plt.show()
-        fig.savefig(self.outdir + '/graph_mtf_alt_' + band + '_graph.png')
-
-        fig2, ax2 = plt.subplots()
-        x_2 = fnAlt[halfAlt:]
-        y_1 = Hdiff[halfAlt:, halfAct]
-        y_2 = Hdefoc[halfAlt:, halfAct]
-        y_3 = Hwfe[halfAlt:, halfAct]
-        y_4 = Hdet[halfAlt:, halfAct]
-        y_5 = Hsmear[halfAlt:, halfAct]
-        y_6 = Hmotion[halfAlt:, halfAct]
-        y_7 = Hsys[halfAlt:, halfAct]
-
-        a = 'Act = ' + str(halfAct) + ' for ' + band
-        plt.suptitle(a)
-        plt.grid(True)
-        plt.xlabel('Spatial Frequencies [-]')
-        plt.ylabel('MTF')
-        ax2.plot(x_2, y_1, 'r', label='Hdiff')
-        ax2.plot(x_2, y_2, 'g', label='Hdefoc')
-        ax2.plot(x_2, y_3, 'b', label='Hwfe')
-        ax2.plot(x_2, y_4, 'k', label='Hdet')
-        ax2.plot(x_2, y_5, 'y', label='Hsmear')
-        ax2.plot(x_2, y_6, 'r', label='Hmotion')
-        ax2.plot(x_2, y_7, 'g', label='Hsys')
-        plt.legend(loc='lower left')
-        # plt.show()
-        fig2.savefig(self.outdir + '/graph_mtf_act_' + band + '_graph.png')
\ No newline at end of file
+        H = [Hdiff, Hdefoc, Hwfe, Hdet, Hsmear, Hmotion, Hsys]
+
+        # Cut ACT (at the centre ALT) and cut ALT (at the centre ACT)
+        cuts = [('Alt = ' + str(halfAlt) + ' for ' + band, fnAct[halfAct:],
+                 [Hi[halfAlt, halfAct:] for Hi in H], self.outdir + '/graph_mtf_alt_' + band + '_graph.png'),
+                ('Act = ' + str(halfAct) + ' for ' + band, fnAlt[halfAlt:],
+                 [Hi[halfAlt:, halfAct] for Hi in H], self.outdir + '/graph_mtf_act_' + band + '_graph.png')]
+
+        # Full figure, quicklook or nothing, following globalConfig.plot_mode
+        mode = plotMode()
+        for title, x, curves, savestr in cuts:
+            if mode == PLOT_QUICKLOOK:
+                submitPlot(quicklookLines, x, curves, savestr, MTF_PLOT_COLOURS)
+            elif mode == PLOT_FULL:
+                submitPlot(figureMtf, x, curves, title, savestr)
\ No newline at end of file
@@ -0,0 +1,105 @@
+
+# MTF TRADE-SPACE EXPLORER
+# Batched evaluation of the system MTF and its contributors (same models as mtf.system_mtf)
+# for many combinations of the optical design parameters at a few frequencies: the
+# parameters are broadcast as columns (points x 1) against the frequencies as a row
+# (1 x frequencies), so each contributor is a single vectorised call per block of points.
+
+import numpy as np
+from ism.src.mtf import mtf
+
+# Parameters of the system MTF (names as in mtf.system_mtf)
+MTF_PARAMS = ['D', 'lambd', 'focal', 'pix_size', 'kLF', 'wLF', 'kHF', 'wHF', 'defocus', 'ksmear', 'kmotion']
+
+# Contributors evaluated by the explorer, in the order they are multiplied
+EXPLORER_MAPS = ['Hdiff', 'Hdefoc', 'Hwfe', 'Hdet', 'Hsmear', 'Hmotion', 'Hsys']
+
+def parameterGrid(**values):
+    """
+    Cartesian product of the values of the parameters
+    :param values: parameter name = scalar or 1D array of values
+    :return: dictionary parameter name -> 1D array with one value per point of the grid
+    """
+    names = list(values)
+    grids = np.meshgrid(*[np.atleast_1d(np.asarray(values[name], dtype=float)) for name in names], indexing='ij')
+    return {name: grid.ravel() for name, grid in zip(names, grids)}
+
+def defaultParameters(ismConfig, lambd):
+    """
+    Parameters of the system MTF of the ISM configuration
+    :param ismConfig: ISM configuration
+    :param lambd: central wavelength of the band [m]
+    :return: dictionary parameter name -> value
+    """
+    params = {name: getattr(ismConfig, name) for name in MTF_PARAMS if hasattr(ismConfig, name)}
+    params['lambd'] = lambd
+    params['focal'] = ismConfig.f
+    return params
+
+class mtfExplorer:
+
+    def __init__(self, logger, block_points=4096):
+        """
+        :param logger: logger
+        :param block_points: parameter combinations evaluated per vectorised call
+        """
+        self.logger = logger
+        self.block_points = block_points
+        self.myMtf = mtf(logger, None)
+
+    def evaluate(self, params, fnAlt, fnAct):
+        """
+        MTF contributors and system MTF for every parameter combination at every frequency
+        :param params: dictionary parameter name (MTF_PARAMS) -> scalar or 1D array (one value per point).
+                       Arrays must all have the same length
+        :param fnAlt: normalised frequencies ALT (f/(1/w)) of the evaluation points
+        :param fnAct: normalised frequencies ACT (f/(1/w)) of the evaluation points (same length as fnAlt)
+        :return: dictionary with the 2D MTFs (see EXPLORER_MAPS), of size points x frequencies
+        """
+        missing = [name for name in MTF_PARAMS if name not in params]
+        if missing:
+            raise Exception('Missing parameters of the system MTF: ' + ', '.join(missing))
+
+        fnAlt = np.atleast_1d(np.asarray(fnAlt, dtype=float))[None, :]
+        fnAct = np.atleast_1d(np.asarray(fnAct, dtype=float))[None, :]
+        if fnAlt.shape != fnAct.shape:
+            raise Exception('Frequencies ALT and ACT of different length')
+        npoints = max(np.size(params[name]) for name in MTF_PARAMS)
+        p = {name: np.broadcast_to(np.asarray(params[name], dtype=float), (npoints,)) for name in MTF_PARAMS}
+
+        self.logger.info("MTF explorer: " + str(npoints) + " points x " + str(fnAlt.shape[1]) + " frequencies")
+        H = {key: np.empty((npoints, fnAlt.shape[1])) for key in EXPLORER_MAPS}
+        for i0 in range(0, npoints, self.block_points):
+            rows = slice(i0, i0 + self.block_points)
+            Hb = self.evaluateBlock({name: p[name][rows, None] for name in MTF_PARAMS}, fnAlt, fnAct)
+            for key in EXPLORER_MAPS:
+                H[key][rows] = Hb[key]
+
+        return H
+
+    def evaluateBlock(self, p, fnAlt, fnAct):
+        """
+        Contributors for a block of parameter combinations (columns) and frequencies (row)
+        :param p: dictionary parameter name -> column of values
+        :param fnAlt: row of normalised frequencies ALT
+        :param fnAct: row of normalised frequencies ACT
+        :return: dictionary with the 2D MTFs (see EXPLORER_MAPS)
+        """
+        fn = np.sqrt(fnAlt * fnAlt + fnAct * fnAct)
+        # Relative frequencies: f/fc, with f = fn/w and fc = D/(lambd*focal)
+        fr = fn / p['pix_size'] * p['lambd'] * p['focal'] / p['D']
+        shape = np.broadcast_shapes(fr.shape, p['ksmear'].shape)
+        # The smearing model takes 1D ALT frequencies: evaluate it on the flattened points
+        fnAltFlat = np.broadcast_to(fnAlt, shape).ravel()
+        ksmearFlat = np.broadcast_to(p['ksmear'], shape).ravel()
+
+        H = {'Hdiff': self.myMtf.mtfDiffract(fr),
+             'Hdefoc': self.myMtf.mtfDefocus(fr, p['defocus'], p['focal'], p['D']),
+             'Hwfe': self.myMtf.mtfWfeAberrations(fr, p['lambd'], p['kLF'], p['wLF'], p['kHF'], p['wHF']),
+             'Hdet': self.myMtf.mtfDetector(fn),
+             'Hsmear': self.myMtf.mtfSmearing(fnAltFlat, 1, ksmearFlat).reshape(shape),
+             'Hmotion': self.myMtf.mtfMotion(fn, p['kmotion'])}
+        H = {key: np.broadcast_to(value, shape) for key, value in H.items()}
+        H['Hsys'] = H['Hdiff'] * H['Hdefoc'] * H['Hwfe'] * H['Hdet'] * H['Hsmear'] * H['Hmotion']
+
+        return H
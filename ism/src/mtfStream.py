@@ -0,0 +1,129 @@
+
+# STREAMING APPLICATION OF THE SYSTEM MTF ALONG TRACK
+# Overlap-save: the ALT dimension is processed in segments of fixed length L that overlap
+# by 2*margin lines. The spatial kernel (PSF) is derived from the system MTF sampled on
+# the segment grid, truncated to +-margin lines ALT and renormalised to unit DC gain, so that
+# the central L-2*margin lines of each segment are an exact linear convolution with the
+# truncated kernel. ACT is filtered as a whole, as in the monolithic application. Memory is
+# bounded by the segment size.
+# The diffraction MTF has a slope at zero frequency, so the PSF has long tails ALT: about
+# 0.12/margin of its energy lies beyond +-margin lines (0.8% at 16 lines). Renormalising keeps
+# the flux (flat scenes and linear ramps are exact); the residual against the monolithic
+# application is the tail energy times the scene contrast at scales longer than the margin
+# (see tailEnergy and ism/test/ism_check_mtf_stream.py).
+
+import numpy as np
+from scipy import fft as sfft
+from ism.src.fftEngine import halfSpectrumMtf
+
+def streamLength(block_lines, margin):
+    """
+    Length of the overlap-save segments: even (the MTF frequency grid then contains
+    the zero frequency) and FFT-friendly
+    :param block_lines: lines of output per segment (minimum)
+    :param margin: overlap margin per side [lines]
+    :return: segment length [lines]
+    """
+    return 2 * sfft.next_fast_len((block_lines + 2 * margin + 1) // 2, real=True)
+
+def tailEnergy(psf, margin):
+    """
+    Fraction of the energy of the PSF beyond +-margin lines ALT
+    :param psf: PSF with the origin in the top left corner (circular, as from the inverse FFT of the MTF)
+    :param margin: margin [lines]
+    :return: energy beyond the margin / total energy
+    """
+    nlines = psf.shape[0]
+    dist = np.minimum(np.arange(nlines), nlines - np.arange(nlines))
+    profile = psf.sum(axis=1)
+    return profile[dist > margin].sum() / profile.sum()
+
+class mtfStream:
+
+    def __init__(self, Hsys, margin, workers=-1, single=False):
+        """
+        :param Hsys: System MTF on the segment grid (streamLength x ncolumns), centred
+        :param margin: overlap margin per side [lines]. Support of the kernel ALT
+        :param workers: threads of scipy.fft
+        :param single: single precision transforms
+        """
+        self.L, self.ncolumns = Hsys.shape
+        self.margin = margin
+        self.workers = workers
+        self.dtype = np.float32 if single else np.float64
+        if self.L <= 2 * margin:
+            raise Exception('Segment of ' + str(self.L) + ' lines too short for a margin of ' + str(margin))
+
+        # Spatial kernel, truncated to +-margin lines ALT and renormalised to unit DC gain
+        psf = sfft.irfft2(halfSpectrumMtf(Hsys), s=Hsys.shape, workers=workers)
+        self.tail = tailEnergy(psf, margin)
+        psf[margin + 1:self.L - margin, :] = 0.
+        psf /= psf.sum()
+        self.K = sfft.rfft2(psf.astype(self.dtype), workers=workers)
+
+    def filterSegment(self, seg):
+        """
+        Circular filtering of one segment (at most L lines). Only the lines
+        [margin, nlines-margin) of the output are valid
+        :param seg: segment of lines
+        :return: filtered segment
+        """
+        nlines = seg.shape[0]
+        GE = sfft.rfft2(np.asarray(seg, dtype=self.dtype), s=(self.L, self.ncolumns), workers=self.workers)
+        GE *= self.K
+        return sfft.irfft2(GE, s=(self.L, self.ncolumns), workers=self.workers, overwrite_x=True)[:nlines]
+
+    def process(self, blocks):
+        """
+        Overlap-save filtering of a strip given as a sequence of blocks of lines
+        (any number of lines per block). The strip ends are mirrored.
+        :param blocks: iterable of 2D arrays (lines x ncolumns)
+        :return: generator of filtered blocks of lines, in order, adding up to the input strip
+        """
+        m = self.margin
+        step = self.L - 2 * m
+        buf = None
+        started = False
+
+        for block in blocks:
+            buf = block if buf is None else np.concatenate((buf, block))
+
+            # Mirror the start of the strip once there are enough lines
+            if not started:
+                if buf.shape[0] < m:
+                    continue
+                buf = np.concatenate((buf[:m][::-1], buf))
+                started = True
+
+            while buf.shape[0] >= self.L:
+                yield self.filterSegment(buf[:self.L])[m:self.L - m]
+                buf = buf[step:]
+
+        if buf is None:
+            return
+
+        # End of the strip
+        if not started:
+            buf = np.pad(buf, ((m, 0), (0, 0)), mode='symmetric')
+        buf = np.pad(buf, ((0, m), (0, 0)), mode='symmetric')
+        while buf.shape[0] > 2 * m:
+            seg = buf[:self.L]
+            yield self.filterSegment(seg)[m:seg.shape[0] - m]
+            buf = buf[step:]
+
+def rechunk(blocks, block_lines):
+    """
+    Regroups a sequence of blocks of lines into blocks of a fixed number of lines
+    (the last one may be shorter)
+    :param blocks: iterable of 2D arrays (lines x ncolumns)
+    :param block_lines: lines per output block
+    :return: generator of blocks of block_lines lines
+    """
+    buf = None
+    for block in blocks:
+        buf = block if buf is None else np.concatenate((buf, block))
+        while buf.shape[0] >= block_lines:
+            yield buf[:block_lines]
+            buf = buf[block_lines:]
+    if buf is not None and buf.shape[0] > 0:
+        yield buf
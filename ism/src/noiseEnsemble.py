@@ -0,0 +1,76 @@
+
+# MONTE CARLO ENSEMBLE OF THE DETECTION AND VIDEO CHAIN PHASES
+# Realisations of the PRNU and DSNU applied to the output of the optical phase (computed once).
+# Each chunk of realisations is one batched computation (realisations x ALT x ACT) of the per-column
+# gain and offset of the fused detection + VCU phases; only per-pixel summaries are kept (streaming
+# mean, standard deviation and quantiles), not the realisations.
+
+from ism.src.detectionVcuPhase import detectionVcuPhase
+import numpy as np
+from common.io.writeToa import writeToa
+from common.src.streamStats import streamMoments, streamQuantile
+
+class noiseEnsemble(detectionVcuPhase):
+
+    def __init__(self, auxdir, indir, outdir):
+        super().__init__(auxdir, indir, outdir)
+
+    def compute(self, toa, band):
+        """
+        Ensemble of the detection and video chain phases
+        :param toa: TOA after the optical phase [mW/m2]
+        :param band: band
+        :return: dictionary with the per-pixel summaries [DN]: 'mean', 'std' and one per percentile ('p5', ...)
+        """
+        nreal = self.ismConfig.ensemble_size
+        chunk = max(1, self.ismConfig.ensemble_chunk)
+        self.logger.info("Noise ensemble of " + str(nreal) + " realisations, in chunks of " + str(chunk))
+
+        moments = streamMoments(toa.shape)
+        quantiles = [streamQuantile(toa.shape, p / 100) for p in self.ismConfig.ensemble_percentiles]
+
+        max_dn = 2 ** self.ismConfig.bit_depth - 1
+        buf = np.empty((min(chunk, nreal),) + toa.shape)
+        for r0 in range(0, nreal, chunk):
+            realisations = range(r0, min(r0 + chunk, nreal))
+            batch = buf[:len(realisations)]
+            self.realisations(toa, band, realisations, max_dn, batch)
+
+            moments.update(batch)
+            for quantile in quantiles:
+                quantile.update(batch)
+
+        summary = {'mean': moments.mean, 'std': moments.std()}
+        for p, quantile in zip(self.ismConfig.ensemble_percentiles, quantiles):
+            summary['p' + str(p)] = quantile.value()
+
+        # Write the summaries
+        # -------------------------------------------------------------------------------
+        for key, value in summary.items():
+            self.writer.submit(writeToa, self.outdir, self.globalConfig.ism_ensemble + key + '_' + band, value)
+
+        return summary
+
+    def realisations(self, toa, band, realisations, max_dn, out):
+        """
+        Batch of realisations of the detection and video chain phases
+        :param toa: TOA after the optical phase [mW/m2]
+        :param band: band
+        :param realisations: indices of the realisations (each has its own random streams)
+        :param max_dn: maximum digital number
+        :param out: output buffer (realisations x ALT x ACT) [DN]
+        :return: out
+        """
+        # Gain and offset per realisation and column
+        gain = np.empty((len(realisations), toa.shape[1]))
+        offset = np.empty((len(realisations), toa.shape[1]))
+        for i, r in enumerate(realisations):
+            gain[i], offset[i] = self.columnAffine(toa.shape[1], band, r)['dn']
+
+        # One broadcast over the realisations
+        np.multiply(toa[None, :, :], gain[:, None, :], out=out)
+        out += offset[:, None, :]
+        np.rint(out, out=out)
+        np.clip(out, 0, max_dn, out=out)
+
+        return out
@@ -6,12 +6,22 @@ from numpy.fft import fftshift, ifft2, fft2
 import numpy as np
 from common.io.writeToa import writeToa
 from common.io.readIsrf import readIsrf
+from common.io.readPsf import readPsf
 from scipy.interpolate import interp1d, interp2d
 from common.plot.plotMat2D import plotMat2D
 from common.plot.plotF import plotF
 from scipy.signal import convolve2d
-from common.src.auxFunc import getIndexBand
-from l1b.test.l1b_test import alt_toa_extractor
+from ism.src.isrfOperator import isrfWeights, weightsOperator, applyOperator, \
+    isrfColumnWeights, smileGrid, applyColumnOperator, applyOperatorPca, applyColumnOperatorPca, \
+    supportWindow, bandGroups
+from common.io.readCube import readCubeInfo, readCubeWindow
+from common.src.pcaCube import pcaCube
+from ism.src.fftEngine import applyMtfFft, paddedShape
+from ism.src.mtfStream import mtfStream, streamLength
+from ism.src.fieldMtf import FIELD_PARAMS, fieldNodes, fieldPosition, applyFieldMtf
+from ism.src.psfConv import psfFromMtf, psfFromProfile, applyPsf, cachedPsf, kernelHalfSize
+from common.io.isrfCache import isrfCacheKey, readIsrfCache, writeIsrfCache
+from common.io.mtfCache import mtfCacheKey
 
 
 class opticalPhase(initIsm):
@@ -34,11 +44,24 @@ class opticalPhase(initIsm):
         self.logger.info("EODP-ALG-ISM-1010: Spectral modelling. ISRF")
         toa = self.spectralIntegration(sgm_toa, sgm_wv, band)
 
+        return self.computeFromIsrf(toa, band)
+
+    def computeFromIsrf(self, toa, band):
+        """
+        Optical phase after the spectral integration: radiance to irradiance
+        conversion and spatial filter (PSF).
+        Used directly when the ISRF of all bands has been applied in one go
+        (see spectralIntegrationBands).
+        :param toa: TOA image 2D in radiances after the ISRF [mW/m2/sr]
+        :param band: band
+        :return: TOA image in irradiances [mW/m2/nm],
+                    with spatial and spectral filter
+        """
         self.logger.debug("TOA [0,0] " +str(toa[0,0]) + " [e-]")
 
         if self.ismConfig.save_after_isrf:
             saveas_str = self.globalConfig.ism_toa_isrf + band
-            writeToa(self.outdir, saveas_str, toa)
+            self.writer.submit(writeToa, self.outdir, saveas_str, toa)
 
         # Radiance to Irradiance conversion
         # -------------------------------------------------------------------------------
@@ -54,15 +77,27 @@ class opticalPhase(initIsm):
         # -------------------------------------------------------------------------------
         # Calculation and application of the system MTF
         self.logger.info("EODP-ALG-ISM-1030: Spatial modelling. PSF/MTF")
-        myMtf = mtf(self.logger, self.outdir)
-        Hsys = myMtf.system_mtf(toa.shape[0], toa.shape[1],
-                                self.ismConfig.D, self.ismConfig.wv[getIndexBand(band)], self.ismConfig.f, self.ismConfig.pix_size,
-                                self.ismConfig.kLF, self.ismConfig.wLF, self.ismConfig.kHF, self.ismConfig.wHF,
-                                self.ismConfig.defocus, self.ismConfig.ksmear, self.ismConfig.kmotion,
-                                self.outdir, band)
-
-        # Apply system MTF
-        toa = self.applySysMtf(toa, Hsys) # always calculated
+        if self.ismConfig.do_psf_conv:
+            # Convolution with the PSF kernel in the spatial domain
+            toa = self.applyPsfConv(toa, band)
+        elif self.ismConfig.mtf_stream:
+            # Overlap-save in blocks of lines ALT (bounded memory)
+            toa = np.concatenate(list(self.streamSysMtf(iter([toa]), toa.shape[1], band)))
+            if self.ismConfig.save_mtfs:
+                # MTF product and plots on the image grid (the filter uses the segment grid)
+                self.systemMtf(toa.shape[0], toa.shape[1], band)
+        elif self.ismConfig.field_mtf:
+            # MTF varying with the field ACT (overlap-add of tiles)
+            toa = self.applyFieldSysMtf(toa, band)
+        else:
+            # With padding, the MTF is computed at the (FFT-friendly) padded size
+            nlines, ncolumns = toa.shape
+            if self.ismConfig.fft_pad:
+                nlines, ncolumns = paddedShape(toa.shape, self.ismConfig.fft_pad_margin)
+            Hsys = self.systemMtf(nlines, ncolumns, band)
+
+            # Apply system MTF
+            toa = self.applySysMtf(toa, Hsys) # always calculated
         self.logger.debug("TOA [0,0] " +str(toa[0,0]) + " [e-]")
 
 
@@ -72,7 +107,7 @@ class opticalPhase(initIsm):
         if self.ismConfig.save_optical_stage:
             saveas_str = self.globalConfig.ism_toa_optical + band
 
-            writeToa(self.outdir, saveas_str, toa)
+            self.writer.submit(writeToa, self.outdir, saveas_str, toa)
 
             title_str = 'TOA after the optical phase [mW/sr/m2]'
             xlabel_str='ACT'
@@ -109,47 +144,313 @@ class opticalPhase(initIsm):
         """
         Application of the system MTF to the TOA
         :param toa: Input TOA image in irradiances [mW/m2]
-        :param Hsys: System MTF
+        :param Hsys: System MTF (of the size of the image, or of the padded image)
         :return: TOA image in irradiances [mW/m2]
         """
         # TODO
 
-        GE = fft2(toa) # image in the frequency domain
-        # fftshift(Hsys) # frequency shifted. Reorders the frequencies to put the value 1 in the first pixel (top left corner)
-
-        toa_ft = np.real(ifft2( GE * fftshift(Hsys)))
+        # Real-to-complex FFTs with the pre-shifted half-spectrum MTF (DC in the top left corner).
+        # If Hsys is larger than the image, the image is mirror-padded to its size
+        toa_ft = applyMtfFft(toa, Hsys,
+                             self.ismConfig.fft_workers,
+                             self.ismConfig.fft_single)
 
         return toa_ft
 
+    def applyPsfConv(self, toa, band):
+        """
+        Application of the PSF by convolution in the spatial domain (see psfConv).
+        The kernel is read from ismConfig.psffile, or derived from the system MTF.
+        :param toa: Input TOA image in irradiances [mW/m2]
+        :param band: band
+        :return: TOA image in irradiances [mW/m2]
+        """
+        if self.ismConfig.psffile is not None:
+            profile = readPsf(self.auxdir + self.ismConfig.psffile)
+            kernel = psfFromProfile(profile, self.ismConfig.kernel_step, self.ismConfig.kernel_half_width)
+        else:
+            # System MTF on a small grid (ismConfig.psf_grid), whatever the size of the image
+            grid = self.ismConfig.psf_grid
+            half_size = kernelHalfSize(self.ismConfig.kernel_half_width)
+            key = (mtfCacheKey(grid, grid, self.ismConfig.D, self.bandRegistry.wv(band), self.ismConfig.f,
+                               self.ismConfig.pix_size, self.ismConfig.kLF, self.ismConfig.wLF, self.ismConfig.kHF,
+                               self.ismConfig.wHF, self.ismConfig.defocus, self.ismConfig.ksmear, self.ismConfig.kmotion),
+                   half_size)
+            kernel = cachedPsf(key, lambda: psfFromMtf(self.systemMtf(grid, grid, band, save=False), half_size))
+
+        return applyPsf(toa, kernel,
+                        self.ismConfig.psf_cost,
+                        self.ismConfig.psf_method,
+                        self.ismConfig.psf_sep_tol,
+                        self.ismConfig.fft_workers)
+
+    def systemMtf(self, nlines, ncolumns, band, save=True):
+        """
+        System MTF of a band for an image (or FFT grid) of nlines x ncolumns
+        :param nlines: lines ALT
+        :param ncolumns: columns ACT
+        :param band: band
+        :param save: plots and outputs of the MTF (see mtf.system_mtf)
+        :return: System MTF, centred
+        """
+        myMtf = mtf(self.logger, self.outdir, self.auxdir + self.ismConfig.mtf_cachedir, self.writer)
+        return myMtf.system_mtf(nlines, ncolumns,
+                                self.ismConfig.D, self.bandRegistry.wv(band), self.ismConfig.f, self.ismConfig.pix_size,
+                                self.ismConfig.kLF, self.ismConfig.wLF, self.ismConfig.kHF, self.ismConfig.wHF,
+                                self.ismConfig.defocus, self.ismConfig.ksmear, self.ismConfig.kmotion,
+                                self.outdir, band, save)
+
+    def applyFieldSysMtf(self, toa, band):
+        """
+        Application of a field-dependent system MTF (see fieldMtf). The parameters
+        in ismConfig.field_params are interpolated linearly at the field position
+        of each tile node; the others are the ones of ismConfig.
+        :param toa: Input TOA image in irradiances [mW/m2]
+        :param band: band
+        :return: TOA image in irradiances [mW/m2]
+        """
+        nlines, ncolumns = toa.shape
+        nodes = fieldNodes(ncolumns, self.ismConfig.field_tile_columns)
+        field = fieldPosition(nodes, ncolumns)
+
+        # Parameters of the MTF at each node
+        params = {}
+        for name in FIELD_PARAMS:
+            params[name] = np.full(nodes.shape, float(getattr(self.ismConfig, name)))
+        for name, values in self.ismConfig.field_params.items():
+            if name not in params:
+                raise Exception('Parameter ' + name + ' of the system MTF cannot depend on the field')
+            params[name] = np.interp(field, self.ismConfig.field_points, values)
+
+        myMtf = mtf(self.logger, self.outdir, self.auxdir + self.ismConfig.mtf_cachedir, self.writer)
+        def mtfFunc(nlines, ncolumns, inode):
+            p = {name: params[name][inode] for name in FIELD_PARAMS}
+            return myMtf.system_mtf(nlines, ncolumns,
+                                    self.ismConfig.D, self.bandRegistry.wv(band), self.ismConfig.f, self.ismConfig.pix_size,
+                                    p['kLF'], p['wLF'], p['kHF'], p['wHF'],
+                                    p['defocus'], p['ksmear'], p['kmotion'],
+                                    self.outdir, band, save=False, cache=False) # one per node and call
+
+        return applyFieldMtf(toa, mtfFunc, nodes,
+                             self.ismConfig.field_margin,
+                             self.ismConfig.field_nthreads,
+                             self.ismConfig.fft_workers,
+                             self.ismConfig.fft_single)
+
+    def streamSysMtf(self, blocks, ncolumns, band):
+        """
+        Streaming application of the system MTF along track (overlap-save).
+        The kernel is derived from the system MTF sampled on the segment grid and
+        renormalised after truncation (see mtfStream); the strip ends are mirrored.
+        The MTF of the segment grid is not written as a product.
+        :param blocks: iterable of blocks of lines of the TOA in irradiances [mW/m2] (lines x ncolumns)
+        :param ncolumns: columns ACT
+        :param band: band
+        :return: generator of filtered blocks of lines
+        """
+        margin = self.ismConfig.stream_margin
+        nlines = streamLength(self.ismConfig.stream_block_lines, margin)
+        Hsys = self.systemMtf(nlines, ncolumns, band, save=False) # segment grid: not a product
+        myStream = mtfStream(Hsys, margin,
+                             self.ismConfig.fft_workers,
+                             self.ismConfig.fft_single)
+        self.logger.info("Overlap-save margin of " + str(margin) + " lines: "
+                         + "{:.2%}".format(myStream.tail) + " of the PSF energy beyond it (kernel renormalised)")
+        return myStream.process(blocks)
+
+    def computeStream(self, blocks, ncolumns, band):
+        """
+        Streaming optical phase after the spectral integration: radiance to irradiance
+        conversion and system MTF by overlap-save (see streamSysMtf), block by block.
+        The intermediate outputs are not written.
+        :param blocks: iterable of blocks of lines of the TOA in radiances after the ISRF [mW/m2/sr]
+        :param ncolumns: columns ACT
+        :param band: band
+        :return: generator of blocks of lines of the TOA in irradiances [mW/m2]
+        """
+        self.logger.info("EODP-ALG-ISM-1020: Radiances to Irradiances")
+        self.logger.info("EODP-ALG-ISM-1030: Spatial modelling. PSF/MTF (overlap-save)")
+        blocks = (self.rad2Irrad(toa, self.ismConfig.D, self.ismConfig.f, self.ismConfig.Tr) for toa in blocks)
+        return self.streamSysMtf(blocks, ncolumns, band)
+
+    def spectralIntegrationStream(self, directory, filename, band, block_lines):
+        """
+        Integration with the ISRF of one band, reading the cube file in blocks of lines ALT
+        and only the wavelengths within the ISRF support of the band
+        :param directory: directory of the input TOA cube
+        :param filename: filename of the input TOA cube
+        :param band: band
+        :param block_lines: lines ALT read at once
+        :return: generator of blocks of lines of the TOA in radiances [mW/m2/sr]
+        """
+        sgm_wv, shape = readCubeInfo(directory, filename)
+
+        if self.ismConfig.isrf_smile:
+            Wc = self.isrfBandColumnWeights(sgm_wv, band, shape[1])
+            i0, i1 = supportWindow(Wc.T)
+            Wc = Wc[:, i0:i1]
+        else:
+            W = weightsOperator(self.isrfBandWeights(sgm_wv, band)).tocsc()
+            i0, i1 = supportWindow(W)
+            W = W[i0:i1]
+
+        for ialt in range(0, shape[0], block_lines):
+            sgm_toa = readCubeWindow(directory, filename, i0, i1, slice(ialt, ialt + block_lines))
+            if self.ismConfig.isrf_smile:
+                yield applyColumnOperator(sgm_toa, Wc,
+                                          self.ismConfig.isrf_nthreads,
+                                          self.ismConfig.isrf_block_lines)
+            else:
+                yield applyOperator(sgm_toa, W,
+                                    self.ismConfig.isrf_nthreads,
+                                    self.ismConfig.isrf_block_lines)[:, :, 0]
+
     def spectralIntegration(self, sgm_toa, sgm_wv, band):
         """
         Integration with the ISRF to retrieve one band
         :param sgm_toa: Spectrally oversampled TOA cube 3D in irradiances [mW/m2]
+                        (or pcaCube, then integrated in the compressed domain)
         :param sgm_wv: wavelengths of the input TOA cube
         :param band: band
         :return: TOA image 2D in radiances [mW/m2]
         """
         # TODO
-        isrf, wv_isrf = readIsrf(self.auxdir + self.ismConfig.isrffile, band)
-        wv_isrf = wv_isrf * 1000 # we want to work in nm
-        nrow_alt, ncol_act, nwvs = sgm_toa.shape
-        isrf_step = wv_isrf[1] - wv_isrf[0] # 0.001  # compute the delta wv from here sgm_wv
-        toa_filtered = np.zeros((nrow_alt, ncol_act))
+        # ACT-dependent ISRF (spectral smile)
+        if self.ismConfig.isrf_smile:
+            Wc = self.isrfBandColumnWeights(sgm_wv, band, sgm_toa.shape[1])
+            if isinstance(sgm_toa, pcaCube):
+                return applyColumnOperatorPca(sgm_toa, Wc)
+            return applyColumnOperator(sgm_toa, Wc,
+                                       self.ismConfig.isrf_nthreads,
+                                       self.ismConfig.isrf_block_lines)
+
+        # The interpolation onto the ISRF grid (Eq. pag 32) and the normalised ISRF
+        # integration (Eq. pag 33) are linear: build the operator once and apply it to the whole cube
+        W = weightsOperator(self.isrfBandWeights(sgm_wv, band))
+        if isinstance(sgm_toa, pcaCube):
+            return applyOperatorPca(sgm_toa, W)[:, :, 0]
+        toa_filtered = applyOperator(sgm_toa, W,
+                                     self.ismConfig.isrf_nthreads,
+                                     self.ismConfig.isrf_block_lines)
+
+        return toa_filtered[:, :, 0]
+
+    def spectralIntegrationBands(self, sgm_toa, sgm_wv, bands):
+        """
+        Integration with the ISRF of several bands in one contraction over the cube,
+        so that a single pass over the input cube feeds every band
+        :param sgm_toa: Spectrally oversampled TOA cube 3D in irradiances [mW/m2]
+                        (or pcaCube, then integrated in the compressed domain)
+        :param sgm_wv: wavelengths of the input TOA cube
+        :param bands: list of bands
+        :return: TOA images in radiances, 3D array ALT x ACT x bands [mW/m2]
+        """
+        # ACT-dependent ISRF (spectral smile). One batched contraction per band over its support
+        if self.ismConfig.isrf_smile:
+            toa_filtered = np.zeros((sgm_toa.shape[0], sgm_toa.shape[1], len(bands)))
+            for iband, band in enumerate(bands):
+                toa_filtered[:, :, iband] = self.spectralIntegration(sgm_toa, sgm_wv, band)
+            return toa_filtered
+
+        W = weightsOperator([self.isrfBandWeights(sgm_wv, band) for band in bands])
+        if isinstance(sgm_toa, pcaCube):
+            return applyOperatorPca(sgm_toa, W)
+        toa_filtered = applyOperator(sgm_toa, W,
+                                     self.ismConfig.isrf_nthreads,
+                                     self.ismConfig.isrf_block_lines)
+
+        return toa_filtered
 
+    def spectralIntegrationFile(self, directory, filename, bands):
+        """
+        Integration with the ISRF of several bands reading from the cube file only
+        the wavelengths within the ISRF support of the bands. Bands with close
+        supports are grouped and their union is read at once (up to
+        ismConfig.isrf_window_max samples), so that memory and disk reads scale
+        with the ISRF support and not with the spectral range of the scene.
+        :param directory: directory of the input TOA cube
+        :param filename: filename of the input TOA cube
+        :param bands: list of bands
+        :return: TOA images in radiances, 3D array ALT x ACT x bands [mW/m2]
+        """
+        sgm_wv, shape = readCubeInfo(directory, filename)
+
+        # Spectral operator of every band
+        if self.ismConfig.isrf_smile:
+            ops = [None] * len(bands)
+            windows = []
+            for iband, band in enumerate(bands):
+                ops[iband] = self.isrfBandColumnWeights(sgm_wv, band, shape[1])
+                windows.append(supportWindow(ops[iband].T))
+        else:
+            W = weightsOperator([self.isrfBandWeights(sgm_wv, band) for band in bands]).tocsc()
+            windows = [supportWindow(W[:, iband]) for iband in range(len(bands))]
+
+        toa_filtered = np.zeros((shape[0], shape[1], len(bands)))
+        for i0, i1, members in bandGroups(windows, self.ismConfig.isrf_window_max):
+
+            sgm_toa = readCubeWindow(directory, filename, i0, i1)
+
+            if self.ismConfig.isrf_smile:
+                for iband in members:
+                    toa_filtered[:, :, iband] = applyColumnOperator(sgm_toa, ops[iband][:, i0:i1],
+                                                                    self.ismConfig.isrf_nthreads,
+                                                                    self.ismConfig.isrf_block_lines)
+            else:
+                toa_filtered[:, :, members] = applyOperator(sgm_toa, W[i0:i1, members],
+                                                            self.ismConfig.isrf_nthreads,
+                                                            self.ismConfig.isrf_block_lines)
+            del sgm_toa
 
-        # Appliying the filter. We normalize it first. Eq. pag 33
-        isfr_int = np.sum(isrf) * isrf_step
-        isfr_norm = isrf / isfr_int
+        return toa_filtered
+
+    def isrfBandWeights(self, sgm_wv, band):
+        """
+        Spectral weights of one band over the input wavelength grid.
+        Taken from the on-disk cache when the ISRF file and the wavelength grid are unchanged.
+        :param sgm_wv: wavelengths of the input TOA cube
+        :param band: band
+        :return: weights, 1D array of the size of sgm_wv
+        """
+        isrfncfile = self.bandRegistry.isrfFile(band)
+        cachedir = self.auxdir + self.ismConfig.isrf_cachedir
+        use_cache = self.ismConfig.isrf_cache and isrfncfile is not None # parametric ISRFs are cheap
 
-        for ialt in range(nrow_alt) :
-            for iact in range(ncol_act):
-                # We compute the TOA Eq. pag 32
-                cs = interp1d(sgm_wv, sgm_toa[ialt, iact, :], fill_value=(0, 0), bounds_error=False)
-                toa_interpolated = cs(wv_isrf) # to do the unit conversion from microns to nanometers
+        if use_cache:
+            key = isrfCacheKey(isrfncfile, sgm_wv)
+            weights = readIsrfCache(cachedir, band, key)
+            if weights is not None:
+                self.logger.debug("ISRF weights for " + band + " taken from the cache")
+                return weights
 
-                # Apply the filter. Pag 32
-                toa_filtered[ialt, iact] = np.sum(toa_interpolated * isfr_norm * isrf_step)
+        isrf, wv_isrf = self.bandRegistry.isrf(band) # [nm]
+        weights = isrfWeights(sgm_wv, wv_isrf, isrf)
 
-        return toa_filtered
+        if use_cache:
+            writeIsrfCache(cachedir, band, key, weights, wv_isrf[1] - wv_isrf[0])
 
+        return weights
 
+    def isrfBandColumnWeights(self, sgm_wv, band, ncolumns):
+        """
+        Spectral weights of one band for every ACT column (spectral smile).
+        Built from a 2D ISRF (columns x wavelengths) when the ISRF file provides one,
+        otherwise from the band ISRF shifted and scaled per column
+        (ismConfig.smile_shift and ismConfig.smile_width).
+        :param sgm_wv: wavelengths of the input TOA cube
+        :param band: band
+        :param ncolumns: number of ACT columns
+        :return: sparse matrix ncolumns x size of sgm_wv
+        """
+        isrf, wv_isrf = self.bandRegistry.isrf(band) # [nm]
+
+        if isrf.ndim == 1:
+            wv_isrf = smileGrid(wv_isrf, isrf,
+                                self.ismConfig.smile_shift,
+                                self.ismConfig.smile_width,
+                                ncolumns)
+        elif isrf.shape[0] != ncolumns:
+            raise Exception('2D ISRF of ' + band + ' has ' + str(isrf.shape[0]) +
+                            ' columns, expected ' + str(ncolumns))
+
+        return isrfColumnWeights(sgm_wv, wv_isrf, isrf)
@@ -0,0 +1,142 @@
+
+# PSF CONVOLUTION ENGINE
+# Spatial-domain application of the PSF. The kernel is derived once from the system MTF
+# (or read from a PSF profile) and the convolution method is chosen from the kernel and
+# image sizes: separable (two 1D passes, rank-1 kernels), direct (2D) or FFT. The image
+# edges wrap around, as in the application of the MTF with FFTs.
+
+import numpy as np
+from scipy import fft as sfft
+from scipy import ndimage
+from collections import OrderedDict
+import threading
+from ism.src.fftEngine import halfSpectrumMtf
+
+# PSF kernels already derived, keyed on the parameters of the system MTF and the kernel size
+_psfCache = OrderedDict()
+_psfCacheLock = threading.Lock()
+PSF_CACHE_SIZE = 8
+
+def kernelHalfSize(half_width):
+    """
+    Half size in pixels of a kernel covering +-half_width pixels (pixel k covers [k-0.5, k+0.5])
+    :param half_width: half-width of the kernel [pixels]
+    :return: half size [pixels] (kernel of 2*half_size+1 pixels per side)
+    """
+    return max(0, int(np.ceil(half_width - 0.5 - 1e-9)))
+
+def psfFromMtf(Hsys, half_size):
+    """
+    PSF kernel from the system MTF: inverse transform, cropped around the centre
+    and normalised to unit sum. The MTF grid sets the period of the PSF: it only
+    needs to be much larger than the kernel, not the size of the image
+    :param Hsys: System MTF, centred (as from mtf.system_mtf)
+    :param half_size: half size of the kernel [pixels] (kernel of 2*half_size+1 pixels per side)
+    :return: PSF kernel, centred
+    """
+    if 2 * half_size + 1 > min(Hsys.shape):
+        raise Exception('PSF kernel of ' + str(2 * half_size + 1) + ' pixels larger than the MTF grid ' + str(Hsys.shape))
+    psf = sfft.irfft2(halfSpectrumMtf(Hsys), s=Hsys.shape)
+    offsets = np.arange(-half_size, half_size + 1)
+    kernel = psf[np.ix_(offsets % Hsys.shape[0], offsets % Hsys.shape[1])]
+    return kernel / kernel.sum()
+
+def cachedPsf(key, build):
+    """
+    PSF kernel from the in-memory cache, built on a miss
+    :param key: hashable key (e.g. parameters of the system MTF and kernel size)
+    :param build: function returning the kernel
+    :return: PSF kernel (read-only)
+    """
+    with _psfCacheLock:
+        if key in _psfCache:
+            _psfCache.move_to_end(key)
+            return _psfCache[key]
+
+    kernel = build()
+    kernel.setflags(write=False)
+
+    with _psfCacheLock:
+        _psfCache[key] = kernel
+        while len(_psfCache) > PSF_CACHE_SIZE:
+            _psfCache.popitem(last=False)
+
+    return kernel
+
+def psfFromProfile(profile, step, half_width):
+    """
+    Separable PSF kernel from a 1D PSF profile sampled finer than the pixel:
+    the profile is truncated to +-half_width and integrated over each pixel
+    :param profile: PSF samples, symmetric around the centre
+    :param step: sampling of the profile [pixels]
+    :param half_width: half-width of the kernel [pixels]
+    :return: PSF kernel, centred
+    """
+    x = (np.arange(len(profile)) - (len(profile) - 1) / 2) * step
+    inside = np.abs(x) <= half_width + 1e-9
+    half_size = kernelHalfSize(half_width)
+    pixel = np.clip(np.rint(x[inside]).astype(int), -half_size, half_size)
+    k1d = np.bincount(pixel + half_size, weights=profile[inside], minlength=2 * half_size + 1)
+    kernel = np.outer(k1d, k1d)
+    return kernel / kernel.sum()
+
+def separableKernel(kernel, tol):
+    """
+    Rank-1 decomposition of the kernel (SVD)
+    :param kernel: PSF kernel
+    :param tol: maximum relative second singular value
+    :return: (kernel ALT, kernel ACT), or None if the kernel is not separable
+    """
+    u, s, vt = np.linalg.svd(kernel)
+    if len(s) > 1 and s[1] > tol * s[0]:
+        return None
+    return u[:, 0] * np.sqrt(s[0]), vt[0] * np.sqrt(s[0])
+
+def convMethod(kshape, shape, separable, cost_model):
+    """
+    Cheapest convolution method for a kernel and an image size
+    :param kshape: kernel shape
+    :param shape: image shape
+    :param separable: the kernel is separable
+    :param cost_model: cost per pixel of each method [ns] (see ismConfig.psf_cost):
+                       'direct' (a, b): a*nk + b, 'separable' (a, b): a*(nk_alt + nk_act) + b, 'fft' a: a*log2(npix)
+    :return: 'separable', 'direct' or 'fft'
+    """
+    npix = shape[0] * shape[1]
+    cost = {'direct': cost_model['direct'][0] * kshape[0] * kshape[1] + cost_model['direct'][1],
+            'fft': cost_model['fft'] * np.log2(npix)}
+    if separable:
+        cost['separable'] = cost_model['separable'][0] * (kshape[0] + kshape[1]) + cost_model['separable'][1]
+    return min(cost, key=cost.get)
+
+def applyPsf(toa, kernel, cost_model, method='auto', sep_tol=1e-3, workers=-1):
+    """
+    Convolution of the image with the PSF (edges wrap around)
+    :param toa: input image
+    :param kernel: PSF kernel, centred, odd size
+    :param cost_model: cost model of the methods for 'auto' (see convMethod and ismConfig.psf_cost)
+    :param method: 'auto', 'separable', 'direct' or 'fft'
+    :param sep_tol: maximum relative second singular value of a separable kernel
+    :param workers: threads of scipy.fft
+    :return: filtered image, same size as toa
+    """
+    sep = separableKernel(kernel, sep_tol) if method in ('auto', 'separable') else None
+    if method == 'auto':
+        method = convMethod(kernel.shape, toa.shape, sep is not None, cost_model)
+    elif method == 'separable' and sep is None:
+        raise Exception('PSF kernel not separable (tolerance ' + str(sep_tol) + ')')
+
+    toa = np.asarray(toa, dtype=float)
+    if method == 'separable':
+        toa_ft = ndimage.convolve1d(toa, sep[0], axis=0, mode='wrap')
+        return ndimage.convolve1d(toa_ft, sep[1], axis=1, mode='wrap')
+    if method == 'direct':
+        return ndimage.convolve(toa, kernel, mode='wrap')
+
+    # Kernel placed circularly around the origin
+    hl, hc = kernel.shape[0] // 2, kernel.shape[1] // 2
+    kpad = np.zeros(toa.shape)
+    np.add.at(kpad, np.ix_(np.arange(-hl, hl + 1) % toa.shape[0], np.arange(-hc, hc + 1) % toa.shape[1]), kernel)
+    GE = sfft.rfft2(toa, workers=workers)
+    GE *= sfft.rfft2(kpad, workers=workers)
+    return sfft.irfft2(GE, s=toa.shape, workers=workers, overwrite_x=True)
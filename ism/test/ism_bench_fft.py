@@ -0,0 +1,67 @@
+#
+# Benchmark of the application of the system MTF
+# Complex fft2/ifft2 in float64 (previous implementation) against the FFT engine
+# (rfft2/irfft2, half-spectrum MTF, scipy.fft workers, optional complex64)
+# Checks that the engine matches the reference for even and odd sizes. Sizes as arguments (default 1024 8192)
+######################################################################################################################
+import sys
+import time
+import logging
+import numpy as np
+from numpy.fft import fftshift, ifft2, fft2
+from config.ismConfig import ismConfig
+from ism.src.mtf import mtf
+from ism.src.fftEngine import applyMtfFft, paddedShape
+
+sizes = [int(s) for s in sys.argv[1:]] or [1024, 8192]
+nrep = 3
+
+cfg = ismConfig()
+cfg.save_mtfs = False
+myMtf = mtf(logging.getLogger('bench'), '.')
+myMtf.ismConfig = cfg
+
+def getMtf(n):
+    return myMtf.system_mtf(n, n, cfg.D, cfg.wv[0], cfg.f, cfg.pix_size,
+                            cfg.kLF, cfg.wLF, cfg.kHF, cfg.wHF, cfg.defocus, cfg.ksmear, cfg.kmotion, '.', 'bench')
+
+def timeit(fun):
+    fun() # warm-up (plans, half-spectrum MTF)
+    t0 = time.perf_counter()
+    for irep in range(nrep):
+        fun()
+    return (time.perf_counter() - t0) / nrep
+
+for n in sizes:
+
+    print("-------------------------------------")
+    print(" -- Image " + str(n) + "x" + str(n))
+
+    toa = np.random.default_rng(0).random((n, n)) * 100
+    Hsys = getMtf(n)
+
+    t_ref = timeit(lambda: np.real(ifft2(fft2(toa) * fftshift(Hsys))))
+    t_r1 = timeit(lambda: applyMtfFft(toa, Hsys, workers=1))
+    t_rn = timeit(lambda: applyMtfFft(toa, Hsys, workers=-1))
+    t_32 = timeit(lambda: applyMtfFft(toa, Hsys, workers=-1, single=True))
+
+    Hpad = getMtf(paddedShape(toa.shape, cfg.fft_pad_margin)[0])
+    t_pad = timeit(lambda: applyMtfFft(toa, Hpad, workers=-1, single=True))
+
+    ref = np.real(ifft2(fft2(toa) * fftshift(Hsys)))
+    err = np.max(np.abs(applyMtfFft(toa, Hsys) - ref) / np.abs(ref))
+    err32 = np.max(np.abs(applyMtfFft(toa, Hsys, single=True) - ref) / np.abs(ref))
+    assert err < 1e-12, 'rfft2 path differs from the fft2 reference: ' + str(err)
+
+    # Odd image size (unpaired Nyquist frequency)
+    toa_odd = toa[:n - 1, :n - 1]
+    Hodd = getMtf(n - 1)
+    ref_odd = np.real(ifft2(fft2(toa_odd) * fftshift(Hodd)))
+    err_odd = np.max(np.abs(applyMtfFft(toa_odd, Hodd) - ref_odd) / np.abs(ref_odd))
+    assert err_odd < 1e-12, 'rfft2 path differs from the fft2 reference (odd size): ' + str(err_odd)
+
+    print(f" -- fft2 complex128 (reference)      {t_ref:8.3f} s")
+    print(f" -- rfft2 float64, 1 worker          {t_r1:8.3f} s  x{t_ref / t_r1:5.1f}   max rel. diff {err:.1e}")
+    print(f" -- rfft2 float64, all workers       {t_rn:8.3f} s  x{t_ref / t_rn:5.1f}")
+    print(f" -- rfft2 float32, all workers       {t_32:8.3f} s  x{t_ref / t_32:5.1f}   max rel. diff {err32:.1e}")
+    print(f" -- rfft2 float32, mirror-padded     {t_pad:8.3f} s  x{t_ref / t_pad:5.1f}")
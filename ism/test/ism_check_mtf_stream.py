@@ -0,0 +1,61 @@
+#
+# Check of the streaming (overlap-save) application of the system MTF against the monolithic one
+# (opticalPhase.applySysMtf, i.e. fftEngine.applyMtfFft on the image grid):
+# - constant image: the stream keeps the flux exactly (kernel renormalised to unit DC gain)
+# - interior rows of long scenes: the residual is bounded by the energy of the PSF beyond the margin
+#   (mtfStream.tail) times the range of the scene
+######################################################################################################################
+import sys
+import logging
+import numpy as np
+from config.ismConfig import ismConfig
+from ism.src.mtf import mtf
+from ism.src.fftEngine import applyMtfFft
+from ism.src.mtfStream import mtfStream, streamLength, rechunk
+
+margins = [int(s) for s in sys.argv[1:]] or [16, 32]
+nlines = 2048
+ncolumns = 150
+block_lines = 64
+ends = 256 # lines excluded at each end of the strip (mirrored in the stream, circular in the monolithic path)
+
+cfg = ismConfig()
+cfg.save_mtfs = False
+myMtf = mtf(logging.getLogger('check'), '.')
+myMtf.ismConfig = cfg
+
+def getMtf(n, m):
+    return myMtf.system_mtf(n, m, cfg.D, cfg.wv[0], cfg.f, cfg.pix_size,
+                            cfg.kLF, cfg.wLF, cfg.kHF, cfg.wHF, cfg.defocus, cfg.ksmear, cfg.kmotion, '.', 'check',
+                            save=False)
+
+def stream(toa, margin):
+    myStream = mtfStream(getMtf(streamLength(cfg.stream_block_lines, margin), toa.shape[1]), margin)
+    return np.concatenate(list(myStream.process(rechunk(iter([toa]), block_lines)))), myStream.tail
+
+rng = np.random.default_rng(0)
+scenes = {'white noise': 1 + rng.random((nlines, ncolumns)),
+          'ALT sine': 1 + 0.5 * np.sin(np.arange(nlines) / 40.)[:, None] + 0.1 * rng.random((nlines, ncolumns))}
+
+for margin in margins:
+
+    print("-------------------------------------")
+    print(" -- Margin " + str(margin) + " lines")
+
+    # Constant image
+    const = np.ones((400, ncolumns))
+    out, tail = stream(const, margin)
+    err = np.max(np.abs(out - applyMtfFft(const, getMtf(*const.shape))))
+    print(f" -- PSF energy beyond the margin     {tail:.2e}")
+    print(f" -- constant image                   max abs diff {err:.1e}")
+    assert err < 1e-12, 'Stream does not keep the flux of a constant image: ' + str(err)
+
+    # Interior rows
+    interior = slice(ends, nlines - ends)
+    for name, toa in scenes.items():
+        ref = applyMtfFft(toa, getMtf(nlines, ncolumns))
+        out = stream(toa, margin)[0]
+        err = np.max(np.abs(out[interior] - ref[interior]))
+        bound = 2 * tail * (toa.max() - toa.min())
+        print(f" -- {name:32s} max abs diff {err:.1e} (bound {bound:.1e})")
+        assert err <= bound, 'Stream differs from the monolithic MTF beyond the tail bound (' + name + '): ' + str(err)
@@ -5,7 +5,7 @@
 # Laboratory 2 - ISM
 ######################################################################################################################
 from common.io.writeToa import readToa
-from common.io.readMat import readMat
+from common.io.mtfProduct import readMtf
 import numpy as np
 import pandas as pd
 from netCDF4 import Dataset
@@ -96,10 +96,13 @@ for band in bands:
     # Create a nested dictionary to store matrices, arrays, and computed values for the current band
     band_results = {}
 
+    # All the MTFs of the band are in one file
+    mtf_product = readMtf(outdir_student_ism_toa_isfr_optical, 'ism_mtf_' + band + '.nc')
+
     # Read matrices and store in the nested dictionary
     for prefix in prefixes:
         # Read matrix for the current prefix and band
-        matrix = readMat(outdir_student_ism_toa_isfr_optical, prefix + band + '.nc')
+        matrix = mtf_product[prefix[:-1]]
         band_results[prefix] = matrix
 
         # Compute nlines_ALT, ACT_central_line, nlines_ACT, and ALT_central_line for the matrix
@@ -116,7 +119,7 @@ for band in bands:
 
     # Read arrays and store in the nested dictionary
     for array in arrays:
-        band_results[array] = readArray(outdir_student_ism_toa_isfr_optical, array + band + '.nc')
+        band_results[array] = mtf_product[array[:-1]]
 
     # Store the results for this band in the main results dictionary
     results[band] = band_results
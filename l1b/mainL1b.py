@@ -9,6 +9,8 @@ indir = r"C:\\Users\\pc\\Desktop\\Earth_Observation_Data_Processing\\EODP_TER_20
 # outdir = r"C:\\Users\\pc\\Desktop\\Earth_Observation_Data_Processing\\EODP_TER_2021\\EODP-TS-L1B\\myoutputs_eq_true"
 outdir = r"C:\\Users\\pc\\Desktop\\Earth_Observation_Data_Processing\\EODP_TER_2021\\EODP-TS-L1B\\myoutputs_eq_false"
 
-# Initialise the ISM
-myL1b = l1b(auxdir, indir, outdir)
-myL1b.processModule()
\ No newline at end of file
+# Worker processes (bands, plots) import this script: run only as the main script
+if __name__ == '__main__':
+    # Initialise the ISM
+    myL1b = l1b(auxdir, indir, outdir)
+    myL1b.processModule()
\ No newline at end of file
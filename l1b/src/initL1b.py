@@ -1,6 +1,8 @@
 
 from config.l1bConfig import l1bConfig
+from config.ismConfig import ismConfig
 from common.src.baseModule import baseModule
+from common.src.bandRegistry import bandRegistry
 from common.io.fileExists import fileExists, addFileSep
 import os
 
@@ -14,5 +16,8 @@ class initL1b(baseModule):
         # Init Local config
         self.l1bConfig = l1bConfig()
 
+        # Band registry (central wavelength, gain and ISRF per band)
+        self.bandRegistry = bandRegistry(self.globalConfig, ismConfig(), self.l1bConfig, self.auxdir)
+
         # Make sure the logger is enabled
         self.logger.disabled = False
@@ -3,11 +3,12 @@
 
 from l1b.src.initL1b import initL1b
 from common.io.writeToa import writeToa, readToa
-from common.src.auxFunc import getIndexBand
 from common.io.readFactor import readFactor, EQ_MULT, EQ_ADD, NC_EXT
+from common.io.readDefectMap import readDefectMap
+from common.src.defectMap import correctDefectMap
 import numpy as np
 import os
-import matplotlib.pyplot as plt
+import sys
 
 class l1b(initL1b):
 
@@ -18,6 +19,12 @@ class l1b(initL1b):
 
         self.logger.info("Start of the L1B Processing Module")
 
+        # Defect map of the detector, written by the ISM
+        if self.l1bConfig.do_defect_correction:
+            defects = readDefectMap(self.indir, self.globalConfig.ism_defect_map)
+            if defects is None:
+                sys.exit('File not found ' + os.path.join(self.indir, self.globalConfig.ism_defect_map) + ". Exiting.")
+
         for band in self.globalConfig.bands:
 
             self.logger.info("Start of BAND " + band)
@@ -37,19 +44,28 @@ class l1b(initL1b):
 
                 # Do the equalization and save to file
                 toa = self.equalization(toa, eq_add, eq_mult)
-                writeToa(self.outdir, self.globalConfig.l1b_toa_eq + band, toa)
+                self.writer.submit(writeToa, self.outdir, self.globalConfig.l1b_toa_eq + band, toa)
+
+            # Bad/dead pixels correction
+            # -------------------------------------------------------------------------------
+            if self.l1bConfig.do_defect_correction:
+                self.logger.info("EODP-ALG-L1B-1015: Bad/dead pixels correction")
+                toa = correctDefectMap(toa, defects[0], defects[1])
 
             # Restitution (absolute radiometric gain)
             # -------------------------------------------------------------------------------
             self.logger.info("EODP-ALG-L1B-1020: Absolute radiometric gain application (restoration)")
-            toa = self.restoration(toa, self.l1bConfig.gain[getIndexBand(band)])
+            toa = self.restoration(toa, self.bandRegistry.gain(band))
 
             # Write output TOA
             # -------------------------------------------------------------------------------
-            writeToa(self.outdir, self.globalConfig.l1b_toa + band, toa)
+            self.writer.submit(writeToa, self.outdir, self.globalConfig.l1b_toa + band, toa)
 
             self.logger.info("End of BAND " + band)
 
+        # Wait for the pending writes
+        self.writer.flush()
+
         self.logger.info("End of the L1B Module!")
 
 
@@ -8,6 +8,8 @@ auxdir = r'C:\\Users\\pc\\Desktop\\Earth_Observation_Data_Processing\\Assignment
 indir = r"C:\\Users\\pc\\Desktop\\Earth_Observation_Data_Processing\\EODP_TER_2021\\EODP-TS-L1C\\input\\gm_alt100_act_150,C:\\Users\\pc\\Desktop\\Earth_Observation_Data_Processing\\EODP_TER_2021\\EODP-TS-L1C\\input\\l1b_output"
 outdir = r"C:\\Users\\pc\\Desktop\\Earth_Observation_Data_Processing\\EODP_TER_2021\\EODP-TS-L1C\\my_output_mgrs"
 
-# Initialise the ISM
-myL1c = l1c(auxdir, indir, outdir)
-myL1c.processModule()
+# Worker processes (bands, plots) import this script: run only as the main script
+if __name__ == '__main__':
+    # Initialise the ISM
+    myL1c = l1c(auxdir, indir, outdir)
+    myL1c.processModule()
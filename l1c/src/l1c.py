@@ -7,9 +7,11 @@ from common.io.readGeodetic import readGeodetic, getCorners
 import mgrs
 import numpy as np
 from scipy.interpolate import bisplrep, bisplev
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from common.io.l1cProduct import writeL1c
-from matplotlib import cm
+from common.plot.plotDispatch import plotMode, submitPlot, flushPlots, PLOT_FULL, PLOT_QUICKLOOK
+from common.plot.quicklook import scatterRaster, quicklookImage, QL_BACKGROUND
+import matplotlib
 
 class l1c(initL1c):
 
@@ -36,13 +38,17 @@ class l1c(initL1c):
 
             # Write output TOA
             # -------------------------------------------------------------------------------
-            writeL1c(self.outdir, self.globalConfig.l1c_toa + band, lat_l1c, lon_l1c, toa_l1c)
+            self.writer.submit(writeL1c, self.outdir, self.globalConfig.l1c_toa + band, lat_l1c, lon_l1c, toa_l1c)
 
             # Plot results
             self.plotL1cToa(lat_l1c, lon_l1c, toa_l1c, band)
 
             self.logger.info("End of BAND " + band)
 
+        # Wait for the pending writes and plots
+        self.writer.flush()
+        flushPlots()
+
         self.logger.info("End of the L1C Module!")
 
 
@@ -101,19 +107,31 @@ class l1c(initL1c):
             print("Warning, size not matching (input radiances and geodetic coordinates)")
 
     def plotL1cToa(self, lat_l1c, lon_l1c, toa_l1c, band):
-        jet = cm.get_cmap('jet', len(lat_l1c))
-        toa_l1c[np.argwhere(toa_l1c < 0)] = 0
-        max_toa = np.max(toa_l1c)
-        # Plot stuff
-        fig = plt.figure(figsize=(20, 10))
-        clr = np.zeros(len(lat_l1c))
-        for ii in range(len(lat_l1c)):
-            clr = jet(toa_l1c[ii] / max_toa)
-            plt.plot(lon_l1c[ii], lat_l1c[ii], '.', color=clr, markersize=10)
-        plt.title('Projection on ground', fontsize=20)
-        plt.xlabel('Longitude [deg]', fontsize=16)
-        plt.ylabel('Latitude [deg]', fontsize=16)
-        plt.grid()
-        plt.axis('equal')
-        plt.savefig(self.outdir + 'toa_' + band + '.png')
-        plt.close(fig)
+        # Full figure, quicklook or nothing, following globalConfig.plot_mode
+        savestr = self.outdir + 'toa_' + band + '.png'
+        mode = plotMode()
+        if mode == PLOT_QUICKLOOK:
+            # Rasterised here, so that only the quicklook size is kept pending or sent to the workers
+            raster = scatterRaster(lon_l1c, lat_l1c, np.maximum(toa_l1c, 0), self.globalConfig.quicklook_size)
+            submitPlot(quicklookImage, raster, savestr, 'jet', QL_BACKGROUND)
+        elif mode == PLOT_FULL:
+            submitPlot(figureL1cToa, lat_l1c, lon_l1c, toa_l1c, savestr)
+
+def figureL1cToa(lat_l1c, lon_l1c, toa_l1c, savestr):
+    jet = matplotlib.colormaps['jet'].resampled(len(lat_l1c))
+    toa_l1c = np.maximum(toa_l1c, 0) # the TOA may be owned by the writer, not modified
+    max_toa = np.max(toa_l1c)
+    # Plot stuff
+    # Figure object, without the global state of pyplot (safe in concurrent modules)
+    fig = Figure(figsize=(20, 10))
+    ax = fig.subplots()
+    clr = np.zeros(len(lat_l1c))
+    for ii in range(len(lat_l1c)):
+        clr = jet(toa_l1c[ii] / max_toa)
+        ax.plot(lon_l1c[ii], lat_l1c[ii], '.', color=clr, markersize=10)
+    ax.set_title('Projection on ground', fontsize=20)
+    ax.set_xlabel('Longitude [deg]', fontsize=16)
+    ax.set_ylabel('Latitude [deg]', fontsize=16)
+    ax.grid()
+    ax.axis('equal')
+    fig.savefig(savestr)